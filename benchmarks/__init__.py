@@ -0,0 +1,13 @@
+"""
+Benchmarks of the hot paths in elderflower, run on synthetic fields.
+
+The benchmark classes follow the asv conventions (``params``, ``setup``,
+``time_*`` and ``peakmem_*`` methods), so they can be collected by asv.
+They can also be run directly, which reports the time and the peak
+memory per call without any extra dependency.
+
+> Example Usage
+python -m benchmarks
+python -m benchmarks -b likelihood --n_repeat 5
+
+"""
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Run the benchmarks without asv and report the time and peak memory per call.
+
+Time is the best of n_repeat calls after one warm-up call. Peak memory
+is the peak of memory allocated during one call traced by tracemalloc
+(arrays allocated by NumPy are included).
+
+> Example Usage
+python -m benchmarks
+python -m benchmarks -b Likelihood --n_repeat 5
+python -m benchmarks -b "MaskStrip|RnormBatch" --quick
+
+"""
+
+import re
+import sys
+import time
+import getopt
+import inspect
+import tracemalloc
+import importlib
+import itertools
+import pkgutil
+
+import benchmarks
+
+def iter_benchmarks(pattern=None):
+    """ Yield (name, class) of benchmark classes matching pattern """
+    for mod_info in pkgutil.iter_modules(benchmarks.__path__):
+        if not mod_info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module('benchmarks.' + mod_info.name)
+        for cls_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            name = mod_info.name + '.' + cls_name
+            if (pattern is None) or re.search(pattern, name):
+                yield name, cls
+
+def time_call(func, n_repeat=3):
+    """ Best time per call in s """
+    func()  # warm up
+    times = []
+    for i in range(n_repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+    return min(times)
+
+def peakmem_call(func):
+    """ Peak memory allocated in one call in bytes """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def run_benchmark(name, cls, n_repeat=3, quick=False):
+    """ Run time_* and peakmem_* methods of cls over its params """
+    params = getattr(cls, 'params', [])
+    param_names = getattr(cls, 'param_names', [])
+
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    if quick:
+        params = [p[:1] for p in params]
+
+    # Pair time_* and peakmem_* methods measuring the same call
+    names = sorted({m.split('_', 1)[1] for m in dir(cls)
+                    if m.startswith(('time_', 'peakmem_'))})
+
+    for p in itertools.product(*params):
+        bench = cls()
+        label = ', '.join(f'{k}={v}' for k, v in zip(param_names, p))
+        try:
+            if hasattr(bench, 'setup'):
+                bench.setup(*p)
+        except NotImplementedError:
+            continue
+
+        for m in names:
+            t, peak = '', ''
+            if hasattr(bench, 'time_' + m):
+                func = getattr(bench, 'time_' + m)
+                t = '{:.4f}'.format(1e3 * time_call(lambda: func(*p), n_repeat))
+            if hasattr(bench, 'peakmem_' + m):
+                func = getattr(bench, 'peakmem_' + m)
+                peak = '{:.2f}'.format(peakmem_call(lambda: func(*p)) / 2**20)
+            print('{:<50s} {:<62s} {:>12s} {:>12s}'.format(name + '.' + m, label, t, peak),
+                  flush=True)
+
+        if hasattr(bench, 'teardown'):
+            bench.teardown(*p)
+
+def main(argv):
+    pattern = None
+    n_repeat = 3
+    quick = False
+
+    try:
+        optlists, args = getopt.getopt(argv, "b:", ["bench=", "n_repeat=", "quick"])
+    except getopt.GetoptError as e:
+        print(e)
+        sys.exit(2)
+
+    for opt, arg in optlists:
+        if opt in ("-b", "--bench"):
+            pattern = arg
+        elif opt == "--n_repeat":
+            n_repeat = int(arg)
+        elif opt == "--quick":
+            quick = True
+
+    print('{:<50s} {:<62s} {:>12s} {:>12s}'.format('benchmark', 'params',
+                                                   'time [ms]', 'peak [MB]'))
+    for name, cls in iter_benchmarks(pattern):
+        run_benchmark(name, cls, n_repeat=n_repeat, quick=quick)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
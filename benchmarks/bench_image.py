@@ -0,0 +1,77 @@
+"""
+Benchmarks of image generation and masking:
+generate_image_by_znorm, make_base_image and make_mask_strip.
+
+"""
+
+from elderflower.modeling import generate_image_by_znorm, make_base_image
+from elderflower.mask import make_mask_strip
+
+from .common import IMAGE_SIZES, STAR_COUNTS, pixel_scale, make_field
+
+
+class GenerateImage:
+    """ Model image of bright stars scaled by z_norm """
+
+    params = [IMAGE_SIZES, STAR_COUNTS, [False, True]]
+    param_names = ['image_size', 'n_star', 'brightest_only']
+
+    def setup(self, image_size, n_star, brightest_only):
+        field = make_field(image_size, n_star)
+        self.psf, self.stars = field['psf'], field['stars']
+        self.xx, self.yy = field['xx'], field['yy']
+        self.brightest_only = brightest_only
+
+    def _generate(self):
+        generate_image_by_znorm(self.psf, self.stars.copy(), self.xx, self.yy,
+                                psf_range=[None, None], psf_scale=pixel_scale,
+                                brightest_only=self.brightest_only,
+                                draw_real=True)
+
+    def time_generate_image_by_znorm(self, *args):
+        self._generate()
+
+    def peakmem_generate_image_by_znorm(self, *args):
+        self._generate()
+
+
+class BaseImage:
+    """ Base image of faint stars drawn with a fixed PSF """
+
+    params = [IMAGE_SIZES, STAR_COUNTS]
+    param_names = ['image_size', 'n_star']
+
+    def setup(self, image_size, n_star):
+        field = make_field(image_size, n_star)
+        psf, self.stars = field['psf'].copy(), field['stars']
+        self.image_shape = field['image'].shape
+
+        psf_e, _ = psf.generate_aureole(psf_range=120, psf_scale=pixel_scale)
+        self.psf_base = (1-psf.frac) * psf.psf_core + psf.frac * psf_e
+        self.psf_size = int(120/pixel_scale)
+
+    def time_make_base_image(self, *args):
+        make_base_image(self.image_shape, self.stars, self.psf_base,
+                        psf_size=self.psf_size)
+
+    def peakmem_make_base_image(self, *args):
+        make_base_image(self.image_shape, self.stars, self.psf_base,
+                        psf_size=self.psf_size)
+
+
+class MaskStrip:
+    """ Strip and cross masks of very bright stars """
+
+    params = [IMAGE_SIZES, STAR_COUNTS]
+    param_names = ['image_size', 'n_star']
+
+    def setup(self, image_size, n_star):
+        field = make_field(image_size, n_star)
+        self.stars = field['stars']
+        self.xx, self.yy = field['xx'], field['yy']
+
+    def time_make_mask_strip(self, *args):
+        make_mask_strip(self.stars, self.xx, self.yy, verbose=False)
+
+    def peakmem_make_mask_strip(self, *args):
+        make_mask_strip(self.stars, self.xx, self.yy, verbose=False)
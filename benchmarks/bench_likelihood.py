@@ -0,0 +1,67 @@
+"""
+Benchmarks of the likelihood functions built by Container.set_likelihood:
+loglike_2p, loglike_3p and loglike_sp (n_spline = 2, 3 and 4), and the
+likelihood with its gradient used by MLE (brightest_only).
+
+"""
+
+import numpy as np
+
+from elderflower.container import Container
+
+from .common import IMAGE_SIZES, STAR_COUNTS, make_field
+
+
+class Likelihood:
+    """ Evaluation of the log likelihood at the center of the prior """
+
+    params = [IMAGE_SIZES, STAR_COUNTS, [2, 3, 4], [False, True]]
+    param_names = ['image_size', 'n_star', 'n_spline', 'brightest_only']
+
+    def setup(self, image_size, n_star, n_spline, brightest_only):
+        field = make_field(image_size, n_star)
+
+        container = Container(n_spline, brightest_only=brightest_only,
+                              draw_real=True)
+        container.fix_n0 = False
+        container.set_prior(n_est=3.2, mu_est=100., std_est=1.)
+        container.set_likelihood(field['image'], field['mask'],
+                                 field['psf'], field['stars'],
+                                 psf_range=[None, None], G_eff=1e5)
+
+        self.loglikelihood = container.loglikelihood
+        self.v = container.prior_transform(np.full(container.ndim, 0.5))
+
+    def time_loglike(self, *args):
+        self.loglikelihood(self.v.copy())
+
+    def peakmem_loglike(self, *args):
+        self.loglikelihood(self.v.copy())
+
+
+class LikelihoodGrad:
+    """ Evaluation of the log likelihood and its gradient at the center of the prior """
+
+    params = [IMAGE_SIZES, STAR_COUNTS, [2, 3, 4]]
+    param_names = ['image_size', 'n_star', 'n_spline']
+
+    def setup(self, image_size, n_star, n_spline):
+        field = make_field(image_size, n_star)
+
+        container = Container(n_spline, brightest_only=True, draw_real=True)
+        container.fix_n0 = False
+        container.set_prior(n_est=3.2, mu_est=100., std_est=1.)
+        container.set_likelihood(field['image'], field['mask'],
+                                 field['psf'], field['stars'],
+                                 psf_range=[None, None], G_eff=1e5)
+
+        if container.loglike_grad is None:
+            raise NotImplementedError
+        self.loglike_grad = container.loglike_grad
+        self.v = container.prior_transform(np.full(container.ndim, 0.5))
+
+    def time_loglike_grad(self, *args):
+        self.loglike_grad(self.v)
+
+    def peakmem_loglike_grad(self, *args):
+        self.loglike_grad(self.v)
@@ -0,0 +1,49 @@
+"""
+Benchmarks of the measurement of scaling factors and stacking:
+compute_Rnorm_batch and stack_star_image.
+
+"""
+
+from elderflower.norm import compute_Rnorm_batch
+from elderflower.stack import stack_star_image
+
+from .common import IMAGE_SIZES, STAR_COUNTS, r_scale, make_field
+
+
+class RnormBatch:
+    """ Thumbnail extraction and ring measurement of all catalog stars """
+
+    params = [IMAGE_SIZES, STAR_COUNTS]
+    param_names = ['image_size', 'n_star']
+
+    def setup(self, image_size, n_star):
+        field = make_field(image_size, n_star)
+        self.args = (field['catalog'], field['image'],
+                     field['seg_map'], field['wcs'])
+
+    def time_compute_Rnorm_batch(self, *args):
+        compute_Rnorm_batch(*self.args, r_scale=r_scale, verbose=False)
+
+    def peakmem_compute_Rnorm_batch(self, *args):
+        compute_Rnorm_batch(*self.args, r_scale=r_scale, verbose=False)
+
+
+class StackStars:
+    """ Stacking of thumbnails of all measured stars """
+
+    params = [IMAGE_SIZES, STAR_COUNTS, ['mean', 'median']]
+    param_names = ['image_size', 'n_star', 'method']
+
+    def setup(self, image_size, n_star, method):
+        field = make_field(image_size, n_star)
+        _, self.res_thumb = compute_Rnorm_batch(field['catalog'], field['image'],
+                                                field['seg_map'], field['wcs'],
+                                                r_scale=r_scale, verbose=False)
+        catalog = field['catalog']
+        self.table = catalog[[num in self.res_thumb for num in catalog['NUMBER']]]
+
+    def time_stack_star_image(self, image_size, n_star, method):
+        stack_star_image(self.table, self.res_thumb, size=61, method=method, verbose=False)
+
+    def peakmem_stack_star_image(self, image_size, n_star, method):
+        stack_star_image(self.table, self.res_thumb, size=61, method=method, verbose=False)
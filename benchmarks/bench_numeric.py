@@ -0,0 +1,79 @@
+"""
+Benchmarks of the multi-power conversions called in each likelihood
+evaluation: the external light from very bright stars and the
+I(r) <-> I0 conversions. The compiled (numba) kernels are compared
+with the NumPy versions for 10 - 500 bright stars.
+
+"""
+
+import numpy as np
+
+from elderflower.numeric import (numba_installed,
+                                 calculate_external_light_mpow,
+                                 calculate_external_light_mpow_numpy,
+                                 I2I0_mpow, I2I0_mpow_numpy,
+                                 I02I_mpow, I02I_mpow_numpy)
+
+from .common import r_scale
+
+# Fiducial multi-power PSF with a cutoff (in pix)
+n_s = np.array([3.1, 2.4, 1.9, 4.])
+theta_s_pix = np.array([2., 20., 120., 480.])
+
+# Numbers of bright stars and implementations that benchmarks are run over
+BRIGHT_COUNTS = [10, 100, 500]
+IMPLEMENTATIONS = ['numpy', 'numba']
+
+
+def make_stars(N, frac_verybright=0.2, image_size=2000, seed=1):
+    """ Positions of N bright stars, a fraction of which are very bright """
+    rng = np.random.default_rng(seed)
+    pos_eval = rng.uniform(0, image_size, size=(N, 2))
+    pos_source = pos_eval[:max(1, int(N*frac_verybright))]
+    I0_source = 10**rng.uniform(2, 4, size=len(pos_source))
+    return pos_source, pos_eval, I0_source
+
+def pick(func_numba, func_numpy, impl):
+    """ Function of the implementation. The compiled kernels are
+        skipped if numba is not installed (they fall back to NumPy). """
+    if impl == 'numpy':
+        return func_numpy
+    if not numba_installed:
+        raise NotImplementedError
+    return func_numba
+
+
+class ExternalLight:
+    """ External light from very bright stars at the bright stars """
+
+    params = [BRIGHT_COUNTS, IMPLEMENTATIONS]
+    param_names = ['n_bright', 'impl']
+
+    def setup(self, n_bright, impl):
+        self.func = pick(calculate_external_light_mpow,
+                         calculate_external_light_mpow_numpy, impl)
+        pos_source, pos_eval, I0_source = make_stars(n_bright)
+        self.args = (n_s, theta_s_pix, pos_source, pos_eval, I0_source)
+        self.func(*self.args)   # compile
+
+    def time_external_light(self, *args):
+        self.func(*self.args)
+
+
+class ConvertI0:
+    """ Conversions between I(r_scale) and I0 of the multi-power PSF """
+
+    params = [BRIGHT_COUNTS, IMPLEMENTATIONS, ['I2I0', 'I02I']]
+    param_names = ['n_bright', 'impl', 'direction']
+
+    def setup(self, n_bright, impl, direction):
+        if direction == 'I2I0':
+            self.func = pick(I2I0_mpow, I2I0_mpow_numpy, impl)
+        else:
+            self.func = pick(I02I_mpow, I02I_mpow_numpy, impl)
+        I = np.random.default_rng(n_bright).uniform(1, 100, size=n_bright)
+        self.args = (n_s, theta_s_pix, r_scale, I)
+        self.func(*self.args)   # compile
+
+    def time_convert(self, *args):
+        self.func(*self.args)
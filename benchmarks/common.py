@@ -0,0 +1,132 @@
+"""
+Synthetic fields shared by the benchmarks.
+
+A field is built through the mock path of elderflower: a multi-power
+PSF_Model, a Stars object scaled by z_norm and a truth image drawn by
+make_truth_image, plus noise, a source mask and a SExtractor-like
+catalog. Fields are seeded and cached so that every benchmark with the
+same parameters sees the same data.
+
+"""
+
+import warnings
+from functools import lru_cache
+
+import numpy as np
+
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from elderflower.io import logger
+from elderflower.utils import make_psf_2D
+from elderflower.modeling import Stars, make_truth_image, add_image_noise
+
+warnings.simplefilter('ignore')
+logger.setLevel('WARNING')
+
+# Image sizes (in pix) and star counts that benchmarks are run over
+IMAGE_SIZES = [256, 512, 1024]
+STAR_COUNTS = [20, 100]
+
+# Fiducial PSF and observation
+pixel_scale = 2.5       # arcsec/pix
+BKG = 100.
+std_noise = 2.
+r_scale = 12
+z_threshold = np.array([10, 300])
+ZP = 27.1
+
+n_s_fid = [3.2, 2.5]
+theta_s_fid = [5, 100]
+cutoff_param = dict(cutoff=True, n_c=4, theta_c=1200)
+
+
+def make_psf():
+    """ Fiducial two-component aureole PSF with a Moffat core """
+    _, psf = make_psf_2D(n_s=n_s_fid, theta_s=theta_s_fid,
+                         frac=0.3, beta=6., fwhm=6.,
+                         cutoff_param=cutoff_param,
+                         psf_range=1200, pixel_scale=pixel_scale)
+    psf.generate_core()
+    psf.theta_out = 1200
+    return psf
+
+@lru_cache(maxsize=8)
+def make_field(image_size, n_star, seed=1):
+    """
+    Build a synthetic field.
+
+    Parameters
+    ----------
+    image_size : int
+        Size of the (square) image in pix.
+    n_star : int
+        Number of stars. The brightness z_norm at r_scale is drawn
+        log-uniformly, so that the field contains faint, medium bright
+        and very bright stars.
+    seed : int, optional, default 1
+        Random seed.
+
+    Returns
+    -------
+    field : dict
+        psf, stars, image, mask, xx, yy, catalog, seg_map and wcs.
+
+    """
+    rng = np.random.default_rng(seed)
+
+    psf = make_psf()
+    image_shape = (image_size, image_size)
+
+    star_pos = rng.uniform(0, image_size, size=(n_star, 2))
+    z_norm = 10**rng.uniform(0, 3, n_star)
+    stars = Stars.from_znorm(psf, star_pos, z_norm,
+                             z_threshold=z_threshold, r_scale=r_scale)
+    stars.BKG = BKG
+
+    image = make_truth_image(psf, stars, image_shape)
+    image = add_image_noise(image + BKG, std_noise, random_seed=seed)
+
+    yy, xx = np.mgrid[:image_size, :image_size]
+
+    # Mask the cores of all stars
+    seg_map = np.zeros(image_shape, dtype=np.int32)
+    r_mask = 2 * psf.fwhm / pixel_scale + 2 * np.log10(stars.Flux)
+    for k, ((x, y), r) in enumerate(zip(star_pos, r_mask)):
+        seg_map[(xx-x)**2+(yy-y)**2 < r**2] = k + 1
+    mask = seg_map > 0
+
+    wcs = make_wcs(image_shape)
+    catalog = make_catalog(stars, wcs, fwhm=psf.fwhm/pixel_scale,
+                           image_shape=image_shape)
+
+    return dict(psf=psf, stars=stars, image=image, mask=mask,
+                xx=xx, yy=yy, catalog=catalog, seg_map=seg_map, wcs=wcs)
+
+def make_wcs(image_shape, ra=150., dec=2.):
+    """ Simple TAN WCS centered at (ra, dec) """
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crval = [ra, dec]
+    wcs.wcs.crpix = [image_shape[1]/2, image_shape[0]/2]
+    wcs.wcs.cdelt = [-pixel_scale/3600, pixel_scale/3600]
+    return wcs
+
+def make_catalog(stars, wcs, fwhm=2.4, image_shape=None, edge=4):
+    """ SExtractor-like catalog of the stars (1-based coordinates).
+        Stars within edge pix from the border are not detected. """
+    X_IMAGE, Y_IMAGE = stars.star_pos.T + 1
+    X_WORLD, Y_WORLD = wcs.all_pix2world(X_IMAGE, Y_IMAGE, 1)
+
+    catalog = Table({"NUMBER": np.arange(stars.n_tot) + 1,
+                     "MAG_AUTO": -2.5*np.log10(stars.Flux) + ZP,
+                     "X_IMAGE": X_IMAGE, "Y_IMAGE": Y_IMAGE,
+                     "FWHM_IMAGE": np.full(stars.n_tot, fwhm),
+                     "X_WORLD": X_WORLD, "Y_WORLD": Y_WORLD})
+
+    if image_shape is not None:
+        inside = (X_IMAGE > edge) & (X_IMAGE < image_shape[1]-edge) & \
+                 (Y_IMAGE > edge) & (Y_IMAGE < image_shape[0]-edge)
+        catalog = catalog[inside]
+
+    return catalog
@@ -0,0 +1,234 @@
+"""
+Local cache of reference catalogs (Pan-STARRS, Vizier, etc.)
+
+The sky is divided into Dec bands of fixed height, each split into RA
+tiles of about the same width on the sky. A cone query is served from
+the tiles it overlaps: tiles cached on disk are read, missing tiles are
+fetched from the service (by a cone circumscribing the tile) and saved.
+Tiles are kept per catalog and per set of query parameters (columns,
+filters, etc.), so a different query never reads stale tiles.
+
+In offline mode nothing is fetched: missing tiles are filled from a
+local catalog file if given, otherwise an error is raised. Tiles cut
+from the local catalog are not saved, so that a partial stand-in never
+takes the place of the tiles of the service in later (online) queries.
+
+> Example Usage
+cache = CatalogCache('./catalogs')
+tab = cache.query('PS1_DR2', fetch, ra, dec, radius,
+                  params={'columns': columns},
+                  ra_key='raMean', de_key='decMean')
+
+"""
+
+import os
+import json
+import math
+import hashlib
+
+import numpy as np
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import Table, vstack
+
+from .io import logger
+
+
+class CatalogCache:
+    """
+    A persistent on-disk cache of reference catalogs in sky tiles.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory storing the tiles.
+    tile_size : float, optional, default 0.5
+        Size of tiles in degree. Note the cone circumscribing a
+        tile should be accepted by the services (<= 0.5 deg for PS1).
+    offline : bool, optional, default False
+        If True, never query remote services.
+    local_catalog : str, optional, default None
+        Path of a catalog file (readable by astropy Table) standing in
+        for the services in offline mode.
+
+    """
+
+    def __init__(self, cache_dir, tile_size=0.5,
+                 offline=False, local_catalog=None):
+        self.cache_dir = cache_dir
+        self.tile_size = tile_size
+        self.offline = offline
+        self.local_catalog = local_catalog
+        self._local_table = None
+
+        self.n_dec = math.ceil(180/tile_size)
+
+    def __str__(self):
+        return "A CatalogCache Class"
+
+    def __repr__(self):
+        mode = 'offline' if self.offline else 'online'
+        return f"{self.__class__.__name__} in {self.cache_dir} ({mode})"
+
+    def tile_dir(self, catalog, params=None):
+        """ Directory of tiles of the catalog with the query parameters """
+        key = json.dumps(params or {}, sort_keys=True, default=str)
+        digest = hashlib.md5(key.encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, catalog.replace('/', '_'), digest)
+
+    def n_ra(self, j):
+        """ Number of RA tiles in the Dec band j """
+        s = self.tile_size
+        dec_min, dec_max = j*s-90, min((j+1)*s-90, 90)
+        # width on the sky <= tile_size at the edge closest to the equator
+        dec_eq = 0 if dec_min < 0 < dec_max else min(abs(dec_min), abs(dec_max))
+        return max(math.ceil(360 * math.cos(math.radians(dec_eq)) / s), 1)
+
+    def tile_bounds(self, i, j):
+        """ [RA min, RA max, Dec min, Dec max] of tile (i, j) in degree """
+        s, w = self.tile_size, 360/self.n_ra(j)
+        return (i*w, min((i+1)*w, 360), j*s-90, min((j+1)*s-90, 90))
+
+    def tiles_overlap(self, ra, dec, radius):
+        """ Indices (i, j) of tiles overlapping the cone (in degree) """
+        s = self.tile_size
+        dec_lo, dec_hi = max(dec-radius, -90), min(dec+radius, 90)
+        j_range = range(int((dec_lo+90)//s), min(int((dec_hi+90)//s), self.n_dec-1)+1)
+
+        # half width in RA at the Dec closest to the pole
+        cos_dec = math.cos(math.radians(max(abs(dec_lo), abs(dec_hi))))
+        sin_r = math.sin(math.radians(radius))
+        dra = 180 if sin_r >= cos_dec else math.degrees(math.asin(sin_r/cos_dec))
+
+        tiles = []
+        for j in j_range:
+            n_ra = self.n_ra(j)
+            if dra >= 180:
+                i_range = range(n_ra)
+            else:
+                w = 360/n_ra
+                i_lo, i_hi = int((ra-dra)//w), int((ra+dra)//w)
+                i_range = sorted({i % n_ra for i in range(i_lo, i_hi+1)})
+            tiles += [(i, j) for i in i_range]
+
+        return tiles
+
+    def _select_tile(self, table, i, j, ra_key, de_key):
+        """ Rows of table within tile (i, j) """
+        ra_min, ra_max, dec_min, dec_max = self.tile_bounds(i, j)
+        ra = np.mod(np.asarray(table[ra_key], dtype=float), 360)
+        dec = np.asarray(table[de_key], dtype=float)
+        in_tile = (ra >= ra_min) & (ra < ra_max) & (dec >= dec_min) & (dec < dec_max)
+        if dec_max == 90:
+            in_tile |= (ra >= ra_min) & (ra < ra_max) & (dec == 90)
+        return table[in_tile]
+
+    def _fetch_tile(self, fetch, i, j, ra_key, de_key):
+        """ Query the tile by the cone circumscribing it """
+        ra_min, ra_max, dec_min, dec_max = self.tile_bounds(i, j)
+        ra_c, dec_c = (ra_min+ra_max)/2., (dec_min+dec_max)/2.
+
+        center = SkyCoord(ra_c, dec_c, unit=u.deg)
+        corners = SkyCoord([ra_min, ra_min, ra_max, ra_max],
+                           [dec_min, dec_max, dec_min, dec_max], unit=u.deg)
+        radius = center.separation(corners).deg.max() * 1.01
+
+        if self.offline:
+            table = self.local_table
+        else:
+            table = fetch(ra_c, dec_c, radius)
+
+        if table is None or len(table) == 0:
+            return None
+        return self._select_tile(table, i, j, ra_key, de_key)
+
+    @property
+    def local_table(self):
+        """ Catalog standing in for the services in offline mode """
+        if self.local_catalog is None:
+            return None
+        if self._local_table is None:
+            logger.info(f"Read local catalog: {self.local_catalog}")
+            self._local_table = Table.read(self.local_catalog)
+        return self._local_table
+
+    def query(self, catalog, fetch, ra, dec, radius,
+              params=None, ra_key='RAJ2000', de_key='DEJ2000'):
+        """
+        Cone search of a catalog served from cached tiles.
+
+        Parameters
+        ----------
+        catalog : str
+            Name of the catalog.
+        fetch : callable
+            fetch(ra, dec, radius) querying the service, all in degree.
+            Return an astropy Table (or None if empty).
+        ra, dec, radius : float
+            Center and radius of the cone in degree.
+        params : dict, optional
+            Parameters of the query (columns, filters, etc.) keying the tiles.
+        ra_key, de_key : str, optional
+            Column names of coordinates in the catalog.
+
+        Returns
+        -------
+        table : astropy.table.Table
+            Rows within the cone.
+
+        """
+
+        dir_tile = self.tile_dir(catalog, params)
+
+        tables = []
+        n_fetch, n_local = 0, 0
+        for i, j in self.tiles_overlap(ra, dec, radius):
+            fn = os.path.join(dir_tile, f'tile_{i}_{j}.ecsv')
+            fn_empty = fn.replace('.ecsv', '.empty')
+
+            if os.path.isfile(fn):
+                tables.append(Table.read(fn, format='ascii.ecsv'))
+                continue
+            elif os.path.isfile(fn_empty):
+                continue
+
+            if self.offline and self.local_catalog is None:
+                msg = f"Tile {i}_{j} of {catalog} is not cached (offline)."
+                logger.error(msg)
+                raise FileNotFoundError(msg)
+
+            table = self._fetch_tile(fetch, i, j, ra_key, de_key)
+
+            if self.offline:
+                # Cut from the local catalog: used but not saved
+                n_local += 1
+                if table is not None and len(table) > 0:
+                    tables.append(table)
+                continue
+
+            n_fetch += 1
+            os.makedirs(dir_tile, exist_ok=True)
+
+            if table is None or len(table) == 0:
+                open(fn_empty, 'w').close()
+            else:
+                table.write(fn, format='ascii.ecsv', overwrite=True)
+                tables.append(table)
+
+        if n_fetch > 0:
+            logger.info(f"Fetched {n_fetch} tile(s) of {catalog} into {dir_tile}")
+        if n_local > 0:
+            logger.info(f"Read {n_local} tile(s) of {catalog} from {self.local_catalog}")
+
+        if len(tables) == 0:
+            return Table()
+
+        table = vstack(tables, metadata_conflicts='silent')
+
+        # Rows within the cone
+        coords = SkyCoord(table[ra_key], table[de_key], unit=u.deg)
+        sep = coords.separation(SkyCoord(ra, dec, unit=u.deg)).deg
+
+        return table[sep <= radius]
+
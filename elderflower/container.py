@@ -1,5 +1,6 @@
 import os
 import numpy as np
+from functools import partial
 import matplotlib.pyplot as plt
 from .io import logger
 
@@ -16,7 +17,10 @@ class Container:
                  fit_frac=False,
                  brightest_only=False,
                  parallel=False,
-                 draw_real=True):
+                 draw_real=True,
+                 fft_convolve=False,
+                 profile=False,
+                 noise_scale=1):
                  
         if n_spline is float:
             if n_spline <=1:
@@ -30,6 +34,15 @@ class Container:
         self.brightest_only = brightest_only
         self.parallel = parallel
         self.draw_real = draw_real
+        self.fft_convolve = fft_convolve
+        
+        # Record wall time of stages in the likelihood (see profiling)
+        self.profile = profile
+        
+        # Ratio of the sky noise of the fitted image to std_est, e.g.
+        # 1/factor for an image block-averaged by factor. The prior of the
+        # sky noise is shifted by it while the other params are unchanged.
+        self.noise_scale = noise_scale
         
     def __str__(self):
         return "A Container Class"
@@ -61,6 +74,11 @@ class Container:
                              theta_in=theta_in, theta_out=theta_out,
                              fit_sigma=fit_sigma, fit_frac=fit_frac)
         
+        noise_scale = getattr(self, 'noise_scale', 1)
+        if fit_sigma & (noise_scale != 1):
+            prior_tf = partial(prior_tf_scale_noise, prior_tf=prior_tf,
+                               K=1+fit_frac, log_scale=np.log10(noise_scale))
+        
         self.prior_transform = prior_tf
         
         # Set labels for displaying the results
@@ -122,9 +140,12 @@ class Container:
                        norm='brightness',
                        psf_range=[None, None],
                        G_eff=1e5,
-                       image_base=None):
+                       image_base=None,
+                       stamp_cache=None):
                        
-        """ Setup likelihood function for fitting """
+        """ Setup likelihood function for fitting.
+        A modeling.StampCache can be given to reuse PSF stamps of
+        medium bright stars. Its counters are kept in self.stamp_cache. """
         
         from .modeling import set_likelihood
         
@@ -137,25 +158,247 @@ class Container:
         stars_tri = stars.copy()
         psf_tri = psf.copy()
         
+        # Noise of the fitted image
+        noise_scale = getattr(self, 'noise_scale', 1)
+        
         # Set up likelihood function
-        loglike = set_likelihood(image, mask_fit,
+        loglike, loglike_batch, loglike_grad = set_likelihood(image, mask_fit,
                                  psf_tri, stars_tri,
                                  norm=norm,
                                  psf_range=psf_range,
                                  fix_n0=self.fix_n0,
-                                 std_est=self.std_est,
-                                 G_eff=G_eff,
+                                 std_est=self.std_est * noise_scale,
+                                 G_eff=G_eff / noise_scale**2,
                                  n_spline=self.n_spline,
                                  leg2d=self.leg2d,
                                  fit_sigma=self.fit_sigma,
                                  fit_frac=self.fit_frac,
                                  brightest_only=self.brightest_only,
                                  parallel=self.parallel, 
-                                 draw_real=self.draw_real)
+                                 draw_real=self.draw_real,
+                                 stamp_cache=stamp_cache,
+                                 fft_convolve=getattr(self, 'fft_convolve', False),
+                                 return_batch=True,
+                                 return_grad=True)
+        
+        if getattr(self, 'profile', False):
+            from .profiling import StageTimer, profiled
+            self.timer = StageTimer()
+            loglike = profiled(loglike, self.timer)
+            if loglike_batch is not None:
+                loglike_batch = profiled(loglike_batch, self.timer, 'loglike_batch')
+            if loglike_grad is not None:
+                loglike_grad = profiled(loglike_grad, self.timer, 'loglike_grad')
         
         self.loglikelihood = loglike
+        self.loglike_batch = loglike_batch
+        self.loglike_grad = loglike_grad
+        self.stamp_cache = stamp_cache
+        
+    def timings(self):
+        """ Wall time and number of calls of stages in the likelihood
+            recorded so far (None if profile=False). """
+        timers = [ct.timer for ct in [self] + getattr(self, 'containers', [])
+                  if getattr(ct, 'timer', None) is not None]
+        if len(timers) == 0:
+            return None
+        
+        from .profiling import merge_timings
+        return merge_timings([timer.summary() for timer in timers])
+        
+    def stamp_cache_info(self):
+        """ Hits and misses of the stamp caches summed over
+            the containers (None if no stamp cache is used). """
+        caches = [ct.stamp_cache for ct in [self] + getattr(self, 'containers', [])
+                  if getattr(ct, 'stamp_cache', None) is not None]
+        if len(caches) == 0:
+            return None
+        
+        hits = sum(cache.hits for cache in caches)
+        misses = sum(cache.misses for cache in caches)
+        n_call = hits + misses
+        return {'hits':hits, 'misses':misses,
+                'hit_rate':hits/n_call if n_call > 0 else 0.}
+        
+    def reset_timings(self):
+        """ Reset the records of stages in the likelihood. """
+        for ct in [self] + getattr(self, 'containers', []):
+            if getattr(ct, 'timer', None) is not None:
+                ct.timer.reset()
+        
+    def loglikelihood_batch(self, V):
+        """ Log-likelihood of a batch of proposals V (M x ndim).
+        Vectorized if supported by the likelihood, otherwise in a loop. """
+        
+        V = np.atleast_2d(V)
+        
+        if getattr(self, 'loglike_batch', None) is None:
+            return np.array([self.loglikelihood(v.copy()) for v in V])
+        else:
+            return self.loglike_batch(V)
+            
+
+
+class JointContainer(Container):
+    """
+    A container joining the containers of multiple regions into a
+    single fitting. The PSF parameters (and the aureole fraction) are
+    shared by all regions while each region keeps its own background
+    parameters. The joint likelihood is the sum of the likelihoods of
+    the regions, so one sampler (and one pool) serves the whole field.
+    
+    Parameters
+    ----------
+    containers : list of Container
+        Containers of each region with priors (or MLE bounds) and
+        likelihood set up in the same way.
+        
+    """
+    
+    def __init__(self, containers):
+        
+        ct0 = containers[0]
+        
+        for ct in containers[1:]:
+            if ct.ndim != ct0.ndim:
+                raise ValueError("Containers of regions have different # of params.")
+                
+        super().__init__(ct0.n_spline, ct0.leg2d,
+                         ct0.fit_sigma, ct0.fit_frac,
+                         brightest_only=ct0.brightest_only,
+                         parallel=ct0.parallel,
+                         draw_real=ct0.draw_real,
+                         fft_convolve=getattr(ct0, 'fft_convolve', False),
+                         profile=getattr(ct0, 'profile', False),
+                         noise_scale=getattr(ct0, 'noise_scale', 1))
+        
+        self.containers = containers
+        self.N_Region = len(containers)
+        self.fix_n0 = ct0.fix_n0
+        
+        # Use the first region for display
+        self.image = ct0.image
+        self.image_shape = ct0.image_shape
+        
+        self.n_est = ct0.n_est
+        self.mu_est = ct0.mu_est
+        self.std_est = [ct.std_est for ct in containers]
+        
+        # Number of background (per region) and PSF (shared) params
+        self.n_bkg = 1 + 2 * self.leg2d + self.fit_sigma
+        self.n_psf = ct0.ndim - self.n_bkg - self.fit_frac
+        
+        self.ndim = self.n_psf + self.N_Region * self.n_bkg + self.fit_frac
+        
+        if hasattr(ct0, 'prior_transform'):
+            self.set_joint_prior()
+        
+        if hasattr(ct0, 'MLE_bounds'):
+            self.set_joint_MLE_bounds()
             
+        self.set_joint_likelihood()
         
+    def __str__(self):
+        return "A Joint Container Class"
+        
+    def region_index(self, i):
+        """ Indices of params of the i-th region in the joint params. """
+        index_psf = np.arange(self.n_psf)
+        index_bkg = self.n_psf + i * self.n_bkg + np.arange(self.n_bkg)
+        index_frac = np.arange(self.ndim-self.fit_frac, self.ndim)
+        return np.concatenate([index_psf, index_bkg, index_frac])
+        
+    def set_joint_prior(self):
+        """ Join priors of regions. Priors of shared params follow the first region. """
+        
+        containers = self.containers
+        indices = [self.region_index(i) for i in range(self.N_Region)]
+        
+        def prior_transform(u):
+            v = u.copy()
+            # The first region is written last to set the shared params
+            for ct, index in zip(containers[::-1], indices[::-1]):
+                v[index] = ct.prior_transform(u[index])
+            return v
+            
+        self.prior_transform = prior_transform
+        
+        # Set labels with the background params tagged by the region
+        from .io import AsciiUpper
+        
+        n_psf, n_bkg = self.n_psf, self.n_bkg
+        labels_r = containers[0].labels
+        labels = labels_r[:n_psf]
+        for reg in AsciiUpper(self.N_Region):
+            labels += [lab + ' [%s]'%reg for lab in labels_r[n_psf:n_psf+n_bkg]]
+        labels += labels_r[n_psf+n_bkg:]
+        
+        self.labels = labels
+        
+    def set_joint_MLE_bounds(self):
+        """ Join p0 and bounds of regions. Bounds of shared params follow the first region. """
+        
+        n_psf, n_bkg = self.n_psf, self.n_bkg
+        ct0 = self.containers[0]
+        
+        param0 = [ct0.param0[:n_psf]]
+        MLE_bounds = list(ct0.MLE_bounds[:n_psf])
+        
+        for ct in self.containers:
+            param0 += [ct.param0[n_psf:n_psf+n_bkg]]
+            MLE_bounds += list(ct.MLE_bounds[n_psf:n_psf+n_bkg])
+        
+        self.param0 = np.concatenate(param0)
+        self.MLE_bounds = tuple(MLE_bounds)
+        
+    def set_joint_likelihood(self):
+        """ Sum likelihood functions of regions. """
+        
+        loglikes = [ct.loglikelihood for ct in self.containers]
+        indices = [self.region_index(i) for i in range(self.N_Region)]
+        
+        def loglike(v):
+            return sum(loglike_r(v[index])
+                       for loglike_r, index in zip(loglikes, indices))
+        
+        self.loglikelihood = loglike
+        
+        loglike_batches = [ct.loglikelihood_batch for ct in self.containers]
+        
+        def loglike_batch(V):
+            V = np.atleast_2d(V)
+            return sum(loglike_batch_r(V[:, index])
+                       for loglike_batch_r, index in zip(loglike_batches, indices))
+        
+        self.loglike_batch = loglike_batch
+        
+        # Gradient only if supported by all regions
+        loglike_grads = [getattr(ct, 'loglike_grad', None) for ct in self.containers]
+        
+        if any(loglike_grad_r is None for loglike_grad_r in loglike_grads):
+            self.loglike_grad = None
+        else:
+            def loglike_grad(v):
+                loglike, grad = 0, np.zeros(len(v))
+                for loglike_grad_r, index in zip(loglike_grads, indices):
+                    loglike_r, grad_r = loglike_grad_r(v[index])
+                    loglike += loglike_r
+                    grad[index] += grad_r
+                return loglike, grad
+            
+            self.loglike_grad = loglike_grad
+        
+    def set_likelihood(self, *args, **kwargs):
+        raise NotImplementedError("Set likelihood of each region then join them.")
+        
+
+def prior_tf_scale_noise(u, prior_tf, K=1, log_scale=0):
+    """ Prior transform with the sky noise (v[-K], in dex) scaled by 10**log_scale """
+    v = prior_tf(u)
+    v[-K] += log_scale
+    return v
+    
+
 def set_labels(n_spline, fit_sigma=True, fit_frac=False, leg2d=False):
     
     """ Setup labels for cornerplot """
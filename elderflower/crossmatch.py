@@ -38,6 +38,46 @@ def query_vizier(catalog_name, radius, columns, column_filters, header=None, coo
     return result
     
     
+def resolve_duplicates(idx_ref, scores, valid=None):
+    """
+    Resolve duplicate entries in a catalog in one pass. For each reference
+    object matched to more than one entry (e.g. pairs returned by
+    search_around_sky), keep the entries with the minimum score.
+    
+    Parameters
+    ----------
+    idx_ref : 1d int array
+        Index of the reference object of each matched pair.
+    scores : 1d array
+        Score of each pair (lower is better). nan is ignored.
+    valid : 1d bool array, optional
+        Pairs taken into account. Invalid pairs are never dropped.
+    
+    Returns
+    -------
+    drop : 1d bool array
+        Whether the pair is not the best match of its reference object.
+        
+    """
+    
+    idx_ref = np.asarray(idx_ref, dtype=int)
+    scores = np.array(scores, dtype=float)
+    if valid is not None:
+        scores[~valid] = np.nan
+        
+    n_ref = idx_ref.max()+1 if len(idx_ref)>0 else 0
+    counts = np.bincount(idx_ref, minlength=n_ref)
+    
+    # minimum score of each reference object
+    score_min = np.full(n_ref, np.nan)
+    np.fmin.at(score_min, idx_ref, scores)
+    
+    with np.errstate(invalid='ignore'):
+        drop = (counts[idx_ref]>1) & (scores > score_min[idx_ref])
+        
+    return drop
+    
+
 def cross_match(wcs_data, SE_catalog, bounds, radius=None,
                 pixel_scale=DF_pixel_scale, mag_limit=15, sep=3*u.arcsec,
                 clean_catalog=True, mag_name='rmag',
@@ -46,7 +86,7 @@ def cross_match(wcs_data, SE_catalog, bounds, radius=None,
                                         'objID', 'Qual', 'gmag', 'e_gmag', 'rmag', 'e_rmag']},
                 column_filters={'Pan-STARRS': {'rmag':'{0} .. {1}'.format(5, 22)}},
                 magnitude_name={'Pan-STARRS':['rmag','gmag']},
-                verbose=True):
+                cache=None, verbose=True):
     """
         Cross match SExtractor catalog with Vizier Online catalog.
         
@@ -59,6 +99,8 @@ def cross_match(wcs_data, SE_catalog, bounds, radius=None,
                 magnitude_name: "Rmag"
                 columns: ['RAJ2000', 'DEJ2000', 'Bmag', 'Rmag']
                 column_filters: {"Rmag":'{0} .. {1}'.format(5, 15)}
+        
+        If cache (a CatalogCache) is given, queries are served from local tiles.
                 
     """
     
@@ -75,13 +117,29 @@ def cross_match(wcs_data, SE_catalog, bounds, radius=None,
     
     for j, (cat_name, table_name) in enumerate(catalog.items()):
         # Query from Vizier
-        result = query_vizier(catalog_name=table_name,
-                              radius=radius,
-                              columns=columns[cat_name],
-                              column_filters=column_filters[cat_name],
-                              coord=coord_cen)
+        if cache is None:
+            result = query_vizier(catalog_name=table_name,
+                                  radius=radius,
+                                  columns=columns[cat_name],
+                                  column_filters=column_filters[cat_name],
+                                  coord=coord_cen)
 
-        Cat_full = result[table_name]
+            Cat_full = result[table_name]
+            
+        else:
+            def fetch(ra, dec, r):
+                result = query_vizier(catalog_name=table_name,
+                                      radius=r*u.deg,
+                                      columns=columns[cat_name],
+                                      column_filters=column_filters[cat_name],
+                                      coord=SkyCoord(ra, dec, unit=u.deg))
+                return result[table_name] if len(result)>0 else None
+                
+            params = {'columns': columns[cat_name],
+                      'column_filters': column_filters[cat_name]}
+            Cat_full = cache.query(table_name, fetch,
+                                   coord_cen.ra.deg, coord_cen.dec.deg,
+                                   radius.to(u.deg).value, params=params)
         
         if len(cat_name) > 4:
             c_name = cat_name[0] + cat_name[-1]
@@ -110,26 +168,16 @@ def cross_match(wcs_data, SE_catalog, bounds, radius=None,
             c_bright = SkyCoord(Cat_bright['RAJ2000'], Cat_bright['DEJ2000'], unit=u.deg)
             c_catalog = SkyCoord(Cat_crop['RAJ2000'], Cat_crop['DEJ2000'], unit=u.deg)
             idxc, idxcatalog, d2d, d3d = c_catalog.search_around_sky(c_bright, sep)
-            inds_c, counts = np.unique(idxc, return_counts=True)
             
-            row_duplicate = np.array([], dtype=int)
+            # Use the measurement with min error in RA/DEC,
+            # ignoring detection without magnitude measurement
+            obj_duplicate = Cat_crop[m_name, "e_RAJ2000", "e_DEJ2000"][idxcatalog]
+            has_mag = ~np.isnan(np.ma.filled(obj_duplicate[m_name], np.nan))
+            e2_coord = np.ma.filled(obj_duplicate["e_RAJ2000"]**2 + \
+                                    obj_duplicate["e_DEJ2000"]**2, np.nan)
             
-            # Use the measurement with min error in RA/DEC
-            for i in inds_c[counts>1]:
-                obj_duplicate = Cat_crop[idxcatalog][idxc==i]
-#                 obj_duplicate.pprint(max_lines=-1, max_width=-1)
-                
-                # Remove detection without magnitude measurement
-                mag_obj = obj_duplicate[m_name]
-                obj_duplicate = obj_duplicate[~np.isnan(mag_obj)]
-                
-                # Use the detection with the best astrometry
-                e2_coord = obj_duplicate["e_RAJ2000"]**2 + obj_duplicate["e_DEJ2000"]**2
-                min_e2_coord = np.nanmin(e2_coord)
-                
-                for ID in obj_duplicate[e2_coord>min_e2_coord]['ID'+'_'+c_name]:
-                    k = np.where(Cat_crop['ID'+'_'+c_name]==ID)[0][0]
-                    row_duplicate = np.append(row_duplicate, k)
+            drop = resolve_duplicates(idxc, e2_coord, valid=has_mag)
+            row_duplicate = idxcatalog[drop]
             
             Cat_crop.remove_rows(np.unique(row_duplicate))
             #Cat_bright = Cat_crop[mag_cat<mag_limit]
@@ -180,7 +228,7 @@ def cross_match(wcs_data, SE_catalog, bounds, radius=None,
 def cross_match_PS1_DR2(wcs_data, SE_catalog, bounds,
                         band='g', radius=None, clean_catalog=True,
                         pixel_scale=DF_pixel_scale, sep=5*u.arcsec,
-                        mag_limit=15, verbose=True):
+                        mag_limit=15, cache=None, verbose=True):
     """
     Use PANSTARRS DR2 API to do cross-match with the SE source catalog.
     Note this could be (much) slower compared to cross-match using Vizier.
@@ -203,6 +251,8 @@ def cross_match_PS1_DR2(wcs_data, SE_catalog, bounds,
     
     sep : maximum separation (in astropy unit) for crossmatch with SE.
     
+    cache : CatalogCache serving the queries from local tiles. (default None)
+    
     Returns
     -------
     tab_target : table containing matched bright sources with SE source catalog
@@ -238,9 +288,18 @@ def cross_match_PS1_DR2(wcs_data, SE_catalog, bounds,
                     gMeanPSFMag,gMeanPSFMagErr,gFlags,rMeanPSFMag,rMeanPSFMagErr,rFlags""".split(',')
         columns = [x.strip() for x in columns]
         columns = [x for x in columns if x and not x.startswith('#')]
-        results = ps1cone(ra, dec, radius.value, release='dr2', columns=columns, **constraints)
-        
-        Cat_full = ascii.read(results)
+        if cache is None:
+            results = ps1cone(ra, dec, radius.value, release='dr2', columns=columns, **constraints)
+            Cat_full = ascii.read(results)
+            
+        else:
+            def fetch(ra, dec, r):
+                results = ps1cone(ra, dec, r, release='dr2', columns=columns, **constraints)
+                return ascii.read(results) if results.strip() else None
+                
+            params = {'columns': columns, 'constraints': constraints}
+            Cat_full = cache.query('PS1_DR2', fetch, ra, dec, radius.value,
+                                   params=params, ra_key='raMean', de_key='decMean')
         for filter in 'gr':
             col = filter+'MeanPSFMag'
             Cat_full[col].format = ".4f"
@@ -281,23 +340,17 @@ def cross_match_PS1_DR2(wcs_data, SE_catalog, bounds,
                                  Cat_crop['decMean'], unit=u.deg)
             idxc, idxcatalog, d2d, d3d = \
                         c_catalog.search_around_sky(c_bright, sep)
-            inds_c, counts = np.unique(idxc, return_counts=True)
-            
-            row_duplicate = np.array([], dtype=int)
             
             # Use the measurement following some criteria
-            for i in inds_c[counts>1]:
-                obj_dup = Cat_crop[idxcatalog][idxc==i]
-                obj_dup['sep'] = d2d[idxc==i]
-                #obj_dup.pprint(max_lines=-1, max_width=-1)
-                
-                # Use the detection with mag
-                mag_obj_dup = obj_dup[mag_name]
-                obj_dup = obj_dup[~np.isnan(mag_obj_dup)]
-                                
-                # Use the closest match
-                good = (obj_dup['sep'] == min(obj_dup['sep']))
-                
+            obj_dup = Cat_crop[[mag_name]][idxcatalog]
+            mag_obj_dup = np.ma.filled(obj_dup[mag_name], np.nan)
+            
+            # Use the detection with mag
+            has_mag = ~np.isnan(mag_obj_dup)
+            
+            # Use the closest match
+            drop = resolve_duplicates(idxc, d2d.value, valid=has_mag)
+            
 ### Extra Criteria
 #                 # Coordinate error of detection
 #                 err2_coord = obj_dup["raMeanErr"]**2 + \
@@ -319,22 +372,12 @@ def cross_match_PS1_DR2(wcs_data, SE_catalog, bounds,
                 
 #                 good = has_err_mag & has_n_det & (~use_tycho_phot)
 ###
-                    
-                # Add rows to be removed
-                for ID in obj_dup[~good]['ID'+'_'+c_name]:
-                    k = np.where(Cat_crop['ID'+'_'+c_name]==ID)[0][0]
-                    row_duplicate = np.append(row_duplicate, k)
-                
-                obj_dup = obj_dup[good]
-                
-                if len(obj_dup)<=1:
-                    continue
-                
-                # Use brightest detection
-                mag = obj_dup[mag_name]
-                for ID in obj_dup[mag>min(mag)]['ID'+'_'+c_name]:
-                    k = np.where(Cat_crop['ID'+'_'+c_name]==ID)[0][0]
-                    row_duplicate = np.append(row_duplicate, k)
+            
+            # Use brightest detection among the closest
+            good = has_mag & ~drop
+            drop |= resolve_duplicates(idxc, mag_obj_dup, valid=good)
+            
+            row_duplicate = idxcatalog[drop]
             
             # Remove rows
             Cat_crop.remove_rows(np.unique(row_duplicate))
@@ -378,7 +421,7 @@ def cross_match_PS1(band, wcs_data,
                     SE_cat_target, bounds_list,
                     pixel_scale=DF_pixel_scale,
                     sep=None, mag_limit=15, n_attempt=3,
-                    use_PS1_DR2=False, verbose=True):
+                    use_PS1_DR2=False, cache=None, verbose=True):
                     
     b_name = band.lower()
     
@@ -399,6 +442,7 @@ def cross_match_PS1(band, wcs_data,
                                                 sep=sep,
                                                 mag_limit=mag_limit,
                                                 band=b_name,
+                                                cache=cache,
                                                 verbose=verbose)
             except HTTPError:
                 logger.warning('Gateway Time-out. Try again.')
@@ -419,6 +463,7 @@ def cross_match_PS1(band, wcs_data,
                                         sep=sep,
                                         mag_limit=mag_limit,
                                         mag_name=mag_name,
+                                        cache=cache,
                                         verbose=verbose)
                                         
     return tab_target, tab_target_full, catalog_star
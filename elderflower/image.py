@@ -9,7 +9,7 @@ import astropy.units as u
 from astropy.utils import lazyproperty
 from photutils.segmentation import SegmentationImage
 
-from .io import logger
+from .io import logger, open_frame
 from .mask import mask_param_default
 from .plotting import display, AsinhNorm, colorbar
 from . import DF_pixel_scale, DF_raw_pixel_scale, DF_Gain
@@ -57,12 +57,12 @@ class ImageButler:
         # Read hdu
         assert os.path.isfile(hdu_path), "Image does not exist. Check path."
             
-        with fits.open(hdu_path) as hdul:
-            self.hdu_path = hdu_path
-            if verbose: logger.info(f"Read Image: {hdu_path}")
-            self.image_full = hdul[0].data
-            self.header = header = hdul[0].header
-            self.full_wcs = wcs.WCS(header)
+        # Full frame (memory-mapped and shared by images of the same file)
+        self.hdu_path = hdu_path
+        if verbose: logger.info(f"Read Image: {hdu_path}")
+        self.frame = open_frame(hdu_path)
+        self.header = self.frame.header
+        self.full_wcs = self.frame.wcs
             
         self.bkg = bkg
         self.ZP = ZP
@@ -83,6 +83,11 @@ class ImageButler:
         else:
             return self.Gain_eff
             
+    @property
+    def image_full(self):
+        """ Full image (memory-mapped) """
+        return self.frame.data
+            
     def __str__(self):
         return "An ImageButler Class"
 
@@ -238,6 +243,7 @@ class Image(ImageButler):
                            catalog_sup='SE',
                            catalog_sup_atlas=None,
                            use_PS1_DR2=False,
+                           catalog_cache=None,
                            subtract_external=True,
                            draw=False,
                            keep_tmp=False, dir_tmp='./tmp'):
@@ -280,6 +286,7 @@ class Image(ImageButler):
                                                     pixel_scale=self.pixel_scale,
                                                     mag_limit=mag_limit,
                                                     use_PS1_DR2=use_PS1_DR2,
+                                                    cache=catalog_cache,
                                                     verbose=False)
         
         CT = calculate_color_term(tab_target_full, mag_range=[mag_saturate,mag_limit+2],
@@ -380,16 +387,20 @@ class ImageList(ImageButler):
         background (if None, read from header)
     G_eff : float or None (default)
         effective gain (e-/ADU)
+    n_cpu : int or None
+        number of processes preparing regions (tables, stars, masks, n0)
+        concurrently. If None, use # of CPU - 1. (default: 1, in serial)
     
     """
     
     def __init__(self, hdu_path, bounds0_list,
                  obj_name='', band='G', pixel_scale=DF_pixel_scale,
-                 pad=0, ZP=None, bkg=None, G_eff=None, verbose=False):
+                 pad=0, ZP=None, bkg=None, G_eff=None, n_cpu=1, verbose=False):
         
         super().__init__(hdu_path, obj_name, band,
                          pixel_scale, pad, ZP, bkg, G_eff, verbose)
                          
+        self.n_cpu = n_cpu
         self.bounds0_list = np.atleast_2d(bounds0_list)
         
         self.Images = [Image(hdu_path, bounds0,
@@ -398,6 +409,9 @@ class ImageList(ImageButler):
                        for bounds0 in self.bounds0_list]
         self.N_Image = len(self.Images)
         
+        # Downsampled regions by factor (see self.downsample)
+        self.pyramid = {}
+        
         
     def __iter__(self):
         for Img in self.Images:
@@ -429,25 +443,43 @@ class ImageList(ImageButler):
     def read_measurement_tables(self, dir_measure, **kwargs):
         """ Read faint stars info and brightness measurement """
         
+        from .parallel import map_regions
+        
+        def read_table(i):
+            Img = self.Images[i]
+            Img.read_measurement_table(dir_measure, **kwargs)
+            return Img.table_faint, Img.table_norm
+            
+        tables = map_regions(read_table, self.N_Image, self.n_cpu)
+        
         self.tables_norm = []
         self.tables_faint = []
         
-        for Img in self.Images:
-            Img.read_measurement_table(dir_measure, **kwargs)
-            self.tables_faint += [Img.table_faint]
-            self.tables_norm += [Img.table_norm]
+        for Img, (table_faint, table_norm) in zip(self.Images, tables):
+            Img.table_faint, Img.table_norm = table_faint, table_norm
+            self.tables_faint += [table_faint]
+            self.tables_norm += [table_norm]
             
         self.fwhm = np.mean([Img.fwhm for Img in self.Images])
     
     def assign_star_props(self, *args, **kwargs):
         """ Assign position and flux for faint and bright stars from tables. """
         
+        from .parallel import map_regions
+        
+        def assign_stars(i):
+            Img = self.Images[i]
+            Img.assign_star_props(*args, **kwargs)
+            return Img.stars_bright, Img.stars_all
+            
+        stars = map_regions(assign_stars, self.N_Image, self.n_cpu)
+        
         stars_bright, stars_all = [], []
     
-        for Img in self.Images:
-            Img.assign_star_props(*args, **kwargs)
-            stars_bright += [Img.stars_bright]
-            stars_all += [Img.stars_all]
+        for Img, (stars_b, stars_a) in zip(self.Images, stars):
+            Img.stars_bright, Img.stars_all = stars_b, stars_a
+            stars_bright += [stars_b]
+            stars_all += [stars_a]
             
         self.stars_bright = stars_bright
         self.stars_all = stars_all
@@ -496,6 +528,7 @@ class ImageList(ImageButler):
         
         from .mask import Mask
         from .utils import crop_image
+        from .parallel import map_regions
         
         # S/N threshold of deep mask
         sn_thre = mask_param['sn_thre']
@@ -521,9 +554,12 @@ class ImageList(ImageButler):
         else:
             count = None
             
-        masks = []
+        if dist_strip is None:
+            dist_strip = max(self.Images[0].image_shape) * self.pixel_scale
         
-        for i, (Image, stars) in enumerate(zip(self.Images, stars_list)):
+        def prepare_mask(i):
+            Image, stars = self.Images[i], stars_list[i]
+            
             if self.verbose:
                 logger.info("Prepare mask for region {}.".format(i+1))
                 
@@ -552,15 +588,20 @@ class ImageList(ImageButler):
                                     save_dir=save_dir)
             
             # Supplementary Strip + Cross mask
-            if dist_strip is None:
-                dist_strip = max(Image.image_shape) * self.pixel_scale
-                
             mask.make_mask_advanced(n_strip, wid_strip, dist_strip,
                                     wid_cross, dist_cross, 
                                     clean=mask_param['clean'],
                                     draw=draw, save=save, save_dir=save_dir)
-
-            masks += [mask]
+            
+            # The image (with the full frame) is linked back after return
+            mask.Image = None
+            
+            return mask
+            
+        masks = map_regions(prepare_mask, self.N_Image, self.n_cpu)
+        
+        for Image, mask in zip(self.Images, masks):
+            mask.Image = Image
                 
         self.Masks = masks
         
@@ -582,6 +623,46 @@ class ImageList(ImageButler):
         self
         
         
+    def downsample(self, factor, stars):
+        """
+        Regions block-averaged by factor for a coarse level of fitting.
+        
+        The images and base images are averaged in blocks of factor x factor
+        pixels, and a block is masked if any of its pixels is masked. Stars
+        are rescaled to the new pixels (see modeling.Stars.downsample).
+        They are built once per factor and cached in self.pyramid.
+        
+        Parameters
+        ----------
+        factor : int
+            Size of the blocks.
+        stars : list of modeling.Stars object
+            Stars for fit of each region.
+        
+        Returns
+        -------
+        levels : list of dict
+            {'image', 'mask_fit', 'image_base', 'stars'} of each region.
+        
+        """
+        
+        from .utils import block_downsample
+        
+        if factor not in self.pyramid:
+            if self.verbose:
+                logger.info("Downsample regions by a factor of {}.".format(factor))
+            
+            levels = []
+            for i in range(self.N_Image):
+                levels += [dict(image=block_downsample(self.images[i], factor),
+                                mask_fit=block_downsample(self.mask_fit[i], factor, func=np.any),
+                                image_base=block_downsample(self.Images[i].image_base, factor),
+                                stars=stars[i].downsample(factor))]
+            
+            self.pyramid[factor] = levels
+            
+        return self.pyramid[factor]
+        
     def estimate_bkg(self):
         """ Estimate background level and std. """
         
@@ -605,15 +686,23 @@ class ImageList(ImageButler):
     
     def fit_n0(self, dir_measure, N_min_fit=10, **kwargs):
         """ Fit power index of 1st component with bright stars. """
-        self.n0, self.d_n0 = [], []
-        for i in range(self.N_Image):
+        from .parallel import map_regions
+        
+        def fit_n0_region(i):
+            kwargs_ = kwargs.copy()
             if hasattr(self, 'std_est'):
-                kwargs['sky_std'] = self.std_est[i]
+                kwargs_['sky_std'] = self.std_est[i]
             else:
                 logger.warning('Sky stddev is not estimated.')
                 
             N_fit = max(N_min_fit, self.stars[i].n_verybright)
-            n0, d_n0 = self.Images[i].fit_n0(dir_measure, N_fit=N_fit, **kwargs)
+            return self.Images[i].fit_n0(dir_measure, N_fit=N_fit, **kwargs_)
+            
+        n0_list = map_regions(fit_n0_region, self.N_Image, self.n_cpu)
+        
+        self.n0, self.d_n0 = [], []
+        for Img, (n0, d_n0) in zip(self.Images, n0_list):
+            Img.n0, Img.d_n0 = n0, d_n0
             self.n0 += [n0]
             self.d_n0 += [d_n0]
             
@@ -626,16 +715,35 @@ class ImageList(ImageButler):
                       brightest_only=False,
                       parallel=False,
                       draw_real=True,
+                      fft_convolve=False,
                       n_min=1.2,
                       d_n0_min=0.1,
                       theta0_range=[50, 300],
                       method='nested',
+                      joint=False,
+                      profile=False,
+                      stamp_cache=False,
+                      pyramid_factor=1,
                       verbose=True):
-        """ Container for fit storing prior and likelihood function """
-        
-        from .container import Container
+        """ Container for fit storing prior and likelihood function.
+        If joint=True, containers of regions are also joined into
+        self.container_joint for fitting all regions at once.
+        If profile=True, stages in the likelihood are timed.
+        If stamp_cache=True, PSF stamps of medium bright stars are reused
+        between calls (see modeling.StampCache), one cache per container.
+        If pyramid_factor > 1, containers with the same prior on the regions
+        block-averaged by pyramid_factor (see self.downsample) are also set
+        in self.containers_coarse (and self.container_joint_coarse) for
+        a coarse-to-fine fitting (see sampler.Sampler). """
+        
+        from .container import Container, JointContainer
+        from .modeling import StampCache
         
         self.containers = []
+        self.containers_coarse = []
+        
+        if pyramid_factor > 1:
+            levels = self.downsample(pyramid_factor, stars)
         
         for i in range(self.N_Image):
             if self.verbose:
@@ -645,7 +753,9 @@ class ImageList(ImageButler):
             container = Container(n_spline, leg2d, 
                                   fit_sigma, fit_frac,
                                   brightest_only=brightest_only,
-                                  parallel=parallel, draw_real=draw_real)
+                                  parallel=parallel, draw_real=draw_real,
+                                  fft_convolve=fft_convolve,
+                                  profile=profile)
             
             if hasattr(self, 'n0_'):
                 # Use a given fixed n0
@@ -708,7 +818,8 @@ class ImageList(ImageButler):
                                      psf_range=[None, None],
                                      norm='brightness',
                                      G_eff=self.G_eff,
-                                     image_base=self.Images[i].image_base)
+                                     image_base=self.Images[i].image_base,
+                                     stamp_cache=StampCache() if stamp_cache else None)
             
             # Set a few attributes to container for convenience
             container.image = self.images[i]
@@ -717,6 +828,50 @@ class ImageList(ImageButler):
             container.image_shape = image_shape
             
             self.containers += [container]
+            
+            if pyramid_factor > 1:
+                # Same prior and setup on the block-averaged region
+                level = levels[i]
+                
+                container_c = Container(n_spline, leg2d, 
+                                        fit_sigma, fit_frac,
+                                        brightest_only=brightest_only,
+                                        parallel=parallel, draw_real=draw_real,
+                                        fft_convolve=fft_convolve,
+                                        profile=profile,
+                                        noise_scale=1./pyramid_factor)
+                container_c.fix_n0 = container.fix_n0
+                
+                if method == 'mle':
+                    container_c.set_MLE_bounds(n0, self.bkg, self.std_est[i], **prior_kws)
+                else:
+                    container_c.set_prior(n0, self.bkg, self.std_est[i], **prior_kws)
+                
+                psf_c = psf.copy()
+                psf_c.pixelize(psf.pixel_scale * pyramid_factor)
+                
+                container_c.set_likelihood(level['image'],
+                                           level['mask_fit'],
+                                           psf_c, level['stars'],
+                                           psf_range=[None, None],
+                                           norm='brightness',
+                                           G_eff=self.G_eff,
+                                           image_base=level['image_base'],
+                                           stamp_cache=StampCache() if stamp_cache else None)
+                
+                container_c.image = level['image']
+                container_c.data = level['image'][~level['mask_fit']].ravel()
+                container_c.image_shape = level['image'].shape
+                
+                self.containers_coarse += [container_c]
+            
+        if joint:
+            self.container_joint = JointContainer(self.containers)
+            if self.verbose:
+                logger.info("Join {} regions for fitting. # of params: {}".format(self.N_Image, self.container_joint.ndim))
+            
+            if pyramid_factor > 1:
+                self.container_joint_coarse = JointContainer(self.containers_coarse)
 
 
 class Thumb_Image:
@@ -18,6 +18,7 @@ import subprocess
 import numpy as np
 from datetime import datetime
 from functools import partial, wraps
+from collections.abc import Mapping
 
 try:
     import dill as pickle
@@ -228,6 +229,270 @@ def clean_pickling_object(keyword):
         if keyword in variable:
             del locals()[variable]
 
+### THUMBNAIL STORE ###
+# Layout of a thumbnail store (one file):
+#   header : magic (8 bytes), offset and length of the index (2 x uint64)
+#   blocks : image, bkg and mask of each star, aligned to 8 bytes
+#   index  : one record per star (see _thumb_index_dtype)
+_thumb_magic = b'EFTHUMB1'
+_thumb_header_size = 24
+_thumb_index_dtype = np.dtype([('NUMBER', '<i8'), ('offset', '<i8'),
+                               ('shape', '<i8', (2,)), ('center', '<f8', (2,)),
+                               ('dtype_image', 'S8'), ('dtype_bkg', 'S8')])
+
+def _thumb_block_sizes(shape, dtype_image, dtype_bkg):
+    """ Aligned sizes in bytes of image, bkg and mask of a thumbnail """
+    size = int(np.prod(shape))
+    align = lambda n: (n + 7) // 8 * 8
+    return (align(size * np.dtype(dtype_image).itemsize),
+            align(size * np.dtype(dtype_bkg).itemsize),
+            align(size))
+
+
+class ThumbnailWriter:
+    """
+    A writer appending thumbnails of stars to a thumbnail store.
+    Thumbnails are written as they are added so that they are not
+    kept in memory. Used as a dict: writer[num] = thumb.
+    
+    Parameters
+    ----------
+    filename : str
+        Path of the store.
+    
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'wb')
+        self.file.write(b'\0' * _thumb_header_size)
+        self.index = []
+        
+    def __str__(self):
+        return "A ThumbnailWriter Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} for {self.filename} N={len(self.index)}"
+        
+    def __enter__(self):
+        return self
+        
+    def __exit__(self, *exc):
+        self.close()
+    
+    def __len__(self):
+        return len(self.index)
+        
+    def __setitem__(self, num, thumb):
+        """ Append the thumbnail (dict of image, mask, bkg and center) of star num """
+        image = np.ascontiguousarray(thumb['image'])
+        bkg = np.ascontiguousarray(np.broadcast_to(thumb['bkg'], image.shape))
+        mask = np.ascontiguousarray(thumb['mask'], dtype=bool)
+        
+        offset = self.file.tell()
+        sizes = _thumb_block_sizes(image.shape, image.dtype, bkg.dtype)
+        for arr, size in zip([image, bkg, mask], sizes):
+            data = arr.tobytes()
+            self.file.write(data + b'\0' * (size-len(data)))
+            
+        self.index.append((num, offset, image.shape, thumb['center'],
+                           image.dtype.str, bkg.dtype.str))
+    
+    def close(self):
+        """ Write the index and the header """
+        if self.file.closed:
+            return
+        index = np.array(self.index, dtype=_thumb_index_dtype)
+        offset = self.file.tell()
+        self.file.write(index.tobytes())
+        self.file.seek(0)
+        self.file.write(_thumb_magic)
+        self.file.write(np.array([offset, len(index)], dtype='<u8').tobytes())
+        self.file.close()
+        
+        
+class ThumbnailStore(Mapping):
+    """
+    A read-only store of thumbnails of stars, memory-mapped from disk.
+    Thumbnails are looked up by NUMBER and read lazily:
+    store[num] = {'image', 'mask', 'bkg', 'center'}.
+    
+    Parameters
+    ----------
+    filename : str
+        Path of the store written by ThumbnailWriter.
+    
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        
+        with open(filename, 'rb') as f:
+            header = f.read(_thumb_header_size)
+        if header[:8] != _thumb_magic:
+            raise ValueError(f'{filename} is not a thumbnail store!')
+        offset, N = np.frombuffer(header[8:], dtype='<u8').astype(int)
+        
+        # Copy-on-write: arrays can be modified in memory only
+        self._data = np.memmap(filename, dtype=np.uint8, mode='c')
+        nbytes = N * _thumb_index_dtype.itemsize
+        self.index = self._data[offset:offset+nbytes].view(_thumb_index_dtype).copy()
+        self._row = {int(num): i for i, num in enumerate(self.index['NUMBER'])}
+    
+    def __str__(self):
+        return "A ThumbnailStore Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} for {self.filename} N={len(self)}"
+        
+    def __getstate__(self):
+        return {'filename': self.filename}
+        
+    def __setstate__(self, state):
+        self.__init__(state['filename'])
+        
+    def __len__(self):
+        return len(self.index)
+        
+    def __iter__(self):
+        return iter(self._row)
+        
+    def __getitem__(self, num):
+        rec = self.index[self._row[int(num)]]
+        shape = tuple(rec['shape'])
+        dtype_image, dtype_bkg = rec['dtype_image'].decode(), rec['dtype_bkg'].decode()
+        size_image, size_bkg, _ = _thumb_block_sizes(shape, dtype_image, dtype_bkg)
+        
+        def read(start, dtype):
+            nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            return self._data[start:start+nbytes].view(dtype).reshape(shape)
+        
+        start = rec['offset']
+        
+        return {"image": read(start, dtype_image),
+                "bkg": read(start+size_image, dtype_bkg),
+                "mask": read(start+size_image+size_bkg, bool),
+                "center": rec['center'].copy()}
+    
+
+def save_thumbnails(res_thumb, filename):
+    """ Save a dict of thumbnails {NUMBER: thumb} as a thumbnail store. """
+    logger.info(f"Saving thumbnails to {filename}")
+    with ThumbnailWriter(filename) as writer:
+        for num, thumb in res_thumb.items():
+            writer[num] = thumb
+
+def load_thumbnails(filename):
+    """ Open a thumbnail store. Pickled thumbnails (.pkl) are also read. """
+    if filename.endswith('.pkl'):
+        return load_pickle(filename)
+    
+    logger.info(f"Read from {filename}")
+    if not os.path.exists(filename):
+        filename_pkl = os.path.splitext(filename)[0] + '.pkl'
+        if os.path.exists(filename_pkl):
+            return load_pickle(filename_pkl)
+        msg = f'{filename} not found!'
+        logger.error(msg)
+        raise FileNotFoundError(msg)
+        
+    return ThumbnailStore(filename)
+
+### FITS FRAME ###
+class Frame:
+    """
+    A FITS frame opened with memmap. Pixels are read from disk only
+    where they are accessed and cutouts are views of the memory map.
+    Use open_frame to share one Frame of a file across the pipeline.
+    
+    Parameters
+    ----------
+    hdu_path : str
+        Path of the FITS file.
+    ext : int, optional, default 0
+        Extension of the image.
+    
+    Notes
+    -----
+    Scaled data (BSCALE/BZERO) are read into memory by astropy on access.
+    
+    """
+    
+    def __init__(self, hdu_path, ext=0):
+        from astropy.io import fits
+        
+        self.hdu_path = hdu_path
+        self.ext = ext
+        self.hdul = fits.open(hdu_path, memmap=True)
+        self.header = self.hdul[ext].header
+        self._data, self._wcs = None, None
+        
+    def __str__(self):
+        return "A Frame Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} for {self.hdu_path} shape={self.shape}"
+        
+    def __reduce__(self):
+        # Pickled by path, reopened (once) in other processes
+        return (open_frame, (self.hdu_path, self.ext))
+    
+    @property
+    def shape(self):
+        return (self.header['NAXIS2'], self.header['NAXIS1'])
+        
+    @property
+    def data(self):
+        """ Memory-mapped image """
+        if self._data is None:
+            self._data = self.hdul[self.ext].data
+        return self._data
+        
+    @property
+    def wcs(self):
+        if self._wcs is None:
+            from astropy.wcs import WCS
+            self._wcs = WCS(self.header)
+        return self._wcs
+        
+    def cutout(self, bounds, return_wcs=False):
+        """ View of the image (and the wcs) within bounds [Xmin, Ymin, Xmax, Ymax] """
+        from .utils import crop_image
+        if return_wcs:
+            return crop_image(self.data, bounds, wcs=self.wcs)
+        else:
+            return crop_image(self.data, bounds)
+        
+    def close(self):
+        self._data = None
+        self.hdul.close()
+        _frames.pop(getattr(self, '_key', None), None)
+        
+        
+# Frames opened by open_frame
+_frames = {}
+
+def open_frame(hdu_path, ext=0):
+    """
+    Open a FITS frame with memmap. The same Frame is returned for the
+    same file (unless modified since), so the frame is opened once and
+    shared by the steps of the pipeline. Frames of earlier versions of
+    the file are closed.
+    
+    """
+    path = os.path.abspath(hdu_path)
+    key = (path, ext, os.path.getmtime(path))
+    
+    frame = _frames.get(key)
+    if frame is None:
+        for key_old in [k for k in _frames if k[:2] == key[:2]]:
+            _frames[key_old].close()
+        frame = Frame(hdu_path, ext)
+        frame._key = key
+        _frames[key] = frame
+        
+    return frame
+
 def load_config(filename):
     """ Read a yaml configuration. """
     
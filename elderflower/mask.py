@@ -330,31 +330,24 @@ class Mask:
         
         if stars.n_verybright > 0:
             # Strip + Cross mask
-            mask_strip_s, mask_cross_s =  make_mask_strip(stars, self.xx, self.yy,
-                                                          pad=pad, n_strip=n_strip,
-                                                          wid_strip=wid_strip_pix,
-                                                          dist_strip=dist_strip_pix,
-                                                          wid_cross=wid_cross_pix,
-                                                          dist_cross=dist_cross_pix)
-
-            # combine strips
-            mask_strip_all = ~np.logical_or.reduce(mask_strip_s)
-            mask_cross_all = ~np.logical_or.reduce(mask_cross_s)
+            mask_strip, mask_cross, ma_example = make_mask_strip(stars, self.xx, self.yy,
+                                                                 pad=pad, n_strip=n_strip,
+                                                                 wid_strip=wid_strip_pix,
+                                                                 dist_strip=dist_strip_pix,
+                                                                 wid_cross=wid_cross_pix,
+                                                                 dist_cross=dist_cross_pix)
             
             seg_deep0 = self.seg_deep0
             
             # combine deep, crosses and strips
             seg_comb0 = seg_deep0.copy()
-            ma_extra = (mask_strip_all|~mask_cross_all) & (seg_deep0==0)
+            ma_extra = (~mask_strip|mask_cross) & (seg_deep0==0)
             seg_comb0[ma_extra] = seg_deep0.max()-2
             mask_comb0 = (seg_comb0!=0)
             
             # assign attribute
             self.mask_comb0 = mask_comb0
             self.seg_comb0 = seg_comb0
-            
-            # example mask for the brightest star
-            ma_example = mask_strip_s[0], mask_cross_s[0]
         
         else:
             if self.verbose:
@@ -482,6 +475,41 @@ def make_mask_map_core(image_shape, star_pos, r_core=12):
     return mask_core, segmap
 
 
+def make_mask_discs(xx, yy, pos, radii, inclusive=False):
+    """
+    Union of discs centered at pos with radii on the grid (xx, yy).
+    Each disc is only evaluated within its bounding box.
+    
+    Parameters
+    ----------
+    xx, yy : 2d array
+        Coordinates of the grid (as from np.mgrid)
+    pos : 2d array
+        Centers of the discs
+    radii : 1d array
+        Radii of the discs
+    inclusive : bool, optional, default False
+        Whether pixels at r = radius are included
+    
+    Returns
+    -------
+    mask : 2d bool array
+    
+    """
+    mask = np.zeros(xx.shape, dtype=bool)
+    x_grid, y_grid = xx[0], yy[:,0]
+    
+    for (x_c, y_c), r in zip(pos, radii):
+        x0, x1 = np.searchsorted(x_grid, x_c-r), np.searchsorted(x_grid, x_c+r, side='right')
+        y0, y1 = np.searchsorted(y_grid, y_c-r), np.searchsorted(y_grid, y_c+r, side='right')
+        
+        rr = np.sqrt((x_grid[x0:x1][None,:]-x_c)**2 + (y_grid[y0:y1][:,None]-y_c)**2)
+        disc = (rr <= r) if inclusive else (rr < r)
+        mask[y0:y1, x0:x1] |= disc
+        
+    return mask
+
+
 def make_mask_map_dual(image, stars,
                        xx=None, yy=None,
                        mask_type='aper', pad=0,
@@ -527,7 +555,7 @@ def make_mask_map_dual(image, stars,
         if r_out is not None:
             if len(np.unique(r_out)) == 1:
                 r_out_A, r_out_B = r_out, r_out
-                r_out_s = np.ones(len(star_pos)) * r_out_s
+                r_out_s = np.ones(len(star_pos)) * r_out
             else:
                 r_out_A, r_out_B = r_out[:2]
                 r_out_s = np.array([r_out_A if F >= stars.F_verybright else r_out_B
@@ -558,10 +586,11 @@ def make_mask_map_dual(image, stars,
         max_lab = segm_deb.max_label
 
         # remove S/N mask map for input (bright) stars
-        for pos in star_pos:
-            rr2 = (xx-pos[0])**2+(yy-pos[1])**2
-            lab = segmap[np.where(rr2==np.min(rr2))][0]
-            segmap[segmap==lab] = 0
+        # labels are read at the nearest pixel of each star
+        ix = np.argmin(abs(xx[0][None,:] - star_pos[:,:1]), axis=1)
+        iy = np.argmin(abs(yy[:,0][None,:] - star_pos[:,1:]), axis=1)
+        labs = segmap[iy, ix]
+        segmap[np.isin(segmap, labs[labs>0])] = 0
             
     if seg_base is not None:
         segmap2 = seg_base
@@ -580,14 +609,12 @@ def make_mask_map_dual(image, stars,
         # mask core for bright stars out to given radii
         if verbose:
             logger.info("Mask core regions: r < %d (VB) /%d (MB) pix"%(r_core_A, r_core_B))
-        core_region = np.logical_or.reduce([np.sqrt((xx-pos[0])**2+(yy-pos[1])**2) < r
-                                            for (pos,r) in zip(star_pos,r_core_s)])
+        core_region = make_mask_discs(xx, yy, star_pos, r_core_s)
         mask_star = core_region.copy()
 
         if r_out is not None:
             # mask outer region for bright stars out to given radii
-            outskirt = np.logical_and.reduce([np.sqrt((xx-pos[0])**2+(yy-pos[1])**2) > r
-                                             for (pos,r) in zip(star_pos,r_out_s)])
+            outskirt = ~make_mask_discs(xx, yy, star_pos, r_out_s, inclusive=True)
             mask_star = (mask_star) | (outskirt)
     
     elif mask_type == 'brightness':
@@ -613,29 +640,64 @@ def make_mask_map_dual(image, stars,
 def make_mask_strip(stars, xx, yy, pad=0, n_strip=24,
                     wid_strip=12, dist_strip=720,
                     wid_cross=8, dist_cross=72, verbose=True):
-    """ Make mask map in strips with width *in pixel unit* """
+    """
+    Make mask map in strips with width *in pixel unit*.
+    
+    Masks of very bright stars are accumulated in one map. For each star,
+    only pixels within dist_strip are evaluated, and the distance to the
+    nearest strip is computed from the polar angle of the pixel in one pass.
+    
+    Returns
+    -------
+    mask_strip : 2d bool array
+        Union of strip masks of very bright stars.
+    mask_cross : 2d bool array
+        Union of cross (spike) masks of very bright stars.
+    ma_example : tuple of 2d bool array
+        Strip and cross mask of the first very bright star (for display).
+    
+    """
     if verbose:
         logger.info("Making sky strips crossing very bright stars...")
     
-    if stars.n_verybright>0:
-        mask_strip_s = np.empty((stars.n_verybright, xx.shape[0], xx.shape[1]))
-        mask_cross_s = np.empty_like(mask_strip_s)
-    else:
-        return None, None
+    if stars.n_verybright==0:
+        return None, None, None
+    
+    mask_strip = np.zeros(xx.shape, dtype=bool)
+    mask_cross = np.zeros(xx.shape, dtype=bool)
+    
+    # Grid coordinates along each axis
+    x_grid, y_grid = xx[0], yy[:,0]
     
     star_pos = stars.star_pos_verybright + pad
     
-    phi_s = np.linspace(-90, 90, n_strip+1)
-    a_s = np.tan(phi_s*np.pi/180)
+    # Strips are evenly spaced in angle from -90 deg
+    d_phi = np.pi / n_strip
+    
+    # Half size of the bounding window
+    dist_max = max(dist_strip, dist_cross)
     
     for k, (x_b, y_b) in enumerate(star_pos):
-        m_s = (y_b-a_s*x_b)
-        mask_strip = np.logical_or.reduce([abs((yy-a*xx-m)/math.sqrt(1+a**2)) < wid_strip 
-                                           for (a, m) in zip(a_s, m_s)])
-        mask_cross = np.logical_or.reduce([abs(yy-y_b)<wid_cross, abs(xx-x_b)<wid_cross])
-        dist_map1 = np.sqrt((xx-x_b)**2+(yy-y_b)**2) < dist_strip
-        dist_map2 = np.sqrt((xx-x_b)**2+(yy-y_b)**2) < dist_cross
-        mask_strip_s[k] = mask_strip & dist_map1
-        mask_cross_s[k] = mask_cross & dist_map2
-
-    return mask_strip_s, mask_cross_s
+        x0, x1 = np.searchsorted(x_grid, [x_b-dist_max, x_b+dist_max], side='right')
+        y0, y1 = np.searchsorted(y_grid, [y_b-dist_max, y_b+dist_max], side='right')
+        
+        dx = x_grid[x0:x1][None,:] - x_b
+        dy = y_grid[y0:y1][:,None] - y_b
+        r = np.sqrt(dx**2 + dy**2)
+        
+        # Angle to the nearest strip
+        dphi = np.mod(np.arctan2(dy, dx) + np.pi/2, d_phi)
+        dphi = np.minimum(dphi, d_phi - dphi)
+        
+        strip = (r * np.sin(dphi) < wid_strip) & (r < dist_strip)
+        cross = ((abs(dy) < wid_cross) | (abs(dx) < wid_cross)) & (r < dist_cross)
+        
+        mask_strip[y0:y1, x0:x1] |= strip
+        mask_cross[y0:y1, x0:x1] |= cross
+        
+        if k == 0:
+            ma_example = np.zeros(xx.shape, dtype=bool), np.zeros(xx.shape, dtype=bool)
+            ma_example[0][y0:y1, x0:x1] = strip
+            ma_example[1][y0:y1, x0:x1] = cross
+    
+    return mask_strip, mask_cross, ma_example
@@ -5,6 +5,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from scipy import stats
+from scipy import fft as sp_fft
 from scipy.integrate import quad
 from scipy.spatial import distance
 from scipy.special import gamma as Gamma
@@ -26,6 +27,7 @@ except ImportError:
     
 
 from copy import deepcopy
+from collections import OrderedDict
 from numpy.polynomial.legendre import leggrid2d
 from itertools import combinations
 from functools import partial, lru_cache
@@ -39,6 +41,7 @@ except ImportError:
     
 from .numeric import *
 from .io import logger
+from .profiling import stage
 from .utils import Intensity2SB, SB2Intensity
 from .utils import round_good_fft, calculate_psf_size
 from .utils import NormalizationError
@@ -48,6 +51,31 @@ from . import DF_pixel_scale
 # Functions for making PSF models
 ############################################
 
+class _ParamState:
+    """ Fixed-layout float arrays of PSF parameters overwritten in place """
+    
+    __slots__ = ('arrays',)
+    
+    def __init__(self):
+        self.arrays = {}
+        
+    def _buffer(self, key, shape):
+        buf = self.arrays.get(key)
+        if (buf is None) or (buf.shape != shape):
+            buf = self.arrays[key] = np.empty(shape)
+        return buf
+        
+    def set(self, key, val):
+        """ Copy val into the array of key """
+        buf = self._buffer(key, np.shape(val))
+        buf[...] = val
+        return buf
+    
+    def divide(self, key, val, scale):
+        """ Write val / scale into the array of key """
+        return np.divide(val, scale, out=self._buffer(key, np.shape(val)))
+    
+    
 class PSF_Model:
     """ A PSF Model object """
     
@@ -71,7 +99,7 @@ class PSF_Model:
         for key, val in params.items():
             if type(val) is list:
                 params[key] = val = np.array(val)
-            exec('self.' + key + ' = val')
+            setattr(self, key, val)
             
         self.params = params
         
@@ -108,8 +136,7 @@ class PSF_Model:
         
         for key, val in self.params.items():
             if ('gamma' in key) | ('theta' in key):
-                val = val / pixel_scale
-                exec('self.' + key + '_pix' + ' = val')
+                setattr(self, key + '_pix', val / pixel_scale)
                 
     def update(self, params):
         """ Update PSF parameters from dictionary keys """
@@ -118,7 +145,7 @@ class PSF_Model:
             if np.ndim(val) > 0:
                 val = np.array(val)
                 
-            exec('self.' + key + ' = val')
+            setattr(self, key, val)
             self.params[key] = val
             
         if 'fwhm' in params.keys():
@@ -131,7 +158,52 @@ class PSF_Model:
             pass
             
         self.pixelize(pixel_scale)
-                
+        
+    def update_fast(self, n_s=None, theta_s=None, frac=None,
+                    gamma1=None, beta1=None):
+        """
+        Update aureole parameters in place, for use in the likelihood.
+        
+        Same as update() for these parameters, but n_s, theta_s and
+        theta_s_pix are kept in fixed-layout arrays owned by the model
+        and overwritten by each call, and only the affected *_pix
+        attributes are recomputed. Arrays of the model are therefore
+        not safe to keep across calls: copy them if needed.
+        
+        Parameters
+        ----------
+        n_s : 1d array, optional
+            Power indices of the multi-power aureole.
+        theta_s : 1d array, optional
+            Transition radii (in arcsec) of the multi-power aureole.
+        frac : float, optional
+            Fraction of the aureole.
+        gamma1, beta1 : float, optional
+            Parameters of the moffat aureole.
+        
+        """
+        state, params = self._state, self.params
+        
+        if n_s is not None:
+            self.n_s = params['n_s'] = state.set('n_s', n_s)
+        if theta_s is not None:
+            self.theta_s = params['theta_s'] = state.set('theta_s', theta_s)
+            self.theta_s_pix = state.divide('theta_s_pix', self.theta_s, self.pixel_scale)
+        if frac is not None:
+            self.frac = params['frac'] = frac
+        if gamma1 is not None:
+            self.gamma1 = params['gamma1'] = gamma1
+            self.gamma1_pix = gamma1 / self.pixel_scale
+        if beta1 is not None:
+            self.beta1 = params['beta1'] = beta1
+    
+    @property
+    def _state(self):
+        """ Fixed-layout arrays of parameters updated by update_fast """
+        if '_param_state' not in self.__dict__:
+            self._param_state = _ParamState()
+        return self._param_state
+        
     def copy(self):
         """ A deep copy of the object """
         return deepcopy(self)            
@@ -496,6 +568,12 @@ class Stars:
     """
     Class storing positions & flux of faint/medium-bright/bright stars
     
+    The partitions of stars are fixed at initialization and stored as
+    read-only masks, indices (idx_*) and positions (star_pos_*). Flux and
+    z_norm are kept in buffers updated in place (update_Flux, update_z_norm),
+    and their subsets (Flux_*, z_norm_*) are taken into buffers on access,
+    which are valid until the next update.
+    
     """
     def __init__(self, star_pos, Flux, 
                  Flux_threshold=[2.7e5, 2.7e6],
@@ -518,21 +596,27 @@ class Stars:
             sky background value
                 
         """
-        self.star_pos = np.atleast_2d(star_pos)
-        self.Flux = np.atleast_1d(Flux)
+        self.star_pos = np.array(np.atleast_2d(star_pos), dtype=float)
+        self.star_pos.setflags(write=False)
+        
         self.Flux_threshold = Flux_threshold
 
         self.F_bright = Flux_threshold[0]
         self.F_verybright = Flux_threshold[1]
         
         self.n_tot = len(star_pos)
-    
-        self.bright = (self.Flux >= self.F_bright)
-        self.verybright = (self.Flux >= self.F_verybright)
-        self.medbright = self.bright & (~self.verybright)
+        
+        # Partitions of stars are fixed by the initial flux
+        Flux = np.asarray(np.atleast_1d(Flux), dtype=float)
+        self._set_partitions(Flux)
+        
+        # Buffers updated in place, and subsets of them taken on access
+        self._bufs = {}
+        self._stale = set()
+        self.update_Flux(Flux)
         
         if z_norm is not None:
-            self.z_norm = z_norm
+            self.update_z_norm(z_norm)
             
         self.r_scale = r_scale
         self.BKG = BKG
@@ -542,7 +626,86 @@ class Stars:
 
     def __repr__(self):
         return ' N='.join([f"{self.__class__.__name__}", str(self.n_tot)])
-
+    
+    def __setstate__(self, state):
+        if '_bufs' not in state:
+            # Objects pickled before the buffers were introduced
+            Flux, z_norm = state.pop('Flux'), state.pop('z_norm', None)
+            for key in list(state):
+                if key.startswith(('n_', 'star_pos_')) and key != 'n_tot':
+                    state.pop(key)
+            self.__dict__.update(state)
+            self.star_pos = np.array(self.star_pos, dtype=float)
+            self.star_pos.setflags(write=False)
+            self._set_partitions(Flux)
+            self._bufs, self._stale = {}, set()
+            self.update_Flux(Flux)
+            if z_norm is not None:
+                self.update_z_norm(z_norm)
+        else:
+            self.__dict__.update(state)
+    
+    def _set_partitions(self, Flux):
+        """ Read-only masks, indices and positions of the star partitions """
+        bright = (Flux >= self.F_bright)
+        verybright = (Flux >= self.F_verybright)
+        parts = dict(faint=~bright, bright=bright,
+                     medbright=bright & (~verybright), verybright=verybright)
+        
+        for name, part in parts.items():
+            idx = np.flatnonzero(part)
+            star_pos = self.star_pos[idx]
+            for arr in (part, idx, star_pos):
+                arr.setflags(write=False)
+            if name != 'faint':
+                setattr(self, name, part)
+            setattr(self, 'idx_' + name, idx)
+            setattr(self, 'star_pos_' + name, star_pos)
+    
+    def _update(self, key, val, offset=0):
+        """ Write val + offset into the buffer of key.
+            Subsets are taken later on access. """
+        if np.shape(val) != (self.n_tot,):
+            raise ValueError(f"{key} needs to be of shape ({self.n_tot},).")
+        buf = self._bufs.get(key)
+        if buf is None:
+            buf = self._bufs[key] = np.empty(self.n_tot)
+        np.add(val, offset, out=buf)
+        self._stale.update((key, name) for name in
+                           ('faint', 'bright', 'medbright', 'verybright'))
+        
+    def _subset(self, key, name):
+        """ Buffer of key in the partition name (valid until the next update) """
+        if key not in self._bufs:
+            raise AttributeError(f"{key} is not given.")
+        out = self._bufs.get((key, name))
+        if (key, name) in self._stale:
+            idx = getattr(self, 'idx_' + name)
+            if out is None:
+                out = self._bufs[(key, name)] = np.empty(len(idx))
+            np.take(self._bufs[key], idx, out=out)
+            self._stale.discard((key, name))
+        return out
+    
+    @property
+    def Flux(self):
+        return self._bufs['Flux']
+    
+    @Flux.setter
+    def Flux(self, Flux):
+        self.update_Flux(Flux)
+    
+    @property
+    def z_norm(self):
+        try:
+            return self._bufs['z_norm']
+        except KeyError:
+            raise AttributeError("z_norm is not given.")
+    
+    @z_norm.setter
+    def z_norm(self, z_norm):
+        self.update_z_norm(z_norm)
+        
     @classmethod            
     def from_znorm(cls, psf, star_pos, z_norm,
                    z_threshold=[10, 300], r_scale=12):
@@ -554,7 +717,20 @@ class Stars:
                    z_norm=z_norm, r_scale=r_scale)
     
     def update_Flux(self, Flux):
-        self.Flux = Flux
+        """ Update flux of stars in place """
+        self._update('Flux', Flux)
+        
+    def update_z_norm(self, z_norm, offset=0):
+        """ Update flux scaling of stars (plus an offset, e.g. of background) in place """
+        self._update('z_norm', z_norm, offset)
+        
+    def z_norm_work(self):
+        """ A copy of z_norm in a work buffer, overwritten by the next call """
+        work = self._bufs.get('z_norm_work')
+        if work is None:
+            work = self._bufs['z_norm_work'] = np.empty(self.n_tot)
+        work[...] = self.z_norm
+        return work
     
     def _info(self):
         Flux = self.Flux
@@ -578,61 +754,45 @@ class Stars:
             logger.debug(msg)
             self.parallel = True
             
-    @lazyproperty
+    @property
     def n_faint(self):
-        return np.sum(~self.bright)
+        return len(self.idx_faint)
 
-    @lazyproperty
+    @property
     def n_bright(self):
-        return np.sum(self.bright)
+        return len(self.idx_bright)
 
-    @lazyproperty
+    @property
     def n_verybright(self):
-        return np.sum(self.verybright)
+        return len(self.idx_verybright)
 
-    @lazyproperty
+    @property
     def n_medbright(self):
-        return np.sum(self.medbright)
+        return len(self.idx_medbright)
 
     @property
     def Flux_faint(self):
-        return self.Flux[~self.bright]
+        return self._subset('Flux', 'faint')
 
     @property
     def Flux_bright(self):
-        return self.Flux[self.bright]
+        return self._subset('Flux', 'bright')
 
     @property
     def Flux_verybright(self):
-        return self.Flux[self.verybright]
+        return self._subset('Flux', 'verybright')
 
     @property
     def Flux_medbright(self):
-        return self.Flux[self.medbright]
+        return self._subset('Flux', 'medbright')
 
     @property
     def z_norm_bright(self):
-        return self.z_norm[self.bright]
+        return self._subset('z_norm', 'bright')
     
     @property
     def z_norm_verybright(self):
-        return self.z_norm[self.verybright]
-    
-    @lazyproperty
-    def star_pos_faint(self):
-        return self.star_pos[~self.bright]
-
-    @lazyproperty
-    def star_pos_bright(self):
-        return self.star_pos[self.bright]
-
-    @lazyproperty
-    def star_pos_verybright(self):
-        return self.star_pos[self.verybright]
-
-    @lazyproperty
-    def star_pos_medbright(self):
-        return self.star_pos[self.medbright]
+        return self._subset('z_norm', 'verybright')
             
     def plot_flux_dist(self, **kwargs):
         from .plotting import plot_flux_dist
@@ -674,7 +834,29 @@ class Stars:
                           self.Flux_threshold, self.z_norm[~remove],
                           r_scale=self.r_scale, BKG=self.BKG)
         return stars_new
-     
+
+    def downsample(self, factor):
+        """
+        Stars on an image block-averaged by factor (see utils.block_downsample).
+
+        Positions and r_scale are rescaled to the new pixels. Block-averaging
+        keeps the surface brightness, so z_norm is unchanged while the flux
+        (and its thresholds) per pixel area decrease by factor^2, which keeps
+        the partitions of stars.
+
+        """
+        from .utils import transform_rescale
+
+        scale, area = 1./factor, float(factor)**2
+
+        stars_ds = Stars(transform_rescale(self.star_pos, scale),
+                         self.Flux / area,
+                         Flux_threshold=[F / area for F in self.Flux_threshold],
+                         z_norm=self.z_norm if 'z_norm' in self._bufs else None,
+                         r_scale=self.r_scale * scale, BKG=self.BKG)
+
+        return stars_ds
+
     def save(self, name='stars', save_dir='./'):
         from .io import save_pickle
         save_pickle(self, os.path.join(save_dir, name+'.pkl'), 'Star model')
@@ -723,10 +905,254 @@ def multi_power2d(xx, yy, n_s, theta_s, I_theta0, cen, clear=False):
     for k in range(len(a_s)):
         reg = (rr>theta_s[k]) & (rr<=theta_s[k+1]) if k<len(a_s)-1 else (rr>theta_s[k])     
         z[reg] = a_s[k] * np.power(rr[reg], -n_s[k])
-        
+
     return z.reshape(xx.shape)
 
 
+class RadialProfileEngine:
+    """
+    A lookup engine for drawing aureoles of (very bright) stars in real space.
+
+    Distances from stars to the pixels to be drawn are computed once and
+    stored in a single index sorted by radius. Each drawing only evaluates
+    the (multi-)power law as a 1D function of radius, with the components
+    found as contiguous segments of the index.
+
+    """
+
+    def __init__(self, star_pos, image_shape, mask=None):
+        """
+        Parameters
+        ----------
+        star_pos : 2d array
+            pixel positions of stars (0-based)
+        image_shape : (int, int)
+            shape of the image to be drawn
+        mask : 2d bool array, optional
+            mask map (masked region is 1). Masked pixels are not drawn.
+
+        """
+        self.star_pos = np.atleast_2d(star_pos)
+        self.image_shape = image_shape
+        self.n_star = len(self.star_pos)
+
+        nY, nX = image_shape
+        if mask is None:
+            pix = np.arange(nY * nX)
+        else:
+            pix = np.flatnonzero(~mask)
+
+        # flat indices of pixels to be drawn
+        self.pix = pix
+        self.n_pix = n_pix = len(pix)
+
+        y_pix, x_pix = np.divmod(pix, nX)
+
+        log_r = np.empty((self.n_star, n_pix))
+        for i, (x0, y0) in enumerate(self.star_pos):
+            rr = np.sqrt((x_pix-x0)**2 + (y_pix-y0)**2)
+            log_r[i] = np.log(np.maximum(rr, 1e-6))
+
+        # Sort (star, pixel) pairs by radius
+        order = np.argsort(log_r, axis=None)
+        star_index, pix_index = np.divmod(order, n_pix)
+
+        self.log_r = log_r.ravel()[order]
+        self.star_index = star_index.astype(np.int32)
+        self.pix_index = pix_index.astype(np.int32)
+
+    def __str__(self):
+        return "A Radial Profile Engine Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} N={self.n_star} npix={self.n_pix}"
+
+    def evaluate(self, n_s, theta_s, I_theta0):
+        """
+        Sum of (multi-)power law aureoles on the drawn pixels.
+
+        Parameters
+        ----------
+        n_s : 1d array
+            power indices of components
+        theta_s : 1d array
+            transition radii of components in pix
+        I_theta0 : 1d array
+            intensity at theta_s[0] of each star
+
+        Returns
+        ----------
+        z : 1d array
+            intensity of drawn pixels
+
+        """
+        z, edges = self.profile(n_s, theta_s)
+
+        z *= np.atleast_1d(I_theta0)[self.star_index]
+
+        return np.bincount(self.pix_index, weights=z, minlength=self.n_pix)
+
+    def profile(self, n_s, theta_s):
+        """
+        Unit (I_theta0=1) aureole of (star, pixel) pairs sorted by radius.
+
+        Returns
+        ----------
+        u : 1d array
+            intensity of pairs
+        edges : 1d array
+            component k is in u[edges[k]:edges[k+1]], inside theta_s[0]
+            is u[:edges[0]]
+
+        """
+        n_s, theta_s = np.atleast_1d(n_s), np.atleast_1d(theta_s)
+
+        if len(n_s) > 1:
+            a_s = compute_multi_pow_norm(n_s, theta_s, 1)
+        else:
+            a_s = theta_s**n_s  # truncated single power law
+
+        log_r = self.log_r
+
+        # Component k is in between edges[k] and edges[k+1]
+        edges = np.searchsorted(log_r, np.log(theta_s), side='right')
+        edges = np.append(edges, len(log_r))
+
+        u = np.empty(len(log_r))
+        u[:edges[0]] = 1.  # flattened inside theta0
+
+        for k in range(len(n_s)):
+            seg = slice(edges[k], edges[k+1])
+            u[seg] = np.exp(math.log(a_s[k]) - n_s[k] * log_r[seg])
+
+        return u, edges
+
+    def gradient(self, w, n_s, theta_s, I_theta0):
+        """
+        Gradient of sum(w * z) with z = evaluate(n_s, theta_s, I_theta0).
+
+        The profile is continuous at the transition radii, so only the
+        power laws within components are differentiated.
+
+        Parameters
+        ----------
+        w : 1d array
+            weights of drawn pixels (e.g. derivative of the likelihood)
+        n_s, theta_s, I_theta0 :
+            same as evaluate
+
+        Returns
+        ----------
+        grad_n : 1d array
+            derivative w.r.t. n_s
+        grad_log_theta : 1d array
+            derivative w.r.t. natural logarithm of theta_s
+        grad_I0 : 1d array
+            derivative w.r.t. I_theta0 of each star
+
+        """
+        n_s, theta_s = np.atleast_1d(n_s), np.atleast_1d(theta_s)
+        n_comp = len(n_s)
+        log_theta = np.log(theta_s)
+
+        u, edges = self.profile(n_s, theta_s)
+
+        # Weighted pairs
+        u *= w[self.pix_index]
+        grad_I0 = np.bincount(self.star_index, weights=u, minlength=self.n_star)
+
+        u *= np.atleast_1d(I_theta0)[self.star_index]
+
+        # Sum of weighted pairs (and times ln r) in each component
+        S0, S1 = np.empty(n_comp), np.empty(n_comp)
+        for k in range(n_comp):
+            seg = slice(edges[k], edges[k+1])
+            S0[k] = np.sum(u[seg])
+            S1[k] = np.dot(u[seg], self.log_r[seg])
+
+        # ln u_k = n_0 ln theta_0 + sum_{j=1..k} (n_j - n_{j-1}) ln theta_j - n_k ln r
+        S0_after = np.cumsum(S0[::-1])[::-1]    # sum over components >= k
+        grad_n = log_theta * S0 - S1
+        grad_n[:-1] -= log_theta[1:] * S0_after[1:]
+        grad_n[:-1] += log_theta[:-1] * S0_after[1:]
+
+        grad_log_theta = np.diff(n_s, prepend=0) * S0_after
+
+        return grad_n, grad_log_theta, grad_I0
+
+    def evaluate_batch(self, n_s, theta_s, I_theta0):
+        """
+        Same as evaluate but for a batch of M parameter sets sharing the
+        radius index.
+
+        Parameters
+        ----------
+        n_s : 2d array
+            power indices of components (M x n_comp)
+        theta_s : 2d array
+            transition radii of components in pix (M x n_comp)
+        I_theta0 : 2d array
+            intensity at theta_s[0] of each star (M x n_star)
+
+        Returns
+        ----------
+        z : 2d array
+            intensity of drawn pixels (M x n_pix)
+
+        """
+        n_s, theta_s = np.atleast_2d(n_s), np.atleast_2d(theta_s)
+        I_theta0 = np.atleast_2d(I_theta0)
+
+        z = np.empty((len(n_s), self.n_pix))
+        for m in range(len(n_s)):
+            z[m] = self.evaluate(n_s[m], theta_s[m], I_theta0[m])
+
+        return z
+
+    def profile_params(self, psf):
+        """ Power indices, transition radii (in pix) and flux-to-amplitude
+            conversion of the aureole of the PSF model. """
+        if psf.aureole_model == "power":
+            n_s, theta_s_pix = np.array([psf.n0]), np.array([psf.theta_0_pix])
+            Flux2Amp = lambda F: power2d_Flux2Amp(psf.n0, psf.theta_0_pix, Flux=1) * F
+
+        elif psf.aureole_model == "multi-power":
+            n_s, theta_s_pix = psf.n_s, psf.theta_s_pix
+            Flux2Amp = lambda F: multi_power2d_Flux2Amp(n_s, theta_s_pix, Flux=1) * F
+
+        else:
+            raise ValueError(f"{psf.aureole_model} aureole is not supported.")
+
+        return n_s, theta_s_pix, Flux2Amp
+
+    def draw(self, psf, Flux=None, I0=None, flat=False):
+        """
+        Draw aureoles given the PSF model and flux / amplitude (of aureole)
+        of stars. Same as PSF_Model.draw_aureole2D_in_real, but returns the
+        image directly. Pixels not drawn are zero.
+        If flat is True, return a 1d array of the drawn pixels (self.pix).
+
+        """
+        n_s, theta_s_pix, Flux2Amp = self.profile_params(psf)
+
+        if I0 is None:
+            I_theta0 = Flux2Amp(Flux)
+        elif Flux is None:
+            I_theta0 = I0
+        else:
+            raise NormalizationError("Both Flux and I0 are not given.")
+
+        z = self.evaluate(n_s, theta_s_pix, I_theta0)
+
+        if flat:
+            return z
+
+        image = np.zeros(self.image_shape)
+        image.flat[self.pix] = z
+
+        return image
+
+
 ############################################
 # Functions for PSF rendering with Galsim
 ############################################
@@ -765,8 +1191,9 @@ def get_stamp_bounds(k, star_pos, Flux,
     # Account for the fractional part of the position
     (ix_nominal, iy_nominal), offset = get_center_offset(pos)
 
-    stamp = star.drawImage(nx=psf_size, ny=psf_size, scale=pixel_scale,
-                           offset=offset, method='no_pixel')
+    with stage('draw_image'):
+        stamp = star.drawImage(nx=psf_size, ny=psf_size, scale=pixel_scale,
+                               offset=offset, method='no_pixel')
     stamp.setCenter(ix_nominal, iy_nominal)
     
     bounds = stamp.bounds & full_image.bounds
@@ -774,6 +1201,247 @@ def get_stamp_bounds(k, star_pos, Flux,
     return stamp, bounds
 
 
+class StampCache:
+    """
+    A LRU cache of unit-flux PSF stamps (core + aureole) drawn by galsim.
+    
+    Stamps are keyed on the PSF parameters quantized by the given steps
+    and on the sub-pixel offset of stars binned into n_offset x n_offset
+    bins. A stamp is drawn with the PSF of the first proposal falling in
+    its key and reused by later (nearby) proposals.
+    
+    """
+    
+    def __init__(self, maxsize=128, n_offset=4,
+                 dn=0.01, dlogtheta=0.01, dfrac=0.005,
+                 n_slot=None, shared=True):
+        """
+        Parameters
+        ----------
+        maxsize : max number of stamps stored (default: 8 PSF keys
+                  of n_offset x n_offset bins)
+        n_offset : number of sub-pixel offset bins along each axis
+        dn : quantization step of power indices (or moffat beta)
+        dlogtheta : quantization step of log transition radii (or moffat gamma)
+        dfrac : quantization step of the aureole fraction
+        n_slot : number of rows (processes) of the counters. Default is profiling.N_SLOT.
+        shared : whether to keep the counters in shared memory, so that
+                 hits and misses in the workers of a pool are counted
+        
+        """
+        self.maxsize = maxsize
+        self.n_offset = n_offset
+        self.dn = dn
+        self.dlogtheta = dlogtheta
+        self.dfrac = dfrac
+        
+        self._stamps = OrderedDict()
+        
+        # Hits and misses of each process (see profiling.StageTimer)
+        from .profiling import N_SLOT, get_slot_table
+        get_slot_table()
+        if n_slot is None:
+            n_slot = N_SLOT
+        counts = np.zeros((n_slot, 2), dtype=np.int64)
+        if shared:
+            from .parallel import share_array
+            counts = share_array(counts)
+        self.counts = counts
+        self._slot, self._pid = None, None
+        
+    def __str__(self):
+        return "A Stamp Cache Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} N={len(self)} hits={self.hits} misses={self.misses}"
+    
+    def __len__(self):
+        return len(self._stamps)
+    
+    def _counter(self):
+        """ Row of the counters of the current process """
+        if self._pid != os.getpid():
+            # The row is looked up again in forked processes
+            from .profiling import _worker_slot
+            self._slot, self._pid = _worker_slot(len(self.counts)), os.getpid()
+        if self._slot is None:
+            # No free row: not counted
+            return np.zeros(2, dtype=np.int64)
+        return self.counts[self._slot]
+    
+    @property
+    def hits(self):
+        """ Number of hits summed over processes """
+        return int(self.counts[:, 0].sum())
+    
+    @property
+    def misses(self):
+        """ Number of misses summed over processes """
+        return int(self.counts[:, 1].sum())
+    
+    @property
+    def hit_rate(self):
+        n_call = self.hits + self.misses
+        return self.hits / n_call if n_call > 0 else 0.
+    
+    @property
+    def info(self):
+        """ Counters of the cache (size of the current process) """
+        return {'hits':self.hits, 'misses':self.misses,
+                'hit_rate':self.hit_rate, 'size':len(self)}
+    
+    def clear(self):
+        """ Empty the cache and reset counters """
+        self._stamps.clear()
+        self.counts[...] = 0
+    
+    @staticmethod
+    def _quantize(val, step):
+        val = np.atleast_1d(val).astype(float)
+        if step > 0:
+            return tuple(np.round(val / step).astype(int))
+        else:
+            return tuple(val)
+    
+    def psf_key(self, psf):
+        """ Key of quantized PSF parameters """
+        if psf.aureole_model == "moffat":
+            index, scale = psf.beta1, psf.gamma1
+        elif psf.aureole_model == "power":
+            index, scale = psf.n0, psf.theta_0
+        else:
+            index, scale = psf.n_s, psf.theta_s
+            
+        return (psf.aureole_model,
+                self._quantize(index, self.dn),
+                self._quantize(np.log10(scale), self.dlogtheta),
+                self._quantize(psf.frac, self.dfrac),
+                float(psf.gamma), float(psf.beta))
+    
+    def offset_bin(self, offset):
+        """ Bin of sub-pixel offset (in [-0.5, 0.5)) """
+        n = self.n_offset
+        return (min(int((offset.x + 0.5) * n), n-1),
+                min(int((offset.y + 0.5) * n), n-1))
+    
+    def offset_center(self, bin_xy):
+        """ Center offset of the sub-pixel bin """
+        n = self.n_offset
+        dx, dy = [(b + 0.5) / n - 0.5 for b in bin_xy]
+        return galsim.PositionD(dx, dy)
+    
+    def draw_stars(self, psf, star_pos, Flux, full_image,
+                   pixel_scale=DF_pixel_scale, even_size=False, **aureole_kws):
+        """
+        Draw stars at star_pos with Flux on full_image using cached stamps.
+        
+        Parameters
+        ----------
+        psf : PSF model (with psf_core generated)
+        star_pos : 2d array, positions of stars
+        Flux : 1d array, flux of stars
+        full_image : galsim image of the canvas
+        pixel_scale : pixel scale of drawing
+        even_size : whether to round the stamp size to even
+        aureole_kws : keyword arguments passed to psf.generate_aureole
+        
+        """
+        key_psf = self.psf_key(psf) + tuple(sorted(aureole_kws.items()))
+        psf_star = None
+        
+        for pos, flux in zip(star_pos, Flux):
+            (ix_nominal, iy_nominal), offset = get_center_offset(pos)
+            bin_xy = self.offset_bin(offset)
+            key = key_psf + bin_xy
+            
+            stamp = self._stamps.get(key)
+            
+            if stamp is None:
+                self._counter()[1] += 1
+                if psf_star is None:
+                    # Build the galsim PSF only once per call
+                    with stage('generate_aureole'):
+                        psf_e, psf_size = psf.generate_aureole(**aureole_kws)
+                    if even_size: psf_size = psf_size // 2 * 2
+                    psf_star = (1-psf.frac) * psf.psf_core + psf.frac * psf_e
+                    
+                with stage('draw_image'):
+                    stamp = psf_star.drawImage(nx=psf_size, ny=psf_size, scale=pixel_scale,
+                                               offset=self.offset_center(bin_xy),
+                                               method='no_pixel').array
+                self._stamps[key] = stamp
+                if len(self._stamps) > self.maxsize:
+                    self._stamps.popitem(last=False)
+            else:
+                self._counter()[0] += 1
+                self._stamps.move_to_end(key)
+            
+            stamp = galsim.ImageF(flux * stamp, scale=pixel_scale)
+            stamp.setCenter(ix_nominal, iy_nominal)
+            
+            bounds = stamp.bounds & full_image.bounds
+            if bounds.isDefined():
+                full_image[bounds] += stamp[bounds]
+
+
+@lru_cache(maxsize=16)
+def get_fft_shape(image_shape, kernel_size):
+    """ Shape of zero-padded canvas for linear convolution of an image
+    with a kernel (odd size), rounded to a good FFT size. """
+    h = kernel_size // 2
+    return tuple(round_good_fft(n + 4 * h) for n in image_shape)
+
+def draw_stars_fft(star_pos, Flux,
+                   psf_star, psf_size, full_image,
+                   pixel_scale=DF_pixel_scale, workers=None):
+    """
+    Draw stars at star_pos with Flux on full_image in one convolution.
+    Stars are rasterized as points with bilinear (sub-pixel) flux splitting
+    on a padded canvas, which is convolved once with the PSF (psf_star)
+    by real FFT. Stars within psf_size/2 outside the image are included.
+    The splitting smooths the PSF core within one pixel, which is fine when
+    the cores of stars are masked in the fitting.
+    
+    Parameters
+    ----------
+    star_pos : 2d array, positions of stars (origin (1,1) as in draw_star)
+    Flux : 1d array, flux of stars
+    psf_star : galsim object of the PSF (core+aureole)
+    psf_size : size of the PSF image in pixel
+    full_image : galsim image of the canvas
+    pixel_scale : pixel scale of drawing
+    workers : number of workers used by scipy.fft
+    
+    """
+    # PSF image of odd size centered on the central pixel
+    K = psf_size // 2 * 2 + 1
+    h = K // 2
+    with stage('draw_image'):
+        kernel = psf_star.drawImage(nx=K, ny=K, scale=pixel_scale, method='no_pixel').array
+    
+    image_shape = full_image.array.shape
+    shape_fft = get_fft_shape(image_shape, K)
+    
+    # Star positions in the canvas (padded by h)
+    x, y = np.atleast_2d(star_pos).T - 1 + h
+    x0, y0 = np.floor(x).astype(int), np.floor(y).astype(int)
+    fx, fy = x - x0, y - y0
+    
+    keep = (x0>=0) & (y0>=0) & (x0<image_shape[1]+2*h) & (y0<image_shape[0]+2*h)
+    x0, y0, fx, fy, Flux = x0[keep], y0[keep], fx[keep], fy[keep], np.asarray(Flux)[keep]
+    
+    canvas = np.zeros(shape_fft)
+    for (dx, dy, w) in [(0, 0, (1-fx) * (1-fy)), (1, 0, fx * (1-fy)),
+                        (0, 1, (1-fx) * fy), (1, 1, fx * fy)]:
+        np.add.at(canvas, (y0+dy, x0+dx), Flux * w)
+    
+    conv = sp_fft.irfft2(sp_fft.rfft2(canvas, workers=workers) * \
+                         sp_fft.rfft2(kernel, s=shape_fft, workers=workers),
+                         s=shape_fft, workers=workers)
+    
+    full_image.array[:] += conv[2*h:2*h+image_shape[0], 2*h:2*h+image_shape[1]]
+
+
 ############################################
 # Functions for making mock images
 ############################################
@@ -909,7 +1577,10 @@ def generate_image_by_flux(psf, stars, xx, yy,
                            draw_real=True,
                            draw_core=False,
                            brightest_only=False,
-                           interpolant='cubic'):
+                           interpolant='cubic',
+                           engine=None, pix=None,
+                           stamp_cache=None,
+                           fft_convolve=False):
     """
     Generate the image by total flux, given the PSF object and Star object.
     
@@ -927,15 +1598,25 @@ def generate_image_by_flux(psf, stars, xx, yy,
     draw_core : whether to draw the core for very bright stars in real.
     brightest_only : whether to draw very bright stars only.
     interpolant : Interpolant method in Galsim.
+    engine : RadialProfileEngine of very bright stars used if draw_real is True. 
+    pix : flat indices of pixels to be drawn. If given, very bright stars in real space
+          are only evaluated at these pixels. The engine needs to be built on them.
+    stamp_cache : StampCache of PSF stamps for medium bright stars (drawn in serial).
+    fft_convolve : whether to draw medium bright stars by a single FFT convolution.
     
     Returns
     ----------
-    image : drawn image
+    image : drawn image (1d array of the pixels if pix is given)
     
     """
     
     nY, nX = xx.shape
     
+    if (pix is not None) & draw_real & ((engine is None) | (not brightest_only)):
+        # Coordinates of pixels to be drawn (not needed by the engine alone)
+        index = np.unravel_index(pix, (nY, nX))
+        xx, yy = xx[index], yy[index]
+    
     frac = psf.frac
     
     if psf_scale is None:
@@ -949,19 +1630,40 @@ def generate_image_by_flux(psf, stars, xx, yy,
         
     if not brightest_only:
         # Draw medium bright stars with galsim in Fourier space
-        psf_e, psf_size = psf.generate_aureole(contrast=contrast[0],
-                                               psf_scale=psf_scale,
-                                               psf_range=psf_range[0],
-                                               min_psf_range=min_psf_range//3,
-                                               max_psf_range=max_psf_range//3,
-                                               interpolant=interpolant)
+        aureole_kws = dict(contrast=contrast[0],
+                           psf_scale=psf_scale,
+                           psf_range=psf_range[0],
+                           min_psf_range=min_psf_range//3,
+                           max_psf_range=max_psf_range//3,
+                           interpolant=interpolant)
+        
+        if stamp_cache is None:
+            with stage('generate_aureole'):
+                psf_e, psf_size = psf.generate_aureole(**aureole_kws)
         
-        psf_size = psf_size // 2 * 2
+            psf_size = psf_size // 2 * 2
         
-        psf_star = (1-frac) * psf_c + frac * psf_e               
+            psf_star = (1-frac) * psf_c + frac * psf_e               
         
         if stars.n_medbright > 0:
-            if (not parallel) | (parallel_enabled==False):
+            if fft_convolve & (stamp_cache is None):
+                # Draw all stars by one convolution
+                draw_stars_fft(stars.star_pos_medbright,
+                               stars.Flux_medbright,
+                               psf_star=psf_star,
+                               psf_size=psf_size,
+                               full_image=full_image,
+                               pixel_scale=psf_scale)
+                
+            elif stamp_cache is not None:
+                # Reuse stamps drawn for nearby PSF parameters
+                stamp_cache.draw_stars(psf,
+                                       stars.star_pos_medbright,
+                                       stars.Flux_medbright,
+                                       full_image, pixel_scale=psf_scale,
+                                       even_size=True, **aureole_kws)
+            
+            elif (not parallel) | (parallel_enabled==False):
                 # Draw in serial
                 for k in range(stars.n_medbright):
                     draw_star(k,
@@ -969,7 +1671,8 @@ def generate_image_by_flux(psf, stars, xx, yy,
                               Flux=stars.Flux_medbright,
                               psf_star=psf_star,
                               psf_size=psf_size,
-                              full_image=full_image)
+                              full_image=full_image,
+                              pixel_scale=psf_scale)
             else:
                 # Draw in parallel, automatically back to serial computing if too few jobs
                 p_get_stamp_bounds = partial(get_stamp_bounds,
@@ -977,7 +1680,8 @@ def generate_image_by_flux(psf, stars, xx, yy,
                                              Flux=stars.Flux_medbright,
                                              psf_star=psf_star,
                                              psf_size=psf_size,
-                                             full_image=full_image)
+                                             full_image=full_image,
+                                             pixel_scale=psf_scale)
 
                 results = parallel_compute(np.arange(stars.n_medbright), p_get_stamp_bounds,
                                            lengthy_computation=False, verbose=False)
@@ -989,10 +1693,17 @@ def generate_image_by_flux(psf, stars, xx, yy,
         # Draw aureole of very bright star (if high cost in FFT) in real space
         # Note origin of star_pos in SE is (1,1) but (0,0) in python
         image_gs = full_image.array
-        
-        func_aureole_2d_s = psf.draw_aureole2D_in_real(stars.star_pos_verybright-1,
-                                                       Flux=frac * stars.Flux_verybright)
-        image_aureole = np.sum([f2d(xx,yy) for f2d in func_aureole_2d_s], axis=0)
+        if pix is not None:
+            image_gs = image_gs.ravel()[pix]
+        
+        with stage('real_aureole'):
+            if engine is None:
+                func_aureole_2d_s = psf.draw_aureole2D_in_real(stars.star_pos_verybright-1,
+                                                               Flux=frac * stars.Flux_verybright)
+                image_aureole = np.sum([f2d(xx,yy) for f2d in func_aureole_2d_s], axis=0)
+            else:
+                image_aureole = engine.draw(psf, Flux=frac * stars.Flux_verybright,
+                                            flat=(pix is not None))
         
         if draw_core:
             func_core_2d_s = psf.draw_core2D_in_real(stars.star_pos_verybright-1,
@@ -1003,12 +1714,13 @@ def generate_image_by_flux(psf, stars, xx, yy,
         
     else:
         # Draw very bright star in Fourier space 
-        psf_e_2, psf_size_2 = psf.generate_aureole(contrast=contrast[1],
-                                                   psf_scale=psf_scale,
-                                                   psf_range=psf_range[1],
-                                                   min_psf_range=min_psf_range,
-                                                   max_psf_range=max_psf_range,
-                                                   interpolant=interpolant)
+        with stage('generate_aureole'):
+            psf_e_2, psf_size_2 = psf.generate_aureole(contrast=contrast[1],
+                                                       psf_scale=psf_scale,
+                                                       psf_range=psf_range[1],
+                                                       min_psf_range=min_psf_range,
+                                                       max_psf_range=max_psf_range,
+                                                       interpolant=interpolant)
         
         psf_size_2 = psf_size_2 // 2 * 2
         
@@ -1020,9 +1732,12 @@ def generate_image_by_flux(psf, stars, xx, yy,
                       Flux=stars.Flux_verybright,
                       psf_star=psf_star_2, 
                       psf_size=psf_size_2,
-                      full_image=full_image)
+                      full_image=full_image,
+                      pixel_scale=psf_scale)
             
         image = full_image.array
+        if pix is not None:
+            image = image.ravel()[pix]
 
     return image
 
@@ -1037,7 +1752,10 @@ def generate_image_by_znorm(psf, stars, xx, yy,
                             brightest_only=False,
                             subtract_external=True,
                             draw_core=False,
-                            interpolant='cubic'):
+                            interpolant='cubic',
+                            engine=None, pix=None,
+                            stamp_cache=None,
+                            fft_convolve=False):
     """
     Generate the image by flux scaling, given the PSF object and Star object.
     
@@ -1057,21 +1775,32 @@ def generate_image_by_znorm(psf, stars, xx, yy,
     draw_core : whether to draw the core for very bright stars in real.
     subtract_external : whether to subtract external scattter light from very bright stars.
     interpolant : Interpolant method in Galsim.
+    engine : RadialProfileEngine of very bright stars used if draw_real is True.
+    pix : flat indices of pixels to be drawn. If given, very bright stars in real space
+          are only evaluated at these pixels. The engine needs to be built on them.
+    stamp_cache : StampCache of PSF stamps for medium bright stars (drawn in serial).
+    fft_convolve : whether to draw medium bright stars by a single FFT convolution.
     
     Returns
     ----------
-    image : drawn image
+    image : drawn image (1d array of the pixels if pix is given)
     
     """
     nY, nX = xx.shape
     
+    if (pix is not None) & draw_real & ((engine is None) | (not brightest_only)):
+        # Coordinates of pixels to be drawn (not needed by the engine alone)
+        index = np.unravel_index(pix, (nY, nX))
+        xx, yy = xx[index], yy[index]
+    
     frac = psf.frac
     r_scale = stars.r_scale
 
-    z_norm = stars.z_norm.copy()
+    z_norm = stars.z_norm_work()
     # Subtract external light from brightest stars
     if subtract_external:
-        I_ext = psf.calculate_external_light(stars)
+        with stage('external_light'):
+            I_ext = psf.calculate_external_light(stars)
         z_norm[stars.bright] -= I_ext
     
     if draw_real & brightest_only:
@@ -1097,19 +1826,40 @@ def generate_image_by_znorm(psf, stars, xx, yy,
         
     if not brightest_only:
         # 1. Draw medium bright stars with galsim in Fourier space
-        psf_e, psf_size = psf.generate_aureole(contrast=contrast[0],
-                                               psf_scale=psf_scale,
-                                               psf_range=psf_range[0],
-                                               min_psf_range=min_psf_range//3,
-                                               max_psf_range=max_psf_range//3,
-                                               interpolant=interpolant)
-#         psf_size = psf_size // 2 * 2
+        aureole_kws = dict(contrast=contrast[0],
+                           psf_scale=psf_scale,
+                           psf_range=psf_range[0],
+                           min_psf_range=min_psf_range//3,
+                           max_psf_range=max_psf_range//3,
+                           interpolant=interpolant)
+        
+        if stamp_cache is None:
+            with stage('generate_aureole'):
+                psf_e, psf_size = psf.generate_aureole(**aureole_kws)
+#             psf_size = psf_size // 2 * 2
 
-        # Draw medium bright stars with galsim in Fourier space
-        psf_star = (1-frac) * psf_c + frac * psf_e               
+            # Draw medium bright stars with galsim in Fourier space
+            psf_star = (1-frac) * psf_c + frac * psf_e               
         
         if stars.n_medbright > 0:
-            if (not parallel) | (parallel_enabled==False):
+            if fft_convolve & (stamp_cache is None):
+                # Draw all stars by one convolution
+                draw_stars_fft(stars.star_pos_medbright,
+                               stars.Flux_medbright,
+                               psf_star=psf_star,
+                               psf_size=psf_size,
+                               full_image=full_image,
+                               pixel_scale=psf_scale)
+                
+            elif stamp_cache is not None:
+                # Reuse stamps drawn for nearby PSF parameters
+                stamp_cache.draw_stars(psf,
+                                       stars.star_pos_medbright,
+                                       stars.Flux_medbright,
+                                       full_image, pixel_scale=psf_scale,
+                                       **aureole_kws)
+                
+            elif (not parallel) | (parallel_enabled==False):
                 # Draw in serial
                 for k in range(stars.n_medbright):
                     draw_star(k,
@@ -1117,7 +1867,8 @@ def generate_image_by_znorm(psf, stars, xx, yy,
                               Flux=stars.Flux_medbright,
                               psf_star=psf_star,
                               psf_size=psf_size,
-                              full_image=full_image)
+                              full_image=full_image,
+                              pixel_scale=psf_scale)
 
             else:
                 # Draw in parallel, automatically back to serial computing if too few jobs
@@ -1126,7 +1877,8 @@ def generate_image_by_znorm(psf, stars, xx, yy,
                                              Flux=stars.Flux_medbright,
                                              psf_star=psf_star,
                                              psf_size=psf_size,
-                                             full_image=full_image)
+                                             full_image=full_image,
+                                             pixel_scale=psf_scale)
 
                 results = parallel_compute(np.arange(stars.n_medbright), p_get_stamp_bounds,
                                            lengthy_computation=False, verbose=False)
@@ -1142,30 +1894,39 @@ def generate_image_by_znorm(psf, stars, xx, yy,
         if brightest_only:
             image_gs = 0.  # no galsim image
             # Only plot the aureole. A heavy mask is required.
-            func_aureole_2d_s = psf.draw_aureole2D_in_real(stars.star_pos_verybright-1,
-                                                           I0=I0_verybright)
+            aureole_norm = dict(I0=I0_verybright)
         else:
             image_gs = full_image.array
+            if pix is not None:
+                image_gs = image_gs.ravel()[pix]
             # Plot core + aureole.
-            func_aureole_2d_s = psf.draw_aureole2D_in_real(stars.star_pos_verybright-1,
-                                                           Flux=frac * stars.Flux_verybright)
+            aureole_norm = dict(Flux=frac * stars.Flux_verybright)
             if draw_core:
                 func_core_2d_s = psf.draw_core2D_in_real(stars.star_pos_verybright-1,
                                                          Flux=(1-frac) * stars.Flux_verybright)
                 image_gs += np.sum([f2d(xx,yy) for f2d in func_core_2d_s], axis=0)
         
-        image_aureole = np.sum([f2d(xx,yy) for f2d in func_aureole_2d_s], axis=0)
+        with stage('real_aureole'):
+            if engine is None:
+                func_aureole_2d_s = psf.draw_aureole2D_in_real(stars.star_pos_verybright-1,
+                                                               **aureole_norm)
+                image_aureole = np.sum([f2d(xx,yy) for f2d in func_aureole_2d_s], axis=0)
+            else:
+                # Evaluate the aureole from precomputed radii
+                image_aureole = engine.draw(psf, **aureole_norm,
+                                            flat=(pix is not None))
 
         image = image_gs + image_aureole
         
     else:
         # Draw very bright star in real space
-        psf_e_2, psf_size_2 = psf.generate_aureole(contrast=contrast[1],
-                                                   psf_scale=psf_scale,
-                                                   psf_range=psf_range[1],
-                                                   min_psf_range=min_psf_range,
-                                                   max_psf_range=max_psf_range,
-                                                   interpolant=interpolant)
+        with stage('generate_aureole'):
+            psf_e_2, psf_size_2 = psf.generate_aureole(contrast=contrast[1],
+                                                       psf_scale=psf_scale,
+                                                       psf_range=psf_range[1],
+                                                       min_psf_range=min_psf_range,
+                                                       max_psf_range=max_psf_range,
+                                                       interpolant=interpolant)
 #         psf_size_2 = psf_size_2 // 2 * 2
         
         psf_star_2 = (1-frac) * psf_c + frac * psf_e_2
@@ -1176,9 +1937,12 @@ def generate_image_by_znorm(psf, stars, xx, yy,
                       Flux=stars.Flux_verybright,
                       psf_star=psf_star_2,
                       psf_size=psf_size_2,
-                      full_image=full_image)
+                      full_image=full_image,
+                      pixel_scale=psf_scale)
             
         image = full_image.array
+        if pix is not None:
+            image = image.ravel()[pix]
                    
     return image
 
@@ -1459,6 +2223,273 @@ def draw_proposal(draw_func,
 
     return image_tri 
     
+def set_loglike_batch(engine, psf, stars, data,
+                      n_spline=2, K=1, fix_n0=False,
+                      fit_sigma=True, fit_frac=False,
+                      std_est=None, G_eff=1e5,
+                      leg=None, sparse=True,
+                      subtract_external=True):
+    
+    """
+    Setup a vectorized log-likelihood function evaluating a batch of
+    proposals (M x ndim) at once, for very bright stars drawn in real
+    space by a RadialProfileEngine (brightest_only). The layout of the
+    proposals and the returned values are the same as set_likelihood.
+    
+    """
+    
+    z_norm = stars.z_norm.copy()
+    r_scale = stars.r_scale
+    
+    n0 = psf.n0
+    theta_0 = psf.theta_0
+    cutoff = psf.cutoff
+    theta_c = psf.theta_c
+    n_c = psf.n_c
+    
+    if leg is not None:
+        H10, H01 = leg.coefs
+        if not sparse:
+            H10, H01 = H10.ravel()[engine.pix], H01.ravel()[engine.pix]
+    
+    # Number of proposals evaluated together
+    step = max(1, 2**16 // engine.n_pix)
+    
+    def loglike_batch(V):
+        
+        V = np.atleast_2d(np.array(V, dtype=float))
+        M = len(V)
+        
+        n_S = V[:, :n_spline].copy()
+        if fix_n0:
+            n_S[:, 0] = n0
+            
+        theta_S = np.column_stack([np.full(M, theta_0),
+                                   10**V[:, n_spline:2*n_spline-1]])
+        if cutoff:
+            n_S = np.column_stack([n_S, np.full(M, n_c)])
+            theta_S = np.column_stack([theta_S, np.full(M, theta_c)])
+        
+        mu = V[:, -K-1]
+        
+        loglike = np.full(M, -1e100)
+        
+        valid = np.all(np.diff(theta_S, axis=1) > 0, axis=1)
+        if not np.any(valid):
+            return loglike
+        
+        # Amplitudes of stars (cheap) for each proposal
+        n_S_pix, theta_S_pix, I0 = [], [], []
+        for m in np.flatnonzero(valid):
+            psf.update_fast(n_s=n_S[m], theta_s=theta_S[m],
+                            frac=10**V[m, -1] if fit_frac else None)
+            
+            # I varies with sky background
+            stars.update_z_norm(z_norm, stars.BKG - mu[m])
+            
+            z_norm_m = stars.z_norm_work()
+            if subtract_external:
+                z_norm_m[stars.bright] -= psf.calculate_external_light(stars)
+            
+            n_s, theta_s_pix, _ = engine.profile_params(psf)
+            n_S_pix += [n_s.copy()]
+            theta_S_pix += [theta_s_pix.copy()]
+            I0 += [psf.I2I0(z_norm_m[stars.verybright], r_scale)]
+        
+        n_S_pix, theta_S_pix, I0 = np.array(n_S_pix), np.array(theta_S_pix), np.array(I0)
+        V, mu = V[valid], mu[valid]
+        loglike_v = np.empty(len(V))
+        
+        # Evaluate by chunks of proposals to keep arrays small
+        for i in range(0, len(V), step):
+            rows = slice(i, i+step)
+            mu_r = mu[rows, None]
+            
+            # Aureoles of the proposals on shared radii
+            ypred = engine.evaluate_batch(n_S_pix[rows], theta_S_pix[rows], I0[rows])
+            ypred += mu_r
+        
+            if leg is not None:
+                A10, A01 = 10**V[rows, -K-2], 10**V[rows, -K-3]
+                ypred += A10[:, None] * H10 + A01[:, None] * H01
+            
+            if fit_sigma:
+                sigma = np.sqrt((10**V[rows, -K])[:, None]**2+(ypred-mu_r)/G_eff)
+            else:
+                sigma = np.sqrt(std_est**2+(ypred-mu_r)/G_eff)
+            
+            residsq = (ypred - data)**2 / sigma**2
+            loglike_v[rows] = -0.5 * np.sum(residsq + np.log(2 * np.pi * sigma**2), axis=1)
+        
+        loglike_v[~np.isfinite(loglike_v)] = -1e100
+        loglike[valid] = loglike_v
+        
+        return loglike
+    
+    return loglike_batch
+    
+def set_loglike_grad(engine, psf, stars, data,
+                     n_spline=2, K=1, fix_n0=False,
+                     fit_sigma=True, fit_frac=False,
+                     std_est=None, G_eff=1e5,
+                     leg=None, sparse=True,
+                     subtract_external=True):
+    
+    """
+    Setup a function returning the log-likelihood and its gradient of a
+    proposal, for very bright stars drawn in real space by a
+    RadialProfileEngine (brightest_only). The layout of the proposal and
+    the log-likelihood are the same as set_likelihood.
+    
+    The aureole, sky, Legendre background and the Gaussian likelihood
+    are differentiated in closed form. The amplitudes of stars, which
+    involve the external light, are differentiated by central differences
+    (cheap since no image is drawn). The aureole fraction is not used by
+    the brightest-only drawing, so its derivative is zero.
+    
+    For use in gradient-based optimization, transition radii out of order
+    (or out of [theta_0, theta_c]) are not rejected but sorted (and clipped),
+    on which the likelihood is continuous, minus a quadratic penalty of the
+    violation (in dex) per fitted pixel. Inside the valid region the
+    log-likelihood is the same as set_likelihood.
+    
+    """
+    
+    z_norm = stars.z_norm.copy()
+    r_scale = stars.r_scale
+    
+    n0 = psf.n0
+    theta_0 = psf.theta_0
+    cutoff = psf.cutoff
+    theta_c = psf.theta_c
+    n_c = psf.n_c
+    ln10 = np.log(10)
+    
+    if leg is not None:
+        H10, H01 = leg.coefs
+        if not sparse:
+            H10, H01 = H10.ravel()[engine.pix], H01.ravel()[engine.pix]
+    
+    # Params affecting amplitudes: power indices, transition radii, sky
+    index_amp = np.r_[int(fix_n0):2*n_spline-1, -K-1]
+    index_theta = np.arange(n_spline, 2*n_spline-1)
+    
+    # Range of transition radii in dex
+    log_theta_range = (np.log10(theta_0), np.log10(theta_c) if cutoff else np.inf)
+    
+    def profile_params(v):
+        n_s = np.array(v[:n_spline], dtype=float)
+        if fix_n0:
+            n_s[0] = n0
+        theta_s = np.sort(np.clip(10**v[index_theta], theta_0, theta_c if cutoff else np.inf))
+        theta_s = np.append(theta_0, theta_s)
+        if cutoff:
+            n_s = np.append(n_s, n_c)
+            theta_s = np.append(theta_s, theta_c)
+        return n_s, theta_s
+    
+    def amplitude(v):
+        """ Amplitudes of very bright stars at theta_0 """
+        n_s, theta_s = profile_params(v)
+        psf.update_fast(n_s=n_s, theta_s=theta_s)
+        
+        # I varies with sky background
+        stars.update_z_norm(z_norm, stars.BKG - v[-K-1])
+        
+        z_norm_v = stars.z_norm_work()
+        if subtract_external:
+            z_norm_v[stars.bright] -= psf.calculate_external_light(stars)
+        
+        return psf.I2I0(z_norm_v[stars.verybright], r_scale)
+    
+    def loglike_grad(v):
+        
+        v = np.array(v, dtype=float)
+        grad = np.zeros(len(v))
+        
+        n_s, theta_s = profile_params(v)
+        
+        # Derivatives of amplitudes by central differences
+        h = np.finfo(float).eps**(1/3) * np.maximum(1, np.abs(v[index_amp]))
+        dI0 = np.empty((len(index_amp), stars.n_verybright))
+        for i, (j, h_j) in enumerate(zip(index_amp, h)):
+            v_p, v_m = v.copy(), v.copy()
+            v_p[j] += h_j
+            v_m[j] -= h_j
+            dI0[i] = (amplitude(v_p) - amplitude(v_m)) / (2*h_j)
+        
+        I0 = amplitude(v)
+        theta_s_pix = psf.theta_s_pix
+        mu = v[-K-1]
+        
+        ypred = engine.evaluate(n_s, theta_s_pix, I0)
+        ypred += mu
+        
+        if leg is not None:
+            A10, A01 = 10**v[-K-2], 10**v[-K-3]
+            ypred += A10 * H10 + A01 * H01
+        
+        if fit_sigma:
+            var_sky = (10**v[-K])**2
+        else:
+            var_sky = std_est**2
+        
+        var = var_sky + (ypred - mu)/G_eff
+        resid = ypred - data
+        
+        loglike = -0.5 * np.sum(resid**2/var + np.log(2 * np.pi * var))
+        
+        if not np.isfinite(loglike):
+            return -1e100, grad
+        
+        # Derivatives w.r.t. the prediction and the variance
+        w_var = 0.5 * (resid**2/var - 1) / var
+        w_model = -resid/var + w_var/G_eff   # aureole and background
+        
+        grad_n, grad_log_theta, grad_I0 = engine.gradient(w_model, n_s, theta_s_pix, I0)
+        
+        grad[:n_spline] = grad_n[:n_spline]
+        if fix_n0:
+            grad[0] = 0
+        
+        # Transition radii: back to the order of the proposal
+        log_theta = v[index_theta]
+        order = np.argsort(np.clip(log_theta, *log_theta_range), kind='stable')
+        grad[index_theta[order]] = ln10 * grad_log_theta[1:n_spline]
+        grad[index_theta[(log_theta < log_theta_range[0]) |
+                         (log_theta > log_theta_range[1])]] = 0
+        
+        # Penalty of radii out of order or out of range
+        violation = np.maximum(-np.diff(np.r_[log_theta_range[0], log_theta,
+                                              log_theta_range[1]]), 0)
+        if np.any(violation > 0):
+            loglike -= engine.n_pix * np.sum(violation**2)
+            grad[index_theta] -= 2 * engine.n_pix * (violation[1:] - violation[:-1])
+        
+        grad[-K-1] = -np.sum(resid/var)
+        
+        if leg is not None:
+            grad[-K-2] = ln10 * A10 * np.dot(w_model, H10)
+            grad[-K-3] = ln10 * A01 * np.dot(w_model, H01)
+            
+        if fit_sigma:
+            grad[-K] = 2 * ln10 * var_sky * np.sum(w_var)
+        
+        # Chain through the amplitudes
+        grad[index_amp] += dI0 @ grad_I0
+        
+        return loglike, grad
+    
+    return loglike_grad
+    
+def make_lazy_grid(image_shape, dtype=np.int32):
+    """ Pixel grids (yy, xx) with the same values as np.mgrid, but as
+        read-only views of 1d arrays without allocating full grids. """
+    nY, nX = image_shape
+    yy = np.broadcast_to(np.arange(nY, dtype=dtype)[:, None], (nY, nX))
+    xx = np.broadcast_to(np.arange(nX, dtype=dtype)[None, :], (nY, nX))
+    return yy, xx
+    
 def calculate_likelihood(ypred, data, sigma):
     # Calculate log-likelihood
     residsq = (ypred - data)**2 / sigma**2
@@ -1502,7 +2533,10 @@ def set_likelihood(image, mask_fit, psf, stars,
                    psf_range=[None,None], leg2d=False,
                    std_est=None, G_eff=1e5,
                    fit_sigma=True, fit_frac=False,
-                   parallel=False, draw_real=False):
+                   parallel=False, draw_real=False,
+                   use_engine=True, sparse=True,
+                   stamp_cache=None, fft_convolve=False,
+                   return_batch=False, return_grad=False):
     
     """
     Setup likelihood function.
@@ -1513,18 +2547,32 @@ def set_likelihood(image, mask_fit, psf, stars,
     mask_fit: mask map (masked region is 1)
     psf: A PSF class to be updated
     stars: Stars class for the modeling
+    use_engine: whether to draw aureoles of very bright stars in real space
+                from radii precomputed on unmasked pixels (RadialProfileEngine)
+    sparse: whether to only draw unmasked pixels in real space, in which case
+            the drawing returns the 1d prediction directly
+    stamp_cache: StampCache reusing PSF stamps of medium bright stars between calls
+    fft_convolve: whether to draw medium bright stars by a single FFT convolution
+                  (not used if stamp_cache is given)
+    return_batch: whether to also return a vectorized log-likelihood function
+                  of a batch of proposals (M x ndim). It is None if not supported,
+                  i.e. unless only very bright stars are drawn by the engine.
+    return_grad: whether to also return a function of a proposal returning the
+                 log-likelihood and its gradient. It is None if not supported
+                 (same as return_batch).
     
     Returns
     ----------
     loglike : log-likelihood function for fitting
+    loglike_batch : vectorized log-likelihood function (if return_batch=True)
+    loglike_grad : log-likelihood and gradient function (if return_grad=True)
     
     """
     
     data = image[~mask_fit].copy().ravel()
     
     image_shape = image.shape
-    nY, nX = image_shape
-    yy, xx = np.mgrid[:nY, :nX]
+    yy, xx = make_lazy_grid(image_shape)
     
     stars_0 = stars.copy()
     z_norm = stars_0.z_norm.copy()
@@ -1540,13 +2588,26 @@ def set_likelihood(image, mask_fit, psf, stars,
     else:
         subtract_external = False
     
+    # Flat indices of pixels to be fit
+    pix_fit = np.flatnonzero(~mask_fit) if sparse else None
+    
+    # Star positions are fixed during the fitting: precompute the radii
+    if use_engine & draw_real & (psf.aureole_model!='moffat') & (stars.n_verybright > 0):
+        engine = RadialProfileEngine(stars.star_pos_verybright-1,
+                                     image_shape, mask=mask_fit)
+    else:
+        engine = None
+    
     p_draw_func = partial(draw_func, xx=xx, yy=yy,
                           psf_range=psf_range,
                           psf_scale=psf.pixel_scale,
                           max_psf_range=psf.theta_out,
                           brightest_only=brightest_only,
                           subtract_external=subtract_external,
-                          parallel=parallel, draw_real=draw_real)
+                          parallel=parallel, draw_real=draw_real,
+                          engine=engine, pix=pix_fit,
+                          stamp_cache=stamp_cache,
+                          fft_convolve=fft_convolve)
         
     # K : position order of background in the proposal (dafault -2)
     K = 0
@@ -1556,10 +2617,30 @@ def set_likelihood(image, mask_fit, psf, stars,
     # 1st-order Legendre Polynomial
     if leg2d:
         leg = Legendre2D(image_shape, order=1)
+        if sparse:
+            leg.coefs = [H.ravel()[pix_fit] for H in leg.coefs]
         H10, H01 = leg.coefs
     else:
         leg = None
         H10, H01 = 0, 0
+    
+    if (engine is not None) & brightest_only & (norm=='brightness') & (n_spline!='m'):
+        kws_batch = dict(n_spline=n_spline, K=K,
+                         fix_n0=fix_n0, fit_sigma=fit_sigma,
+                         fit_frac=fit_frac, std_est=std_est,
+                         G_eff=G_eff, leg=leg, sparse=sparse,
+                         subtract_external=subtract_external)
+        loglike_batch = set_loglike_batch(engine, psf, stars, data, **kws_batch)
+        loglike_grad = set_loglike_grad(engine, psf, stars, data, **kws_batch)
+    else:
+        loglike_batch = loglike_grad = None
+    
+    def returns(loglike):
+        """ loglike, followed by loglike_batch / loglike_grad if requested """
+        out = (loglike,)
+        if return_batch: out += (loglike_batch,)
+        if return_grad: out += (loglike_grad,)
+        return out if len(out) > 1 else loglike
         
     if n_spline == 'm':
         
@@ -1571,28 +2652,26 @@ def set_likelihood(image, mask_fit, psf, stars,
             if fit_sigma:
                 sigma = 10**v[-K]
 
-            param_update = {'gamma1':gamma1, 'beta1':beta1}
+            frac = 10**v[-1] if fit_frac else None
 
-            if fit_frac:
-                frac = 10**v[-1]
-                param_update['frac'] = frac
-
-            psf.update(param_update)
+            psf.update_fast(gamma1=gamma1, beta1=beta1, frac=frac)
 
             if norm=='brightness':
                 # I varies with sky background
-                stars.z_norm = z_norm + (stars.BKG - mu)
+                stars.update_z_norm(z_norm, stars.BKG - mu)
 
             image_tri = p_draw_func(psf, stars)
             image_tri += mu
             
-            ypred = image_tri[~mask_fit].ravel()
+            with stage('mask'):
+                ypred = image_tri if sparse else image_tri[~mask_fit].ravel()
 
-            loglike = calculate_likelihood(ypred, data, sigma)
+            with stage('likelihood'):
+                loglike = calculate_likelihood(ypred, data, sigma)
             
             return loglike
 
-        return loglike_mof
+        return returns(loglike_mof)
         
     else:
         n0 = psf.n0
@@ -1622,18 +2701,13 @@ def set_likelihood(image, mask_fit, psf, stars,
                     loglike = -1e100
                     return loglike
 
-                param_update = {'n_s':n_s, 'theta_s':theta_s}
+                frac = 10**v[-1] if fit_frac else None
 
-                if fit_frac:
-                    frac = 10**v[-1]
-                    param_update['frac'] = frac
-
-                psf.update(param_update)
-                psf.update({'n_s':n_s, 'theta_s':theta_s})
+                psf.update_fast(n_s=n_s, theta_s=theta_s, frac=frac)
 
                 if norm=='brightness':
                     # I varies with sky background
-                    stars.z_norm = z_norm + (stars.BKG - mu)
+                    stars.update_z_norm(z_norm, stars.BKG - mu)
 
                 image_tri = p_draw_func(psf, stars)
 
@@ -1644,7 +2718,8 @@ def set_likelihood(image, mask_fit, psf, stars,
                     bkg_leg = A10 * H10 + A01 * H01
                     image_tri += bkg_leg
                     
-                ypred = image_tri[~mask_fit].ravel()
+                with stage('mask'):
+                    ypred = image_tri if sparse else image_tri[~mask_fit].ravel()
                 
                 if fit_sigma:
                     # sigma = 10**v[-K]
@@ -1653,11 +2728,12 @@ def set_likelihood(image, mask_fit, psf, stars,
                     #sigma = std_est
                     sigma = np.sqrt(std_est**2+(ypred-mu)/G_eff)
 
-                loglike = calculate_likelihood(ypred, data, sigma)
+                with stage('likelihood'):
+                    loglike = calculate_likelihood(ypred, data, sigma)
 
                 return loglike
 
-            return loglike_2p        
+            return returns(loglike_2p)
 
 
         elif n_spline==3:
@@ -1681,17 +2757,13 @@ def set_likelihood(image, mask_fit, psf, stars,
                     
                 mu = v[-K-1]
 
-                param_update = {'n_s':n_s, 'theta_s':theta_s}
-
-                if fit_frac:
-                    frac = 10**v[-1]  
-                    param_update['frac'] = frac
+                frac = 10**v[-1] if fit_frac else None
 
-                psf.update(param_update)
+                psf.update_fast(n_s=n_s, theta_s=theta_s, frac=frac)
 
                 if norm=='brightness':
                     # I varies with sky background
-                    stars.z_norm = z_norm + (stars.BKG - mu)
+                    stars.update_z_norm(z_norm, stars.BKG - mu)
 
                 image_tri = p_draw_func(psf, stars)
                 image_tri += mu
@@ -1700,7 +2772,8 @@ def set_likelihood(image, mask_fit, psf, stars,
                     A10, A01 = 10**v[-K-2], 10**v[-K-3]
                     image_tri += A10 * H10 + A01 * H01
         
-                ypred = image_tri[~mask_fit].ravel()
+                with stage('mask'):
+                    ypred = image_tri if sparse else image_tri[~mask_fit].ravel()
                 
                 if fit_sigma:
                     #sigma = 10**v[-K]
@@ -1709,11 +2782,12 @@ def set_likelihood(image, mask_fit, psf, stars,
                     #sigma = std_est
                     sigma = np.sqrt(std_est**2+(ypred-mu)/G_eff)
 
-                loglike = calculate_likelihood(ypred, data, sigma)
+                with stage('likelihood'):
+                    loglike = calculate_likelihood(ypred, data, sigma)
                 
                 return loglike
 
-            return loglike_3p
+            return returns(loglike_3p)
 
         else:
 
@@ -1736,23 +2810,20 @@ def set_likelihood(image, mask_fit, psf, stars,
                 
                 mu = v[-K-1]
                 
-                param_update = {'n_s':n_s, 'theta_s':theta_s}
-
-                if fit_frac:
-                    frac = 10**v[-1]
-                    param_update['frac'] = frac
+                frac = 10**v[-1] if fit_frac else None
 
-                psf.update(param_update)
+                psf.update_fast(n_s=n_s, theta_s=theta_s, frac=frac)
                 
                 if norm=='brightness':
                     # I varies with sky background
-                    stars.z_norm = z_norm + (stars.BKG - mu)
+                    stars.update_z_norm(z_norm, stars.BKG - mu)
 
                 image_tri = draw_proposal(p_draw_func, v,
                                           psf, stars,
                                           K=K, leg=leg)
                 
-                ypred = image_tri[~mask_fit].ravel()
+                with stage('mask'):
+                    ypred = image_tri if sparse else image_tri[~mask_fit].ravel()
                 
                 if fit_sigma:
                     #sigma = 10**v[-K]
@@ -1761,8 +2832,9 @@ def set_likelihood(image, mask_fit, psf, stars,
                     #sigma = std_est
                     sigma = np.sqrt(std_est**2+(ypred-mu)/G_eff)
                 
-                loglike = calculate_likelihood(ypred, data, sigma)
+                with stage('likelihood'):
+                    loglike = calculate_likelihood(ypred, data, sigma)
 
                 return loglike
             
-            return loglike_sp
+            return returns(loglike_sp)
@@ -13,7 +13,8 @@ from astropy.table import Table
 from astropy.stats import sigma_clip
 from photutils import CircularAnnulus
 
-from .io import logger, save_pickle, load_pickle, check_save_path
+from .io import (logger, check_save_path, open_frame,
+                 load_thumbnails, ThumbnailWriter)
 from .stack import stack_star_image
 
 def counter(i, number):
@@ -52,28 +53,42 @@ def compute_Rnorm(image, mask_field, cen,
     
     cen = (cen[0], cen[1])
     anl = CircularAnnulus([cen], R-wid_ring, R+wid_ring)
-    anl_ma = anl.to_mask()[0].to_image(image.shape)
-    in_ring = anl_ma > 0.5        # sky ring (R-wid, R+wid)
-    mask = in_ring & (~mask_field) & (~np.isnan(image))
+    anl_ma = anl.to_mask()[0]
+    
+    # Only evaluate pixels in the bounding box of the annulus
+    slices, slices_ma = anl_ma.get_overlap_slices(image.shape)
+    if slices is None:
+        return [np.nan] * 3 + [1]
+    
+    weights = anl_ma.data[slices_ma]
+    image_box = image[slices]
+    
+    in_ring = weights > 0.5        # sky ring (R-wid, R+wid)
+    mask = in_ring & (~mask_field[slices]) & (~np.isnan(image_box))
         # sky ring with other sources masked
     
     # Whether to mask the cross regions, important if R is small
     if mask_cross:
-        yy, xx = np.indices(image.shape)
-        rr = np.sqrt((xx-cen[0])**2+(yy-cen[1])**2)
+        yy = np.arange(slices[0].start, slices[0].stop)[:,None]
+        xx = np.arange(slices[1].start, slices[1].stop)[None,:]
         in_cross = ((abs(xx-cen[0])<wid_cross))|(abs(yy-cen[1])<wid_cross)
-        mask = mask * (~in_cross)
+        mask = mask & (~in_cross)
     
-    if len(image[mask]) < 5:
+    if len(image_box[mask]) < 5:
         return [np.nan] * 3 + [1]
     
-    z_ = sigma_clip(image[mask], sigma=3, maxiters=5)
+    z_ = sigma_clip(image_box[mask], sigma=3, maxiters=5)
     z = z_.compressed()
         
-    I_mean = np.average(z, weights=anl_ma[mask][~z_.mask])
+    I_mean = np.average(z, weights=weights[mask][~z_.mask])
     I_med, I_std = np.median(z), np.std(z)
     
     if display:
+        # Full maps for display
+        mask_full = np.zeros(image.shape, dtype=bool)
+        mask_full[slices] = mask
+        mask = mask_full
+        
         L = min(100, int(mask.shape[0]))
         
         fig, (ax1,ax2) = plt.subplots(nrows=1, ncols=2, figsize=(9,4))
@@ -112,6 +127,7 @@ def compute_Rnorm_batch(table_target,
                         mag_saturate=13.5,
                         mag_limit=15,
                         wid_ring=0.5, wid_cross=4,
+                        keep_thumb=True, thumb_store=None, n_cpu=1,
                         display=False, verbose=True):
                         
     """
@@ -140,68 +156,126 @@ def compute_Rnorm_batch(table_target,
         Half-width in pixel of ring used to measure the scaling.
     wid_cross : float, optional, default 4
         Half-width  in pixel of the spike mask when measuring the scaling.
+    keep_thumb : bool or 1d bool array, optional, default True
+        Whether to keep thumbnails of (each of) the objects. Thumbnails
+        not kept are released once the object is measured.
+    thumb_store : ThumbnailWriter, optional, default None
+        If given, thumbnails are written to the store as objects are
+        measured instead of being kept in memory.
+    n_cpu : int or None, optional, default 1
+        Number of processes measuring objects concurrently.
+        If None, use # of CPU - 1. Objects are measured in serial
+        if display is True.
         
     Returns
     -------
     res_norm : nd array
         A N x 5 array saving the measurements.
         [I_mean, I_med, I_std, I_sky, I_flag]
-    res_thumb : dict
+    res_thumb : dict or ThumbnailWriter
         A dictionary storing thumbnails, mask, background and center of object.
+        thumb_store if given.
         
     """
     
-    from .image import Thumb_Image
+    from .parallel import imap_tasks
 
+    N = len(table_target)
+    keep_thumb = np.broadcast_to(keep_thumb, N)
+    
+    if display: n_cpu = 1
+    
+    def measure(i):
+        return measure_Rnorm_row(table_target[i], image, seg_map, wcs,
+                                 r_scale=r_scale, k_win=k_win,
+                                 mag_saturate=mag_saturate,
+                                 mag_limit=mag_limit,
+                                 wid_ring=wid_ring, wid_cross=wid_cross,
+                                 return_thumb=keep_thumb[i],
+                                 display=display, verbose=verbose)
+    
     # Initialize
-    res_thumb = {}
-    res_norm = np.empty((len(table_target), 5))
+    res_thumb = {} if thumb_store is None else thumb_store
+    res_norm = np.empty((N, 5))
     
-    # Iterate rows over the target table
-    for i, row in enumerate(table_target):
+    # Iterate rows over the target table (results arrive in order)
+    for i, (I_stats, thumb) in enumerate(imap_tasks(measure, N, n_cpu, chunksize=4)):
         if verbose:
-            counter(i, len(table_target))
-        num, mag_auto = row['NUMBER'], row['MAG_AUTO']
-        
-        wid_cross_ = wid_cross  # spikes mask
-        
-        # For brighter sources, use a broader window
-        if mag_auto <= mag_saturate-3:
-            n_win = int(40 * k_win)
-        elif mag_saturate-3 < mag_auto < mag_saturate:
-            n_win = int(30 * k_win)
-        elif mag_saturate < mag_auto < mag_limit:
-            n_win = int(20 * k_win)
-            wid_cross_ = max(wid_cross//2, 1)
-        else:
-            n_win = int(10 * k_win)
-            wid_cross_ = 0
-        
-        # Make thumbnail of the star and mask sources
-        thumb = Thumb_Image(row, wcs)
-        thumb.extract_star(image, seg_map, n_win=n_win)
-        
-        # Measure the mean, med and std of intensity at r_scale
-        thumb.compute_Rnorm(R=r_scale,
-                            wid_ring=wid_ring,
-                            wid_cross=wid_cross_,
-                            display=display)
-                            
-        I_flag = thumb.I_flag
-        if (I_flag==1) & verbose: logger.debug("Errorenous measurement: #", num)
-        
-        # Store results as dict (might be bulky)
-        res_thumb[num] = {"image":thumb.img_thumb,
-                          "mask":thumb.star_ma,
-                          "bkg":thumb.bkg,
-                          "center":thumb.cen_star}
-                          
+            counter(i, N)
+            
         # Store measurements to array
-        I_stats = ['I_mean', 'I_med', 'I_std', 'I_sky']
-        res_norm[i] = np.array([getattr(thumb, attr) for attr in I_stats] + [I_flag])
+        res_norm[i] = I_stats
+        
+        # Store thumbnails in memory or on disk
+        if thumb is not None:
+            res_thumb[table_target[i]['NUMBER']] = thumb
 
     return res_norm, res_thumb
 
+def measure_Rnorm_row(row, image, seg_map, wcs,
+                      r_scale=12, k_win=1,
+                      mag_saturate=13.5,
+                      mag_limit=15,
+                      wid_ring=0.5, wid_cross=4,
+                      return_thumb=True,
+                      display=False, verbose=True):
+    """
+    Measure the scaling factor of one object (a row of the table).
+    See compute_Rnorm_batch for parameters.
+    
+    Returns
+    -------
+    I_stats : 1d array
+        [I_mean, I_med, I_std, I_sky, I_flag]
+    thumb : dict or None
+        Thumbnail, mask, background and center of object.
+    
+    """
+    
+    from .image import Thumb_Image
+    
+    num, mag_auto = row['NUMBER'], row['MAG_AUTO']
+        
+    wid_cross_ = wid_cross  # spikes mask
+    
+    # For brighter sources, use a broader window
+    if mag_auto <= mag_saturate-3:
+        n_win = int(40 * k_win)
+    elif mag_saturate-3 < mag_auto < mag_saturate:
+        n_win = int(30 * k_win)
+    elif mag_saturate < mag_auto < mag_limit:
+        n_win = int(20 * k_win)
+        wid_cross_ = max(wid_cross//2, 1)
+    else:
+        n_win = int(10 * k_win)
+        wid_cross_ = 0
+    
+    # Make thumbnail of the star and mask sources
+    thumb = Thumb_Image(row, wcs)
+    thumb.extract_star(image, seg_map, n_win=n_win)
+    
+    # Measure the mean, med and std of intensity at r_scale
+    thumb.compute_Rnorm(R=r_scale,
+                        wid_ring=wid_ring,
+                        wid_cross=wid_cross_,
+                        display=display)
+                        
+    I_flag = thumb.I_flag
+    if (I_flag==1) & verbose: logger.debug(f"Errorenous measurement: #{num}")
+    
+    I_stats = ['I_mean', 'I_med', 'I_std', 'I_sky']
+    I_stats = np.array([getattr(thumb, attr) for attr in I_stats] + [I_flag])
+    
+    if return_thumb:
+        thumb = {"image":thumb.img_thumb,
+                 "mask":thumb.star_ma,
+                 "bkg":thumb.bkg,
+                 "center":thumb.cen_star}
+    else:
+        thumb = None
+        
+    return I_stats, thumb
+
 def measure_Rnorm_all(hdu_path,
                       table,
                       bounds,
@@ -215,6 +289,7 @@ def measure_Rnorm_all(hdu_path,
                       width_ring=0.5,
                       width_cross=4,
                       obj_name="",
+                      n_cpu=1,
                       display=False,
                       save=True, dir_name='.',
                       read=False, verbose=True):
@@ -250,8 +325,12 @@ def measure_Rnorm_all(hdu_path,
         Half-width in pixel of the spike mask when measuring the scaling.
     obj_name : str, optional
         Object name used as prefix of saved output.
+    n_cpu : int or None, optional, default 1
+        Number of processes measuring stars concurrently.
+        If None, use # of CPU - 1.
     save : bool, optional, default True
-        Whether to save output table and thumbnails.
+        Whether to save output table and thumbnails. Thumbnails are
+        saved as a thumbnail store (.thumb) read lazily by NUMBER.
     dir_name : str, optional
         Path of saving. Use currrent one as default.
     read : bool, optional, default False
@@ -262,8 +341,9 @@ def measure_Rnorm_all(hdu_path,
     table_norm : astropy.table.Table
         Table containing measurement results.
         
-    res_thumb : dict
-        A dictionary storing thumbnails, mask, background and center of object.
+    res_thumb : dict or ThumbnailStore
+        A dictionary (or a store on disk if saved) storing thumbnails, mask,
+        background and center of object.
         'image' : image of the object
         'mask' : mask map from SExtractor with nearby sources masked (masked = 1)
         'bkg' : estimated local 2d background
@@ -273,10 +353,8 @@ def measure_Rnorm_all(hdu_path,
     
     from .utils import convert_decimal_string
     
-    with fits.open(hdu_path) as hdul:
-        image = hdul[0].data
-        header = hdul[0].header
-        wcs_data = wcs.WCS(header)
+    frame = open_frame(hdu_path)
+    image, wcs_data = frame.data, frame.wcs
     
     if verbose:
         msg = "Measure intensity at R = {0} ".format(r_scale)
@@ -291,18 +369,24 @@ def measure_Rnorm_all(hdu_path,
     
     fn_table_norm = os.path.join(dir_name, '%s-norm_%dpix_%smag%s_%s.txt'\
                                 %(obj_name, r_scale, band, mag_str, range_str))
-    fn_res_thumb = os.path.join(dir_name, '%s-thumbnail_%smag%s_%s.pkl'\
+    fn_res_thumb = os.path.join(dir_name, '%s-thumbnail_%smag%s_%s.thumb'\
                                 %(obj_name, band, mag_str, range_str))
     
     fn_psf_satck = os.path.join(dir_name, f'{obj_name}-{band}-psf_stack_{range_str}.fits')
     
     if read:
         table_norm = Table.read(fn_table_norm, format="ascii")
-        res_thumb = load_pickle(fn_res_thumb)
+        res_thumb = load_thumbnails(fn_res_thumb)
         
     else:
         tab = table[table[mag_name]<mag_limit]
         
+        if save:  # write star thumbnails as they are measured
+            check_save_path(dir_name, overwrite=True, verbose=False)
+            thumb_store = ThumbnailWriter(fn_res_thumb)
+        else:
+            thumb_store = None
+        
         with warnings.catch_warnings():
             warnings.simplefilter('ignore')
             res_norm, res_thumb = compute_Rnorm_batch(tab, image,
@@ -313,6 +397,8 @@ def measure_Rnorm_all(hdu_path,
                                                       mag_saturate=mag_saturate,
                                                       mag_limit=mag_limit,
                                                       k_win=k_enlarge,
+                                                      thumb_store=thumb_store,
+                                                      n_cpu=n_cpu,
                                                       display=display,
                                                       verbose=verbose)
         
@@ -331,9 +417,11 @@ def measure_Rnorm_all(hdu_path,
                 col = np.around(res_norm[:,j], 5)
             table_norm[colname] = col
         
-        if save:  # save star thumbnails
-            check_save_path(dir_name, overwrite=True, verbose=False)
-            save_pickle(res_thumb, fn_res_thumb, 'thumbnail result')
+        if save:
+            thumb_store.close()
+            if verbose:
+                logger.info(f"Saved thumbnails to {fn_res_thumb}")
+            res_thumb = load_thumbnails(fn_res_thumb)
             table_norm.write(fn_table_norm, overwrite=True, format='ascii')
     
     # Stack non-saturated stars to obtain the inner PSF.
@@ -6,7 +6,9 @@ from scipy.special import gamma as Gamma
 
 try:
     from numba import njit
+    numba_installed = True
 except ImportError:
+    numba_installed = False
     def njit(*args, **kwargs):
         def dummy_decorator(func, *args, **kwargs):
             return func
@@ -337,7 +339,43 @@ def Flux2I_pow(frac, n0, theta0, r, Flux=1):
     I = I0 / (r/theta0)**n0
     return I
 
+@njit
+def mpow_I2I0_factor(n_s, theta_s_pix, r):
+    """ Ratio I(theta_0) / I(r) of multi-power law at r (scalar).
+        theata_s and r in pixel """
+    # Same as np.digitize(r, theta_s_pix, right=True) - 1
+    i = -1
+    for theta in theta_s_pix:
+        if theta < r:
+            i += 1
+            
+    factor = r**(n_s[i]) * theta_s_pix[0]**(-n_s[0])
+    for j in range(i):
+        factor *= theta_s_pix[j+1]**(n_s[j]-n_s[j+1])
+    
+    return factor
+
 def I2I0_mpow(n_s, theta_s_pix, r, I=1):
+    """ Convert Intensity I(r) at r to I at theta_0 with multi-power law.
+        theata_s and r in pixel """
+    if numba_installed & (np.ndim(r) == 0):
+        factor = mpow_I2I0_factor(np.asarray(n_s, dtype=float),
+                                  np.asarray(theta_s_pix, dtype=float), float(r))
+        return I * factor
+    else:
+        return I2I0_mpow_numpy(n_s, theta_s_pix, r, I=I)
+
+def I02I_mpow(n_s, theta_s_pix, r, I0=1):
+    """ Convert Intensity I(r) at r to I at theta_0 with multi-power law.
+        theata_s and r in pixel """
+    if numba_installed & (np.ndim(r) == 0):
+        factor = mpow_I2I0_factor(np.asarray(n_s, dtype=float),
+                                  np.asarray(theta_s_pix, dtype=float), float(r))
+        return I0 / factor
+    else:
+        return I02I_mpow_numpy(n_s, theta_s_pix, r, I0=I0)
+
+def I2I0_mpow_numpy(n_s, theta_s_pix, r, I=1):
     """ Convert Intensity I(r) at r to I at theta_0 with multi-power law.
         theata_s and r in pixel """
     i = np.digitize(r, theta_s_pix, right=True) - 1
@@ -347,7 +385,7 @@ def I2I0_mpow(n_s, theta_s_pix, r, I=1):
         
     return I0
 
-def I02I_mpow(n_s, theta_s_pix, r, I0=1):
+def I02I_mpow_numpy(n_s, theta_s_pix, r, I0=1):
     """ Convert Intensity I(r) at r to I at theta_0 with multi-power law.
         theata_s and r in pixel """
     i = np.digitize(r, theta_s_pix, right=True) - 1
@@ -371,6 +409,52 @@ def calculate_external_light_pow(n0, theta0, pos_source, pos_eval, I0_source):
     return I_s.sum(axis=0)
 
 def calculate_external_light_mpow(n_s, theta_s_pix, pos_source, pos_eval, I0_source):
+    """ Calculate light produced by source (I0_source, pos_source) at pos_eval. """
+    if numba_installed:
+        return external_light_mpow(np.asarray(n_s, dtype=float),
+                                   np.asarray(theta_s_pix, dtype=float),
+                                   np.asarray(pos_source, dtype=float),
+                                   np.asarray(pos_eval, dtype=float),
+                                   np.asarray(I0_source, dtype=float))
+    else:
+        return calculate_external_light_mpow_numpy(n_s, theta_s_pix,
+                                                   pos_source, pos_eval, I0_source)
+
+@njit
+def external_light_mpow(n_s, theta_s_pix, pos_source, pos_eval, I0_source):
+    """ Compiled kernel of calculate_external_light_mpow summing the light
+        of sources at each position without the distance matrix. """
+    n_comp = len(n_s)
+    
+    # Eq: I(r) = I0 * (theta0/theta1)^(n0) * (theta1/theta2)^(n1) *...* (theta_{k}/r)^(nk)
+    factors = np.empty(n_comp+1)
+    factors[0] = theta_s_pix[0]**n_s[0]
+    for i in range(1, n_comp):
+        factors[i] = factors[i-1] * theta_s_pix[i]**(n_s[i]-n_s[i-1])
+    factors[n_comp] = factors[0] # r <= theta_0 (index -1)
+    
+    I_ext = np.zeros(len(pos_eval))
+    
+    for k in range(len(pos_eval)):
+        for s in range(len(pos_source)):
+            dx = pos_source[s, 0] - pos_eval[k, 0]
+            dy = pos_source[s, 1] - pos_eval[k, 1]
+            r = math.sqrt(dx*dx + dy*dy)
+            
+            if r == 0: continue
+            
+            # Same as np.digitize(r, theta_s_pix, right=True) - 1
+            i = -1
+            for theta in theta_s_pix:
+                if theta < r:
+                    i += 1
+            
+            # shift to avoid zero division
+            I_ext[k] += I0_source[s] * factors[i] / (r + 1e-3)**n_s[i]
+            
+    return I_ext
+
+def calculate_external_light_mpow_numpy(n_s, theta_s_pix, pos_source, pos_eval, I0_source):
     """ Calculate light produced by source (I0_source, pos_source) at pos_eval. """
     r_s = distance.cdist(pos_source, pos_eval)
     r_inds = np.digitize(r_s, theta_s_pix, right=True) - 1
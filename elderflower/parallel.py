@@ -3,9 +3,22 @@ Submodule for parallel computing
 Adapted from https://github.com/pycroscopy/sidpy (S.Somnath, C.Smith)
 """
 
+import os
+import sys
+import atexit
+import shutil
+import weakref
+import tempfile
+import logging
+import itertools
 import numpy as np
 import joblib
 
+try:
+    import dill as pickle
+except ImportError:
+    import pickle
+
 def parallel_compute(data, func, cores=None, lengthy_computation=False, func_args=None, func_kwargs=None, verbose=False):
     """
     Computes the provided function using multiple cores using the joblib library
@@ -162,3 +175,373 @@ def recommend_cpu_cores(num_jobs, requested_cores=None, lengthy_computation=Fals
                 print('Not enough jobs per core. Reducing cores to {}'.format(requested_cores))
 
     return int(requested_cores)
+
+
+### Shared memory ###
+
+# Arrays larger than this (in bytes) are put in shared memory when
+# a state is saved for workers.
+SHARED_MIN_NBYTES = 2**20
+
+# Shared memory blocks created (name -> block) or attached in this process
+_shared_blocks = {}
+# Addresses of shared arrays -> (name, shape, dtype)
+_shared_arrays = {}
+
+def _release_shared_block(name, address, pid):
+    _shared_arrays.pop(address, None)
+    shm = _shared_blocks.pop(name, None)
+    if shm is not None:
+        try:
+            shm.close()
+            # Only unlink in the process creating the block (not forks)
+            if pid == os.getpid(): shm.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+
+def _register_shared_array(shm, shape, dtype, owner=True):
+    """ Wrap a shared memory block as an array and track it by address. """
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    address = array.__array_interface__['data'][0]
+    
+    _shared_blocks[shm.name] = shm
+    _shared_arrays[address] = (shm.name, array.shape, array.dtype.str)
+    
+    # The block is released with the array
+    pid = os.getpid() if owner else None
+    weakref.finalize(array, _release_shared_block, shm.name, address, pid)
+    return array
+    
+def share_array(array):
+    """
+    Copy an array to shared memory. The returned array is backed by a
+    shared memory block which is pickled by name (see SharedPickler),
+    so that workers map the same memory instead of receiving a copy.
+    
+    """
+    from multiprocessing import shared_memory
+    
+    array = np.ascontiguousarray(array)
+    if is_shared_array(array):
+        return array
+    
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    array_sh = _register_shared_array(shm, array.shape, array.dtype)
+    array_sh[...] = array
+    
+    return array_sh
+
+def is_shared_array(array):
+    """ Whether an array is the full array of a shared memory block. """
+    if not isinstance(array, np.ndarray) or (type(array) is not np.ndarray):
+        return False
+    info = _shared_arrays.get(array.__array_interface__['data'][0])
+    return (info is not None) and (info[1] == array.shape) and (info[2] == array.dtype.str)
+
+def attach_shared_array(name, shape, dtype):
+    """ Attach to an array in shared memory by the name of the block. """
+    from multiprocessing import shared_memory
+    
+    if name in _shared_blocks:
+        shm = _shared_blocks[name]
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        # Only the owner unlinks the block
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        
+    return _register_shared_array(shm, shape, dtype, owner=False)
+    
+
+class SharedPickler(pickle.Pickler):
+    """
+    A pickler saving large arrays by reference to shared memory.
+    Arrays not in shared memory yet are copied there once.
+    
+    """
+    
+    def reducer_override(self, obj):
+        if (type(obj) is np.ndarray) and (obj.dtype != object):
+            if is_shared_array(obj) | (obj.nbytes >= SHARED_MIN_NBYTES):
+                obj_sh = share_array(obj)
+                # Keep the shared copy alive with the source array
+                if obj_sh is not obj:
+                    self._shared_refs.append(obj_sh)
+                name, shape, dtype = _shared_arrays[obj_sh.__array_interface__['data'][0]]
+                return attach_shared_array, (name, shape, dtype)
+        return NotImplemented
+        
+    def dump(self, obj):
+        self._shared_refs = []
+        super().dump(obj)
+        return self._shared_refs
+    
+    
+### Persistent worker pool ###
+
+# Registered states (e.g. likelihood and prior functions carrying
+# the image, mask and stars). Workers forked after the registration
+# inherit them. Otherwise they load the state once from disk.
+_worker_state = {}
+_worker_cache = {}
+_state_counter = itertools.count()
+
+def _get_state(key, path=None):
+    """ Get a registered state in the current process. """
+    if key in _worker_state:
+        return _worker_state[key]
+    
+    if key not in _worker_cache:
+        # Only keep the latest loaded state in workers
+        _worker_cache.clear()
+        with open(path, 'rb') as f:
+            _worker_cache[key] = pickle.load(f)
+            
+    return _worker_cache[key]
+    
+
+class StateFunction:
+    """
+    A light-weight picklable handle of a function in a registered state.
+    Only the handle is sent to workers with each task.
+    """
+    
+    def __init__(self, key, name, path=None):
+        self.key = key
+        self.name = name
+        self.path = path
+        
+    def __call__(self, *args, **kwargs):
+        return _get_state(self.key, self.path)[self.name](*args, **kwargs)
+        
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, key={self.key})"
+        
+
+class WorkerPool:
+    """
+    A persistent pool of workers initialized with heavy read-only states.
+    
+    States (dict of functions) are registered once by register(). The
+    returned handles only carry a key so the per-task payload is the
+    parameter vector. The workers are kept alive across fittings
+    (e.g. regions or consecutive runs) until close() is called.
+    
+    Parameters
+    ----------
+    n_cpu : int
+        Number of processes.
+        
+    """
+    
+    def __init__(self, n_cpu):
+        self.size = n_cpu
+        self.pool = None
+        self.keys = []
+        self.temp_dir = None
+        self.shared_refs = {}
+        
+    def __str__(self):
+        return "A WorkerPool Class"
+        
+    def __repr__(self):
+        return f"{self.__class__.__name__} n_cpu={self.size} states={len(self.keys)}"
+        
+    @property
+    def is_open(self):
+        return self.pool is not None
+        
+    def open(self):
+        """ Start the workers. Registered states are inherited if forked. """
+        import multiprocess as mp
+        from .profiling import get_slot_table, init_worker_slot
+        if self.pool is None:
+            self.pool = mp.Pool(processes=self.size,
+                                initializer=init_worker_slot,
+                                initargs=(get_slot_table(),))
+            self.start_method = mp.get_start_method()
+        
+    def register(self, **funcs):
+        """
+        Register functions as a state and return handles of them
+        in the same order as given.
+        
+        """
+        
+        key = next(_state_counter)
+        _worker_state[key] = funcs
+        self.keys.append(key)
+        
+        if not self.is_open:
+            # Workers forked from here inherit the state
+            self.open()
+            forked = (self.start_method == 'fork')
+        else:
+            forked = False
+        
+        # Otherwise the workers load the state once from disk
+        path = None if forked else self.dump(key, funcs)
+        
+        return [StateFunction(key, name, path) for name in funcs]
+        
+    def dump(self, key, funcs):
+        """ Save a state to the temporary directory of the pool. """
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.mkdtemp(prefix='elderflower_pool_')
+        path = os.path.join(self.temp_dir, f'state_{key}.pkl')
+        with open(path, 'wb') as f:
+            # Large arrays are shared by workers instead of copied
+            shared_refs = SharedPickler(f, pickle.HIGHEST_PROTOCOL).dump(funcs)
+        self.shared_refs[key] = shared_refs
+        return path
+        
+    def release(self, key):
+        """ Release a registered state. The workers are kept. """
+        _worker_state.pop(key, None)
+        self.shared_refs.pop(key, None)
+        if key in self.keys:
+            self.keys.remove(key)
+        if self.temp_dir is not None:
+            path = os.path.join(self.temp_dir, f'state_{key}.pkl')
+            if os.path.exists(path):
+                os.remove(path)
+        
+    def map(self, func, iterable):
+        self.open()
+        return self.pool.map(func, iterable)
+        
+    def close(self):
+        """ Close the workers and release all states. """
+        for key in list(self.keys):
+            self.release(key)
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+        
+
+_worker_pool = None
+
+def get_worker_pool(n_cpu):
+    """ Get the persistent worker pool. Reopen it if n_cpu changes. """
+    global _worker_pool
+    
+    if _worker_pool is not None:
+        if _worker_pool.size == n_cpu:
+            return _worker_pool
+        _worker_pool.close()
+        
+    _worker_pool = WorkerPool(n_cpu)
+    return _worker_pool
+
+@atexit.register
+def close_worker_pool():
+    """ Close the persistent worker pool. """
+    global _worker_pool
+    
+    if _worker_pool is not None:
+        _worker_pool.close()
+        _worker_pool = None
+
+
+### Independent tasks (e.g. regions or stars) ###
+
+# Task run in forked workers, inherited instead of pickled
+_fork_task = None
+
+class _RecordCollector(logging.Handler):
+    """ A handler keeping log records to be emitted later. """
+    
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        
+    def emit(self, record):
+        # Format the message so that the record can be pickled
+        record.msg, record.args = record.getMessage(), None
+        record.exc_info, record.exc_text = None, None
+        self.records.append(record)
+        
+def _run_fork_task(i):
+    """ Run the task #i in a worker and collect its log records. """
+    import matplotlib.pyplot as plt
+    from .io import logger
+    
+    # Figures can only be saved in workers
+    plt.switch_backend('Agg')
+    
+    collector = _RecordCollector()
+    handlers = logger.handlers[:]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(collector)
+    
+    try:
+        result = _fork_task(i)
+    finally:
+        logger.removeHandler(collector)
+        for handler in handlers:
+            logger.addHandler(handler)
+            
+    return collector.records, result
+    
+def imap_tasks(task, n_task, n_cpu=1, chunksize=1):
+    """
+    Iterate over outputs of task(i) for i in range(n_task).
+    
+    If n_cpu > 1, tasks are run concurrently in forked processes. The task
+    is inherited by the workers (not pickled) but its output is sent back.
+    Outputs are yielded in order as soon as they are available, and log
+    messages of each task are emitted together in the same order.
+    
+    Parameters
+    ----------
+    task : callable
+        Function of the index of task.
+    n_task : int
+        Number of tasks.
+    n_cpu : int or None, optional, default 1
+        Number of processes. If None, use # of CPU - 1.
+    chunksize : int, optional, default 1
+        Number of tasks sent to a worker at once.
+        
+    """
+    import multiprocess as mp
+    from .io import logger
+    
+    if n_cpu is None:
+        n_cpu = max(mp.cpu_count()-1, 1)
+    n_cpu = min(n_cpu, n_task)
+    
+    if (n_cpu <= 1) | ('fork' not in mp.get_all_start_methods()):
+        for i in range(n_task):
+            yield task(i)
+        return
+    
+    global _fork_task
+    _fork_task = task
+    
+    try:
+        with mp.get_context('fork').Pool(processes=n_cpu) as pool:
+            for records, result in pool.imap(_run_fork_task, range(n_task),
+                                             chunksize=chunksize):
+                for record in records:
+                    logger.handle(record)
+                yield result
+    finally:
+        _fork_task = None
+        
+def map_regions(task, n_region, n_cpu=1):
+    """
+    Run task(i) for each region i in range(n_region), concurrently
+    if n_cpu > 1 (see imap_tasks). Return a list of outputs in order.
+    
+    """
+    return list(imap_tasks(task, n_region, n_cpu))
@@ -292,8 +292,8 @@ def draw_mask_map_strip(image, seg_comb, mask_comb, stars,
     fig, (ax1,ax2,ax3) = plt.subplots(ncols=3, nrows=1, figsize=(20,6), dpi=100)
     
     if ma_example is not None:
-        mask_strip, mask_cross = ma_example
-        mask_strip[mask_cross.astype(bool)]=0.5
+        mask_strip = ma_example[0].astype(float)
+        mask_strip[ma_example[1]]=0.5
         ax1.plot(star_pos_A[0][0], star_pos_A[0][1], "r*",ms=18)
     else:
         mask_strip = np.zeros_like(image)
@@ -0,0 +1,250 @@
+"""
+Submodule for profiling the stages of the likelihood.
+
+Stages are marked in the code by ``with stage(name):``. Nothing is
+recorded unless a StageTimer is activated (which is done by the
+likelihood returned by profiled()), so the cost when disabled is a
+function call returning a shared null context.
+
+The records of a StageTimer are kept in shared memory, one row per
+process, so that the wall time and number of calls accumulated in
+the workers of a pool are seen from the main process. Each worker
+claims a row once (see _worker_slot), so that live processes never
+update the same row.
+
+"""
+
+import os
+import time
+import numpy as np
+from contextlib import nullcontext
+
+from .io import logger
+
+# Stages marked in the likelihood
+STAGES = ('loglike',             # the whole likelihood call
+          'external_light',      # calculate_external_light
+          'generate_aureole',    # galsim aureole of medium / very bright stars
+          'draw_image',          # galsim drawing of medium bright stars
+          'real_aureole',        # real-space aureole of very bright stars
+          'mask',                # image_tri[~mask_fit]
+          'likelihood',          # calculate_likelihood
+          'loglike_batch',       # batched likelihood of proposals (MLE)
+          'loglike_grad')        # likelihood and its gradient (MLE)
+
+_null_stage = nullcontext()
+
+# Timer recording in the current process
+_active_timer = None
+
+def stage(name):
+    """ Context marking a stage. Recorded only if a timer is active. """
+    if _active_timer is None:
+        return _null_stage
+    return _active_timer.stage(name)
+
+# Number of rows of records (processes) by default
+N_SLOT = 4 * ((os.cpu_count() or 1) + 1)
+
+# Table of rows claimed by processes: (pids of the owners of rows, lock,
+# pid of the main process). Created once in the main process and
+# inherited by forked workers (or passed by init_worker_slot).
+_slot_table = None
+
+# (pid, row) of the current process
+_slot = (None, None)
+
+def get_slot_table():
+    """ Table of rows claimed by processes (created if not yet) """
+    global _slot_table
+    if _slot_table is None:
+        import multiprocess as mp
+        _slot_table = (mp.Array('q', N_SLOT, lock=False), mp.Lock(), os.getpid())
+    return _slot_table
+
+def init_worker_slot(slot_table):
+    """ Initializer of pools passing the table of rows to workers
+        (needed if they are not forked) """
+    global _slot_table
+    _slot_table = slot_table
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _claim_slot(pid):
+    """ Claim a free row for the process pid (or the row of a dead process) """
+    owners, lock, pid_main = get_slot_table()
+    if pid == pid_main:
+        return 0
+    with lock:
+        for i in range(1, len(owners)):
+            if owners[i] == pid:
+                return i
+        for i in range(1, len(owners)):
+            if (owners[i] == 0) or (not _is_alive(owners[i])):
+                owners[i] = pid
+                return i
+    logger.warning(f"No free row of records for process {pid}. "
+                    "Its stages and counts are not recorded.")
+    return None
+
+def _worker_slot(n_slot):
+    """ Row of the current process in records of n_slot rows: 0 for the
+        main process, a row claimed once by each worker. None if no row
+        is free (nothing is recorded in the process). """
+    global _slot
+    pid = os.getpid()
+    if _slot[0] != pid:
+        _slot = (pid, _claim_slot(pid))
+    row = _slot[1]
+    return row if (row is not None) and (row < n_slot) else None
+
+
+class _Stage:
+    """ Context adding wall time and a call to a row of the records """
+
+    __slots__ = ('record', 'start')
+
+    def __init__(self, record):
+        self.record = record
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.record[0] += time.perf_counter() - self.start
+        self.record[1] += 1
+
+
+class StageTimer:
+    """
+    A timer accumulating wall time and number of calls per stage.
+
+    Parameters
+    ----------
+    stages : list of str, optional
+        Names of stages. Default is STAGES.
+    n_slot : int, optional
+        Number of rows (processes) of the records. Default is N_SLOT.
+    shared : bool, optional, default True
+        Whether to keep the records in shared memory. Required
+        to collect records from workers.
+
+    """
+
+    def __init__(self, stages=STAGES, n_slot=None, shared=True, records=None):
+        self.stages = tuple(stages)
+        self.index = {name: i for i, name in enumerate(self.stages)}
+        self.shared = shared
+
+        # Rows are claimed from the table of the main process
+        get_slot_table()
+
+        if records is None:
+            if n_slot is None:
+                n_slot = N_SLOT
+            records = np.zeros((n_slot, len(self.stages), 2))
+            if shared:
+                from .parallel import share_array
+                records = share_array(records)
+
+        self.records = records
+        self.slot, self.pid = None, None
+
+    def __str__(self):
+        return "A StageTimer Class"
+
+    def __repr__(self):
+        return f"{self.__class__.__name__} stages={len(self.stages)} shared={self.shared}"
+
+    def __reduce__(self):
+        # The records in shared memory are pickled by the name of the block
+        if self.shared:
+            from .parallel import _shared_arrays
+            name, shape, dtype = _shared_arrays[self.records.__array_interface__['data'][0]]
+            return (_attach_timer, (self.stages, name, shape, dtype))
+        else:
+            return (StageTimer, (self.stages, None, False, self.records))
+
+    def stage(self, name):
+        if self.pid != os.getpid():
+            # The row is looked up again in forked processes
+            self.slot, self.pid = _worker_slot(len(self.records)), os.getpid()
+        if self.slot is None:
+            return _null_stage
+        return _Stage(self.records[self.slot, self.index[name]])
+
+    def reset(self):
+        self.records[...] = 0
+
+    def summary(self):
+        """
+        Total wall time (in s) and number of calls of each stage summed over processes.
+
+        Returns
+        -------
+        timings : dict
+            {stage: {'time': float, 'ncall': int, 'time_per_call': float}}
+
+        """
+        total = self.records.sum(axis=0)
+        timings = {}
+        for name, (t, ncall) in zip(self.stages, total):
+            timings[name] = {'time': t, 'ncall': int(ncall),
+                             'time_per_call': t/ncall if ncall>0 else 0.}
+        return timings
+
+
+def _attach_timer(stages, name, shape, dtype):
+    from .parallel import attach_shared_array
+    return StageTimer(stages, records=attach_shared_array(name, shape, dtype))
+
+
+class _Profiled:
+    """ Wrap a function (likelihood) to record stages with a timer """
+
+    def __init__(self, func, timer, name='loglike'):
+        self.func = func
+        self.timer = timer
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        global _active_timer
+        _active_timer = self.timer
+        try:
+            with self.timer.stage(self.name):
+                return self.func(*args, **kwargs)
+        finally:
+            _active_timer = None
+
+def profiled(func, timer, name='loglike'):
+    """ Return a function recording its stages (and itself as name) with timer """
+    return _Profiled(func, timer, name)
+
+def merge_timings(timings_list):
+    """ Sum a list of timings (e.g. of regions) """
+    timings = {}
+    for timings_ in timings_list:
+        for name, t in timings_.items():
+            t0 = timings.setdefault(name, {'time': 0., 'ncall': 0})
+            t0['time'] += t['time']
+            t0['ncall'] += t['ncall']
+    for t in timings.values():
+        t['time_per_call'] = t['time']/t['ncall'] if t['ncall']>0 else 0.
+    return timings
+
+def format_timings(timings):
+    """ Format a dict of timings as a table """
+    lines = ["{:<18s} {:>12s} {:>10s} {:>14s}".format("stage", "time [s]",
+                                                    "# calls", "per call [ms]")]
+    for name, t in timings.items():
+        if t['ncall'] > 0:
+            lines.append("{:<18s} {:12.3f} {:10d} {:14.4f}".format(name, t['time'], t['ncall'],
+                                                                  1e3 * t['time_per_call']))
+    return "\n".join(lines)
@@ -5,12 +5,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 import multiprocess as mp
 
-from scipy.optimize import minimize
+from functools import partial
+from scipy.optimize import minimize, OptimizeResult
 
 try:
     import dynesty
     from dynesty import plotting as dyplot
     from dynesty import utils as dyfunc
+    from dynesty.results import Results
     dynesty_installed = True
 except ImportError:
     warnings.warn("dynesty is not installed. Only MLE method is available.")
@@ -26,9 +28,22 @@ class Sampler:
     def __init__(self, container,
                  sample_method='auto', bound='multi',
                  n_cpu=None, n_thread=None,
-                 run='nested', results=None):
+                 run='nested', results=None,
+                 persistent_pool=True,
+                 warm_start=False, warm_width=5.,
+                 container_coarse=None, pyramid_width=5.):
                  
-        """ A class for runnning the sampling and plotting results """
+        """ A class for runnning the sampling and plotting results.
+        If persistent_pool=True, the likelihood is shipped once to a pool
+        of workers kept alive across fittings (see parallel.WorkerPool).
+        If warm_start=True, the prior of nested sampling is narrowed to
+        warm_width times the Hessian-based width around a MLE pre-fit
+        (see Sampler.warm_start).
+        If a container_coarse of a block-averaged image is given, the prior
+        of nested sampling is narrowed to pyramid_width times the posterior
+        width of a fitting on it (see Sampler.coarse_to_fine), and the
+        warm start is not used. For MLE, the fitting starts from the MLE
+        on the coarse container. """
                  
         if (sample_method=='mle')|(dynesty_installed==False):
             run = 'mle'
@@ -37,6 +52,7 @@ class Sampler:
         self.run = run
         
         self.container = container
+        self.container_coarse = container_coarse
         self.image = container.image
         self.ndim = container.ndim
         
@@ -50,7 +66,7 @@ class Sampler:
                 n_thread = max(n_thread, n_cpu-1)
             
             if n_cpu > 1:
-                self.open_pool(n_cpu)
+                self.open_pool(n_cpu, persistent=persistent_pool)
                 self.use_pool = {'update_bound': False}
             else:
                 self.pool = None
@@ -59,8 +75,24 @@ class Sampler:
             self.prior_tf = container.prior_transform
             self.loglike = container.loglikelihood
             
-            dsampler = dynesty.DynamicNestedSampler(self.loglike,
-                                                    self.prior_tf, self.ndim,
+            if container_coarse is not None:
+                self.prior_tf = self.coarse_to_fine(container_coarse, width=pyramid_width,
+                                                    sample_method=sample_method, bound=bound,
+                                                    n_cpu=n_cpu, n_thread=n_thread,
+                                                    persistent_pool=persistent_pool)
+            elif warm_start:
+                self.prior_tf = self.warm_start(width=warm_width)
+            
+            if hasattr(self.pool, 'register'):
+                # Ship the likelihood state to the workers only once
+                loglike, prior_tf = self.pool.register(loglike=self.loglike,
+                                                       prior_tf=self.prior_tf)
+                self.pool_key = loglike.key
+            else:
+                loglike, prior_tf = self.loglike, self.prior_tf
+            
+            dsampler = dynesty.DynamicNestedSampler(loglike,
+                                                    prior_tf, self.ndim,
                                                     sample=sample_method, bound=bound,
                                                     pool=self.pool, queue_size=n_thread,
                                                     use_pool=self.use_pool)
@@ -70,7 +102,7 @@ class Sampler:
             self.MLE_bounds = container.MLE_bounds
             self.param0 = container.param0
             self.loglike = container.loglikelihood
-            self.NLL = lambda p: -self.loglike(p)
+            self.set_MLE_functions()
             
         else:
             self._results = results # use existed results
@@ -91,6 +123,9 @@ class Sampler:
 
         start = time.time()
         
+        # Only record stages during this fitting
+        self.container.reset_timings()
+        
         if self.run == 'nested':
             msg = "Run Nested sampling for the fitting... "
             msg += "# of params: {0}".format(self.ndim)
@@ -110,34 +145,333 @@ class Sampler:
                 self.close_pool()
                 
         elif self.run == 'mle':
-            msg = "Run maximum likelihood estimate... "
-            msg += "# of params: {0}".format(self.ndim)
-            logger.info(msg)
-            
-            msg = "MLE bounds:"
-            for mle_b in self.MLE_bounds:
-                msg +=  "  [{0:.3f}, {1:.3f}]".format(mle_b[0], mle_b[1])
-            logger.info(msg)
-            
-            results = minimize(self.NLL, self.param0, method='L-BFGS-B',
-                               bounds=self.MLE_bounds)
-                               
-            self.MLE_results = results
+            if self.container_coarse is not None:
+                # Start from the MLE on the coarse level
+                self.param0 = self.coarse_MLE(self.container_coarse)
+            self.MLE_results = self.run_MLE()
             
         end = time.time()
         self.run_time = (end-start)
 
         logger.info("Finish Fitting! Total time elapsed: %.3g s"%self.run_time)
         
-    def open_pool(self, n_cpu):
-        logger.info("Opening new pool: # of CPU used: %d"%(n_cpu))
-        self.pool = mp.Pool(processes=n_cpu)
-        self.pool.size = n_cpu
+        # Wall time of stages summed over the workers (if profiled)
+        self.timings = self.container.timings()
+        if self.timings is not None:
+            from .profiling import format_timings
+            logger.info("Time spent in the likelihood:\n" + format_timings(self.timings))
+        
+        # Reuse of PSF stamps (if a stamp cache is used)
+        self.stamp_cache_info = self.container.stamp_cache_info()
+        if self.stamp_cache_info is not None:
+            logger.info("Stamp cache: {hits} hits, {misses} misses, "
+                        "hit rate {hit_rate:.1%}".format(**self.stamp_cache_info))
+        
+    def set_MLE_functions(self):
+        """ Objective of MLE from the likelihood of the container """
+        container = self.container
+        self.NLL = lambda p: -self.loglike(p)
+        
+        # Analytic gradient, or vectorized likelihood for
+        # finite-difference gradients (if supported)
+        if getattr(container, 'loglike_grad', None) is not None:
+            self.loglike_grad = container.loglike_grad
+        elif getattr(container, 'loglike_batch', None) is not None:
+            self.loglike_batch = container.loglikelihood_batch
+        
+    def run_MLE(self):
+        """ Minimize the negative log-likelihood from param0 within MLE_bounds """
+        msg = "Run maximum likelihood estimate... "
+        msg += "# of params: {0}".format(self.ndim)
+        logger.info(msg)
+        
+        msg = "MLE bounds:"
+        for mle_b in self.MLE_bounds:
+            msg +=  "  [{0:.3f}, {1:.3f}]".format(mle_b[0], mle_b[1])
+        logger.info(msg)
+        
+        if hasattr(self, 'loglike_grad') | hasattr(self, 'loglike_batch'):
+            # Evaluate the gradient with the objective
+            results = minimize(self.NLL_and_grad, self.param0,
+                               method='L-BFGS-B', jac=True,
+                               bounds=self.MLE_bounds)
+        else:
+            results = minimize(self.NLL, self.param0, method='L-BFGS-B',
+                               bounds=self.MLE_bounds)
+        
+        return results
+        
+    def NLL_and_grad(self, p):
+        """ Negative log-likelihood and its gradient. The gradient is analytic
+            if supported, otherwise by forward differences from one batch of
+            proposals. """
+        if hasattr(self, 'loglike_grad'):
+            loglike, grad = self.loglike_grad(p)
+            return -loglike, -grad
+        
+        h = np.sqrt(np.finfo(float).eps) * np.maximum(1, np.abs(p))
+        
+        # Step backward at the upper bounds
+        upper = np.array([np.inf if b[1] is None else b[1] for b in self.MLE_bounds])
+        h = np.where(p + h > upper, -h, h)
+        
+        nll = -self.container.loglikelihood_batch(np.vstack([p, p + np.diag(h)]))
+        
+        return nll[0], (nll[1:] - nll[0]) / h
+        
+    def warm_start(self, width=5., eps=1e-6, rel_step=1e-4):
+        """
+        Narrow the prior for nested sampling around a MLE pre-fit.
+        
+        The pre-fit is run in the unit cube of the prior, starting from
+        its center, so it is bounded by the real support of the prior and
+        keeps its constraints (e.g. the ordering of params). The narrowed
+        prior is the prior of the container restricted to the box in the
+        unit cube within width * sigma of the MLE, where sigma is the width
+        from the inverse Hessian of the negative log-likelihood in the unit
+        cube. Params without curvature keep the full range. If the MLE is
+        on the edge of the prior, the box extends to the edge.
+        
+        The posterior is therefore conditioned on the box. The pre-fit and
+        the box are kept in self.warm_start_info and saved with the results.
+        
+        Parameters
+        ----------
+        width : float, optional, default 5
+            Half width of the narrowed prior in units of sigma.
+        eps : float, optional, default 1e-6
+            Margin of the pre-fit from the edges of the unit cube.
+        rel_step : float, optional, default 1e-4
+            Step of the finite differences of the Hessian.
+        
+        Returns
+        -------
+        prior_tf : callable
+            Prior transform of the narrowed prior.
+        
+        """
+        
+        start = time.time()
+        
+        ndim = self.ndim
+        self.set_MLE_functions()
+        
+        logger.info("Warm start: MLE pre-fit for the prior of nested sampling.")
+        
+        # The gradient may overflow far from the data (e.g. at the edges of
+        # the prior). Such steps are rejected by the line search by making
+        # them worse than the last point with a finite gradient.
+        last = {'nll': np.inf, 'grad_u': np.zeros(ndim), 'n_reject': 0}
+        
+        def objective(u):
+            nll, grad_u = self.NLL_and_grad_u(u)
+            if np.isfinite(nll) & np.all(np.isfinite(grad_u)):
+                last.update(nll=nll, grad_u=grad_u)
+                return nll, grad_u
+            last['n_reject'] += 1
+            return last['nll'] + abs(last['nll']) + 1, last['grad_u']
+        
+        u0 = np.full(ndim, 0.5)
+        results = minimize(objective, u0,
+                           method='L-BFGS-B', jac=True,
+                           bounds=[(eps, 1-eps)] * ndim)
+        u_mle = results.x
+        
+        if last['n_reject'] > 0:
+            logger.warning("Warm start: %d step(s) of the MLE pre-fit rejected "
+                           "for a non-finite gradient."%last['n_reject'])
+        
+        # Hessian in the unit cube by central differences of the gradient
+        H = np.empty((ndim, ndim))
+        for i in range(ndim):
+            u_p, u_m = u_mle.copy(), u_mle.copy()
+            u_p[i] = min(u_mle[i] + rel_step, 1-eps)
+            u_m[i] = max(u_mle[i] - rel_step, eps)
+            H[i] = (self.NLL_and_grad_u(u_p)[1] - self.NLL_and_grad_u(u_m)[1]) / (u_p[i] - u_m[i])
+        H = (H + H.T) / 2.
+        
+        # Width of params with (finite) curvature
+        curved = np.all(np.isfinite(H), axis=1) & (np.diag(H) > 0)
+        sigma_u = np.full(ndim, np.inf)
+        
+        H_c = H[curved][:, curved]
+        try:
+            np.linalg.cholesky(H_c)
+            sigma_u[curved] = np.sqrt(np.diag(np.linalg.inv(H_c)))
+        except np.linalg.LinAlgError:
+            # Not positive definite: use the marginal curvature
+            sigma_u[curved] = 1. / np.sqrt(np.diag(H_c))
+        
+        lower_u = np.clip(u_mle - width * sigma_u, 0, 1)
+        upper_u = np.clip(u_mle + width * sigma_u, 0, 1)
+        
+        # MLE on the edge of the prior: extend the box to the edge
+        at_edge = (u_mle <= 2*eps) | (u_mle >= 1-2*eps)
+        lower_u[u_mle <= 2*eps] = 0
+        upper_u[u_mle >= 1-2*eps] = 1
+        if np.any(at_edge):
+            labels = np.array(getattr(self, 'labels', np.arange(ndim)), dtype=str)
+            logger.warning("Warm start: MLE on the edge of the prior for " + \
+                           ", ".join(labels[at_edge]) + ". The narrowed prior extends to the edge.")
+        
+        prior_tf = self.container.prior_transform
+        
+        self.warm_start_info = {'param_mle': prior_tf(u_mle),
+                                'loglike_mle': -results.fun,
+                                'u_mle': u_mle,
+                                'sigma_u': sigma_u,
+                                'width': width,
+                                'at_edge': at_edge,
+                                'lower_u': lower_u,
+                                'upper_u': upper_u,
+                                'lower': prior_tf(lower_u),
+                                'upper': prior_tf(upper_u),
+                                'nfev': results.nfev,
+                                'run_time': time.time() - start}
+        
+        msg = "Narrowed prior (unit cube):"
+        for lo, hi in zip(lower_u, upper_u):
+            msg +=  "  [{0:.3f}, {1:.3f}]".format(lo, hi)
+        logger.info(msg)
+        
+        return partial(prior_tf_unit_box, prior_tf=prior_tf,
+                       lower=lower_u, upper=upper_u)
+        
+    def NLL_and_grad_u(self, u, step=1e-6):
+        """ Negative log-likelihood and its gradient in the unit cube of the prior.
+            The gradient is the analytic one (if supported) times the Jacobian of
+            the prior transform, otherwise by forward differences from one batch
+            of proposals. """
+        ct = self.container
+        
+        # Step backward near the upper edge
+        h = np.where(u + step > 1, -step, step)
+        U = np.vstack([u, u + np.diag(h)])
+        V = np.array([ct.prior_transform(u_) for u_ in U])
+        
+        if hasattr(self, 'loglike_grad'):
+            loglike, grad = self.loglike_grad(V[0])
+            J = (V[1:] - V[0]) / h[:, None]    # J[i, j] = dv_j / du_i
+            nll, grad_u = -loglike, -J @ grad
+        else:
+            nll = -ct.loglikelihood_batch(V)
+            nll, grad_u = nll[0], (nll[1:] - nll[0]) / h
+        
+        return nll, grad_u
+        
+
+    def coarse_to_fine(self, container_coarse, width=5.,
+                       nlive_init=None, print_progress=True, **kwargs):
+        """
+        Narrow the prior for nested sampling by a fitting on a coarse level.
+
+        The coarse container is set up on the image block-averaged by a
+        factor, with the same prior in the unit cube (see
+        ImageList.set_container with pyramid_factor). A nested sampling
+        without batches is run on it, which costs a fraction of a fitting
+        on the original image per call. The narrowed prior is the prior of
+        the container restricted to the box in the unit cube within
+        width * sigma of the weighted mean of the coarse samples.
+
+        The posterior is therefore conditioned on the box. The coarse
+        fitting and the box are kept in self.pyramid_info and saved with
+        the results.
+
+        Parameters
+        ----------
+        container_coarse : Container
+            Container of the coarse level.
+        width : float, optional, default 5
+            Half width of the box in units of the posterior width.
+        nlive_init : int, optional
+            Number of live points of the coarse fitting. Default is ndim*10.
+        print_progress : bool, optional, default True
+            Whether to turn on the progress bar of dynesty.
+        kwargs :
+            Options of the Sampler of the coarse level.
+
+        Returns
+        -------
+        prior_tf : callable
+            Prior transform of the narrowed prior.
+
+        """
+
+        start = time.time()
+
+        logger.info("Coarse-to-fine: nested sampling on the coarse level.")
+        s = Sampler(container_coarse, **kwargs)
+
+        if nlive_init is None: nlive_init = self.ndim*10
+        s.run_fitting(nlive_init=nlive_init, maxbatch=0,
+                      print_progress=print_progress)
+
+        # Weighted mean and width of the coarse samples in the unit cube
+        results = s.results
+        weights = np.exp(results.logwt - results.logz[-1])
+        umean, ucov = dyfunc.mean_and_cov(results.samples_u, weights)
+        usigma = np.sqrt(np.diag(ucov))
+
+        lower_u = np.clip(umean - width * usigma, 0, 1)
+        upper_u = np.clip(umean + width * usigma, 0, 1)
+
+        prior_tf = self.container.prior_transform
+
+        self.pyramid_info = {'param_coarse': get_params_fit(results)[0],
+                             'width': width,
+                             'lower_u': lower_u,
+                             'upper_u': upper_u,
+                             'lower': prior_tf(lower_u),
+                             'upper': prior_tf(upper_u),
+                             'ncall': int(np.sum(results.ncall)),
+                             'run_time': time.time() - start}
+
+        msg = "Narrowed prior (unit cube):"
+        for lo, hi in zip(lower_u, upper_u):
+            msg +=  "  [{0:.3f}, {1:.3f}]".format(lo, hi)
+        logger.info(msg)
+
+        return partial(prior_tf_unit_box, prior_tf=prior_tf,
+                       lower=lower_u, upper=upper_u)
+
+    def coarse_MLE(self, container_coarse):
+        """ MLE on the coarse level (see Sampler.coarse_to_fine) as the initial guess """
+
+        start = time.time()
+
+        logger.info("Coarse-to-fine: MLE on the coarse level.")
+        s = Sampler(container_coarse, run='mle')
+        results = s.run_MLE()
+
+        self.pyramid_info = {'param_coarse': results.x,
+                             'loglike_coarse': -results.fun,
+                             'nfev': results.nfev,
+                             'run_time': time.time() - start}
+
+        return results.x
+
+    def open_pool(self, n_cpu, persistent=True):
+        if persistent:
+            from .parallel import get_worker_pool
+            logger.info("Use persistent pool: # of CPU used: %d"%(n_cpu))
+            self.pool = get_worker_pool(n_cpu)
+        else:
+            from .profiling import get_slot_table, init_worker_slot
+            logger.info("Opening new pool: # of CPU used: %d"%(n_cpu))
+            self.pool = mp.Pool(processes=n_cpu,
+                                initializer=init_worker_slot,
+                                initargs=(get_slot_table(),))
+            self.pool.size = n_cpu
     
     def close_pool(self):
-        logger.info("Pool Closed.")
-        self.pool.close()
-        self.pool.join()
+        if hasattr(self, 'pool_key'):
+            # Keep the workers for the next fitting
+            logger.info("Pool state released.")
+            self.pool.release(self.pool_key)
+        else:
+            logger.info("Pool Closed.")
+            self.pool.close()
+            self.pool.join()
 
     @property
     def results(self):
@@ -155,10 +489,49 @@ class Sampler:
         else:
             return get_params_fit(self.results, return_sample)
     
+    def split_regions(self):
+        """
+        Split results of a joint fitting (see container.JointContainer)
+        into a list of samplers of each region.
+        
+        """
+        
+        ct = self.container
+        samplers = []
+        
+        for i, ct_r in enumerate(ct.containers):
+            index = ct.region_index(i)
+            
+            if self.run == 'mle':
+                s = Sampler(ct_r, run='mle')
+                s.MLE_results = OptimizeResult(self.MLE_results)
+                s.MLE_results.x = self.MLE_results.x[index]
+                
+            else:
+                res = dict(self.results.items())
+                for key in ['samples', 'samples_u']:
+                    if key in res:
+                        res[key] = res[key][:, index]
+                s = Sampler(ct_r, run=False, results=Results(res))
+            
+            if hasattr(self, 'warm_start_info'):
+                s.warm_start_info = {key: val[index] if np.ndim(val) == 1 else val
+                                     for key, val in self.warm_start_info.items()}
+            
+            if hasattr(self, 'pyramid_info'):
+                s.pyramid_info = {key: val[index] if np.ndim(val) == 1 else val
+                                  for key, val in self.pyramid_info.items()}
+                
+            s.run_time = self.run_time
+            s.timings = getattr(self, 'timings', None)
+            samplers += [s]
+            
+        return samplers
+    
     def save_results(self, filename, save_dir='.'):
         """ Save fitting results """
         
-        if not self.run:
+        if (not self.run) & (getattr(self, '_results', None) is None):
             logger.warning("No results to saved.")
             return None
         
@@ -171,10 +544,22 @@ class Sampler:
         res['fit_res'] = self.results         # fitting results
         res['container'] = self.container     # a container for prior and likelihood
         
+        if getattr(self, 'timings', None) is not None:
+            res['timings'] = self.timings     # wall time of likelihood stages
+            
+        if hasattr(self, 'warm_start_info'):
+            res['warm_start'] = self.warm_start_info   # MLE pre-fit and narrowed prior
+            
+        if hasattr(self, 'pyramid_info'):
+            res['pyramid'] = self.pyramid_info     # coarse fitting and narrowed prior
+        
         # Delete <local> prior and loglikelihood function which can't be pickled
-        for attr in ['prior_transform', 'loglikelihood']:
-            if hasattr(res['container'], attr):
-                delattr(res['container'], attr)
+        # and the timer of stages kept in shared memory
+        for ct in [res['container']] + getattr(res['container'], 'containers', []):
+            for attr in ['prior_transform', 'loglikelihood', 'loglike_batch',
+                         'loglike_grad', 'timer']:
+                if hasattr(ct, attr):
+                    delattr(ct, attr)
         
         save_pickle(res, os.path.join(save_dir, filename), 'fitting result')
         
@@ -192,7 +577,16 @@ class Sampler:
             print(res['fit_info'])
             results['fit_info'] = res['fit_info']
         
-        return cls(res['container'], run=False, results=results)
+        sampler = cls(res['container'], run=False, results=results)
+        sampler.timings = res.get('timings')
+        
+        if 'warm_start' in res:
+            sampler.warm_start_info = res['warm_start']
+            
+        if 'pyramid' in res:
+            sampler.pyramid_info = res['pyramid']
+        
+        return sampler
     
     def cornerplot(self, truths=None, figsize=(16,15),
                    save=False, save_dir='.', suffix='', **kwargs):
@@ -319,6 +713,11 @@ class Sampler:
             plt.show()
 
 
+def prior_tf_unit_box(u, prior_tf, lower, upper):
+    """ Prior transform of prior_tf restricted to [lower, upper] in the unit cube """
+    return prior_tf(lower + u * (upper - lower))
+
+
 # (Old) functional way
 def Run_Dynamic_Nested_Fitting(loglikelihood, prior_transform, ndim,
                                nlive_init=100, sample='auto', 
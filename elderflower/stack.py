@@ -39,36 +39,105 @@ def resample_thumb(image, mask, center, shape_new=None):
     center_ : center of the target after the shift
         
     """
+    
+    images_, masks_, centers_ = resample_thumbs([image], [mask], [center], shape_new)
+    
+    return images_[0], masks_[0], centers_[0]
 
-    from scipy.interpolate import RectBivariateSpline
-
-    X_c, Y_c = center
-    NX, NY = image.shape
-
-    # original grid points
-    Xp, Yp = np.linspace(0, NX-1, NX), np.linspace(0, NY-1, NY)
-
-    rbspl = RectBivariateSpline(Xp, Yp, image, kx=3, ky=3)
-    rbspl_ma = RectBivariateSpline(Xp, Yp, mask, kx=1, ky=1)
+def _resample_axis1(arrays, points, k):
+    """
+    Interpolate arrays (N x n x m) along axis 1 at points (N x n_) with
+    an interpolating spline of order k. The spline is constant beyond
+    the grid. Return an N x m x n_ array (interpolated axis moved last).
+    """
+    from scipy.interpolate import BSpline, make_interp_spline
+    from scipy.sparse import csr_matrix
+    
+    N, n, m = arrays.shape
+    n_ = points.shape[1]
+    
+    # spline coefficients of all arrays by one (banded) solve
+    values = arrays.transpose(1,0,2).reshape(n, N*m)
+    spl = make_interp_spline(np.arange(n, dtype=float), values, k=k)
+    coef = spl.c.reshape(n, N, m).transpose(1,0,2).reshape(N*n, m)
+    
+    # evaluate the (k+1 non-zero) B-splines at points of each array
+    D = BSpline.design_matrix(np.clip(points, 0, n-1).ravel(), spl.t, k).tocsr()
+    rows = np.repeat(np.arange(N*n_), np.diff(D.indptr))
+    D = csr_matrix((D.data, D.indices + rows//n_ * n, D.indptr), shape=(N*n_, N*n))
+    
+    return (D @ coef).reshape(N, n_, m).transpose(0,2,1)
 
+def resample_thumbs(images, masks, centers, shape_new=None):
+    """
+    Batched resample_thumb for thumbnails of the same shape.
+    
+    The spline interpolation (bicubic for images, bilinear for masks)
+    is separable, so the batch is resampled along each axis at once:
+    spline coefficients by one banded solve, and the evaluation at
+    the shifted grids by a sparse product.
+    
+    Parameters
+    ----------
+    images : 3d array or list of 2d array
+        Input images of the same shape.
+    masks : 3d array or list of 2d bool array
+        Input masks (masked = 1).
+    centers : 2d array or list
+        Centers of the targets.
+    shape_new : turple, optional
+        New shape after resampling.
+    
+    Returns
+    -------
+    images_ : 3d array
+        Output images.
+    masks_ : 3d bool array
+        Output masks (masked = 1).
+    centers_ : 2d array
+        Centers of the targets after the shift.
+    
+    """
+    
+    images = np.asarray(images, dtype=float)
+    masks = np.asarray(masks, dtype=float)
+    centers = np.asarray(centers, dtype=float)
+    
+    X_c, Y_c = centers[:,0], centers[:,1]
+    NX, NY = images.shape[1:]
+    
     # new NAXIS
     if shape_new is None:
-        NX_ = NY_ = int(np.floor(image.shape[0]/2) * 2) - 3
+        NX_ = NY_ = int(np.floor(NX/2) * 2) - 3
     else:
         NX_, NY_ = shape_new
+        
+    # shift grid points of each thumbnail
+    Xp_ = np.linspace(X_c - NX_//2, X_c + NX_//2, NX_, axis=-1)
+    Yp_ = np.linspace(Y_c - NY_//2, Y_c + NY_//2, NY_, axis=-1)
+    
+    # resample image (bicubic) and mask (bilinear)
+    images_ = _resample_axis1(_resample_axis1(images, Xp_, 3), Yp_, 3)
+    masks_ = _resample_axis1(_resample_axis1(masks, Xp_, 1), Yp_, 1) > 0.5
+    
+    centers_ = np.stack([X_c - Xp_[:,0], Y_c - Yp_[:,0]], axis=1)
+    
+    return images_, masks_, centers_
+
+def _batches_by_shape(thumbs, batch_size=64):
+    """ Group (image, ...) tuples into batches of images of the same shape """
+    groups = {}
+    for thumb in thumbs:
+        shape = np.shape(thumb[0])
+        group = groups.setdefault(shape, [])
+        group.append(thumb)
+        if len(group) == batch_size:
+            yield groups.pop(shape)
+            
+    yield from groups.values()
 
-    # shift grid points
-    Xp_ = np.linspace(X_c - NX_//2, X_c + NX_//2, NX_)
-    Yp_ = np.linspace(Y_c - NY_//2, Y_c + NY_//2, NY_)
-
-    # resample image
-    image_ = rbspl(Xp_, Yp_)
-    mask_ = rbspl_ma(Xp_, Yp_) > 0.5
-
-    center_ = np.array([X_c - Xp_[0], Y_c - Yp_[0]])
-    return image_, mask_, center_
-
-def stack_star_image(table_stack, res_thumb, size=61, verbose=True):
+def stack_star_image(table_stack, res_thumb, size=61,
+                     method='mean', batch_size=64, verbose=True):
     """
     Stack images of stars in the table.
     
@@ -76,10 +145,14 @@ def stack_star_image(table_stack, res_thumb, size=61, verbose=True):
     ----------
     table_stack : astropy.table.Table
         SExtarctor table of stars to stack
-    res_thumb : dict
-        the dict containing the thumbnails, masks and centers
+    res_thumb : dict or ThumbnailStore
+        the dict (or store) containing the thumbnails, masks and centers
     size : int, optional, default 61
         Size of the stacked image in pixel, will be round to odd number.
+    method : 'mean', 'median' or 'sigclip', optional, default 'mean'
+        Combination of the stars. 'sigclip' is a 3-sigma clipped mean.
+    batch_size : int, optional, default 64
+        Number of thumbnails of the same size resampled at once.
     
     Returns
     -------
@@ -92,57 +165,73 @@ def stack_star_image(table_stack, res_thumb, size=61, verbose=True):
     canvas = np.zeros(shape)
     footprint = np.zeros_like(canvas)
     
-    i = 0
+    if method != 'mean':
+        # Masked pixels are nan, stars are combined at the end
+        cube = np.full((len(table_stack),)+shape, np.nan)
+    
     if verbose:
         logger.info("Stacking {0} non-staurated stars to obtain the PSF core...".format(len(table_stack)))
-    for num in table_stack['NUMBER']:
-
-        # Read image, mask and center
-        img_star = res_thumb[num]['image']
-        mask_star = res_thumb[num]['mask']
-        cen_star = res_thumb[num]['center']
-        
-        # enlarge mask
-        for j in range(1):
+    
+    def read_thumbs():
+        for k, num in enumerate(table_stack['NUMBER']):
+            # Read image, mask and center
+            img_star = res_thumb[num]['image']
+            mask_star = res_thumb[num]['mask']
+            cen_star = res_thumb[num]['center']
+            
+            # enlarge mask
             mask_star = binary_dilation(mask_star)
-        
-        shape_star = img_star.shape
-        
-        if shape_star[0]!=shape_star[1]: continue
-           
-        # meausre local background
-        r_out = min(img_star.shape) * 0.8 //2
-        r_in = r_out - 5
-        bkg = background_annulus(cen_star, img_star, mask_star, r_in=r_in, r_out=r_out, draw=False)
+            
+            if img_star.shape[0]!=img_star.shape[1]: continue
+            
+            # meausre local background
+            r_out = min(img_star.shape) * 0.8 //2
+            r_in = r_out - 5
+            bkg = background_annulus(cen_star, img_star, mask_star, r_in=r_in, r_out=r_out, draw=False)
+            
+            yield img_star, mask_star, cen_star, bkg, k
+            
+    for batch in _batches_by_shape(read_thumbs(), batch_size):
+        images, masks, centers, bkgs, ks = zip(*batch)
         
         # resample thumbnail centroid to center
-        img_star_, mask_star_, cen_star_ = resample_thumb(img_star, mask_star, cen_star)
-        shape_star_ = img_star_.shape
+        images_, masks_, _ = resample_thumbs(images, masks, centers)
+        shape_ = images_.shape[1]
         
         # remove nearby sources
-        img_star_ = img_star_ - bkg
-        img_star_[mask_star_] = 0
-        img_star_ = img_star_/img_star_.sum()
+        images_ -= np.array(bkgs)[:,None,None]
+        images_[masks_] = 0
+        images_ /= images_.sum(axis=(1,2))[:,None,None]
         
-        # add cutout to canvas
-        dx = abs(shape_star_[0]-canvas.shape[0])//2
-        dy = abs(shape_star_[1]-canvas.shape[1])//2
-        if shape_star_[0] > size:
-            cutout = img_star_[dx:-dx,dy:-dy]
-            canvas += cutout
-            footprint += (cutout!=0)
-        elif shape_star_[0] < size:
-            cutout = img_star_
-            canvas[dx:-dx,dy:-dy] += cutout
-            footprint[dx:-dx,dy:-dy] += (cutout!=0)
+        # add cutouts to canvas
+        d = abs(shape_-size)//2
+        if shape_ > size:
+            cutouts, masks_, window = images_[:,d:-d,d:-d], masks_[:,d:-d,d:-d], np.s_[:,:]
+        elif shape_ < size:
+            cutouts, window = images_, np.s_[d:-d,d:-d]
         else:
-            canvas += img_star_
-            footprint += 1
+            cutouts, window = images_, np.s_[:,:]
+        
+        if method == 'mean':
+            canvas[window] += cutouts.sum(axis=0)
+            if shape_ == size:
+                footprint += len(cutouts)
+            else:
+                footprint[window] += (cutouts!=0).sum(axis=0)
+        else:
+            cube[(np.array(ks),)+window] = np.where(masks_, np.nan, cutouts)
             
-        i += 1
-
-    image_stack = canvas/footprint
-    image_stack = image_stack/image_stack.sum()
+    if method == 'mean':
+        image_stack = canvas/footprint
+    elif method == 'median':
+        image_stack = np.nanmedian(cube, axis=0)
+    elif method == 'sigclip':
+        from astropy.stats import sigma_clip
+        image_stack = np.nanmean(sigma_clip(cube, sigma=3, axis=0, masked=False), axis=0)
+    else:
+        raise ValueError("method should be 'mean', 'median' or 'sigclip'.")
+        
+    image_stack = image_stack/np.nansum(image_stack)
 
     return image_stack
 
@@ -291,37 +380,35 @@ def fine_stack_PSF_image(table_stack, res_thumb, size=61, fwhm_psf=5, n_iter=2,
     if verbose:
         logger.info("Stacking {0} non-staurated stars to obtain the PSF core...".format(len(table_stack)))
         
-    stars_scaled = np.ma.empty((len(table_stack), size, size))
+    stars_scaled = np.empty((len(table_stack), size, size))
+    
+    def read_thumbs():
+        for ind, num in enumerate(table_stack['NUMBER']):
+            mask = binary_dilation(res_thumb[num]['mask'], iterations=3)
+            image = res_thumb[num]['image'] - res_thumb[num]['bkg']
+            yield image, mask, res_thumb[num]['center'], ind
     
     # Shift image center and normalize by aperture flux
-    for ind in range(len(table_stack)):
-        num = table_stack['NUMBER'][ind]
-        bkg = res_thumb[num]['bkg']
-        image = res_thumb[num]['image']
-        mask = res_thumb[num]['mask']
-        center = res_thumb[num]['center']
-        
-        for j in range(3):
-            mask = binary_dilation(mask)
-                
-        image = np.ma.array(image - bkg, mask=mask)
+    for batch in _batches_by_shape(read_thumbs()):
+        images, masks, centers, inds = zip(*batch)
         
         # resample
-        image_new, mask_new, center_new = resample_thumb(image, mask, center, shape_new=image_shape)
-        
-        # rough estimate of first total flux
-        r_aper = get_aperture_flux_fraction(np.ma.array(image_new, mask=mask_new), frac=0.99)
-        r_aper = min(r_aper, size)
-        aper = CircularAperture(center, r=r_aper)
-        aper_new = CircularAperture(center_new, r=r_aper)
-        aper_ma = aper_new.to_mask().to_image(image_new.shape)
+        images_new, masks_new, centers_new = resample_thumbs(images, masks, centers,
+                                                             shape_new=image_shape)
         
-        # normalization
-        flux = np.ma.sum(image_new[(aper_ma == 1) & (~mask_new)])
-        stars_scaled[ind] = image_new / flux
+        for ind, image_new, mask_new, center_new in zip(inds, images_new, masks_new, centers_new):
+            # rough estimate of first total flux
+            r_aper = get_aperture_flux_fraction(np.ma.array(image_new, mask=mask_new), frac=0.99)
+            r_aper = min(r_aper, size)
+            aper_new = CircularAperture(center_new, r=r_aper)
+            aper_ma = aper_new.to_mask().to_image(image_new.shape)
+            
+            # normalization
+            flux = np.sum(image_new[(aper_ma == 1) & (~mask_new)])
+            stars_scaled[ind] = image_new / flux
     
     # first median stack
-    star_med_0 = np.ma.median(stars_scaled, axis=0)
+    star_med_0 = np.median(stars_scaled, axis=0)
     star_med = star_med_0.copy()
     
     # some static PSF photometry setup
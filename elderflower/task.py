@@ -12,7 +12,7 @@ from astropy.io import fits
 from astropy.table import Table
 
 from .io import logger
-from .io import find_keyword_header, check_save_path, clean_pickling_object
+from .io import find_keyword_header, check_save_path, clean_pickling_object, open_frame
 from .detection import default_SE_config, default_conv, default_nnw
 from .mask import mask_param_default
 from . import DF_pixel_scale, DF_raw_pixel_scale, DF_Gain
@@ -227,9 +227,13 @@ def Match_Mask_Measure(hdu_path,
                        mag_limit_segm=22,
                        mag_saturate=13.5,
                        mask_param=mask_param_default,
+                       n_cpu=1,
                        draw=True,
                        save=True,
                        use_PS1_DR2=False,
+                       catalog_dir=None,
+                       offline=False,
+                       local_catalog=None,
                        fn_psf_core=None,
                        work_dir='./'):
                        
@@ -286,6 +290,9 @@ def Match_Mask_Measure(hdu_path,
     mask_param: dict, optional
         Parameters setting up the mask map.
         See doc string of .mask for details.
+    n_cpu : int, optional, default 1
+        Number of cpu used for measuring bright stars.
+        If None, use # of CPU - 1.
     draw : bool, optional, default True
         Whether to draw diagnostic plots.
     save : bool, optional, default True
@@ -293,6 +300,16 @@ def Match_Mask_Measure(hdu_path,
     use_PS1_DR2 : bool, optional, default False
         Whether to use PANSTARRS DR2. Crossmatch with DR2 is done by MAST query,
         which could easily fail if a field is too large (> 1 deg^2).
+    catalog_dir : str, optional, default None
+        Directory of the local cache of reference catalogs. Queries are
+        served from cached sky tiles and only missing tiles are fetched.
+        If None, catalogs are queried every run without caching.
+    offline : bool, optional, default False
+        Whether to serve all queries locally (from catalog_dir and local_catalog)
+        without querying remote services.
+    local_catalog : str, optional, default None
+        Path of a reference catalog file standing in for the services in
+        offline mode. Column names should match the queried catalog.
     fn_psf_core : bool, optional, default None
         Path of the provided stacked PSF core.
     work_dir : str, optional, default current directory
@@ -313,7 +330,6 @@ def Match_Mask_Measure(hdu_path,
     # Read and Display
     ##################################################
     from .utils import crop_image, crop_catalog, background_stats
-    from astropy import wcs
     
     # Read hdu
     if not os.path.isfile(hdu_path):
@@ -321,11 +337,9 @@ def Match_Mask_Measure(hdu_path,
         logger.error(msg)
         raise FileNotFoundError()
         
-    with fits.open(hdu_path) as hdul:
-        logger.info(f"Read Image: {hdu_path}")
-        data = hdul[0].data
-        header = hdul[0].header
-        wcs_data = wcs.WCS(header)
+    logger.info(f"Read Image: {hdu_path}")
+    frame = open_frame(hdu_path)
+    data, header, wcs_data = frame.data, frame.header, frame.wcs
 
     # Read output from SExtractor detection
     SE_cat_full = Table.read(os.path.join(work_dir, f'{obj_name}-{band}.cat'), format="ascii.sextractor")
@@ -371,6 +385,7 @@ def Match_Mask_Measure(hdu_path,
                         add_supplementary_atlas,
                         add_supplementary_SE_star)
     from .crossmatch import cross_match_PS1
+    from .catalog import CatalogCache
     
     # Identify bright extended sources and enlarge their mask
     SE_cat_target, ext_cat, mag_saturate = identify_extended_source(SE_cat, draw=draw,
@@ -388,6 +403,15 @@ def Match_Mask_Measure(hdu_path,
         bounds_crossmatch = field_bounds
         dir_name = os.path.join(work_dir, 'Measure-PS1/')
     
+    # Local cache of reference catalogs
+    if (catalog_dir is None) & offline:
+        catalog_dir = os.path.join(work_dir, 'catalogs')
+    if catalog_dir is not None:
+        catalog_cache = CatalogCache(catalog_dir, offline=offline,
+                                     local_catalog=local_catalog)
+    else:
+        catalog_cache = None
+    
     # Crossmatch with PANSTRRS mag < mag_limit
     tab_target, tab_target_full, catalog_star = \
                                 cross_match_PS1(band, wcs_data,
@@ -397,6 +421,7 @@ def Match_Mask_Measure(hdu_path,
                                                 sep=pixel_scale*u.arcsec,
                                                 mag_limit=mag_limit,
                                                 use_PS1_DR2=use_PS1_DR2,
+                                                cache=catalog_cache,
                                                 verbose=True)
    
 
@@ -496,6 +521,7 @@ def Match_Mask_Measure(hdu_path,
                                                 width_ring=width_ring_pix,
                                                 obj_name=obj_name,
                                                 mag_name=mag_name_cat,
+                                                n_cpu=n_cpu,
                                                 save=save, dir_name=dir_name,
                                                 verbose=True)
 
@@ -541,9 +567,17 @@ def Run_PSF_Fitting(hdu_path,
                     draw_real=True,
                     brightest_only=False,
                     parallel=True,
+                    fft_convolve=False,
+                    stamp_cache=False,
+                    joint_fit=False,
+                    profile=False,
                     n_cpu=None,
                     nlive_init=None,
                     sample_method='auto',
+                    warm_start=False,
+                    warm_width=5,
+                    pyramid_factor=1,
+                    pyramid_width=5,
                     print_progress=True,
                     draw=True,
                     save=True,
@@ -643,8 +677,24 @@ def Run_PSF_Fitting(hdu_path,
         If turned on the fitting will ignore medium bright stars.
     parallel : bool, optional, default True
         Whether to run drawing for medium bright stars in parallel.
+    fft_convolve : bool, optional, default False
+        Whether to draw medium bright stars by a single FFT convolution
+        of their point sources with the PSF, instead of one stamp per star.
+        Faster in fields crowded with medium bright stars.
+    stamp_cache : bool, optional, default False
+        Whether to reuse PSF stamps of medium bright stars drawn with
+        nearby PSF parameters and sub-pixel offsets (see modeling.StampCache).
+        If True, fft_convolve is not used. The hit rate is logged after the fitting.
+    joint_fit : bool, optional, default False
+        Whether to fit all regions at once with a shared PSF and
+        backgrounds of each region, using one sampler for the field.
+    profile : bool, optional, default False
+        Whether to record wall time and calls of stages in the likelihood
+        (summed over workers). The timings are logged after the fitting
+        and saved with the results.
     n_cpu : int, optional, default None
-        Number of cpu used for fitting and/or drawing.
+        Number of cpu used for fitting and/or drawing. If None, the fitting
+        uses # of CPU - 1 and the regions are prepared in serial.
     nlive_init : int, optional, default None
         Number of initial live points in dynesty. If None will
         use nlive_init = ndim*10.
@@ -652,6 +702,21 @@ def Run_PSF_Fitting(hdu_path,
         Samplimg method in dynesty. If 'auto', the method is 'unif' for ndim < 10,
         'rwalk' for 10 <= ndim <= 20, 'slice' for ndim > 20.
         'mle': Maximum likelhood evaluation using scipy.
+    warm_start : bool, optional, default False
+        Whether to narrow the prior of nested sampling around a MLE
+        pre-fit. The pre-fit and the narrowed prior are saved with
+        the results. Not used if sample_method='mle'.
+    warm_width : float, optional, default 5
+        Half width of the narrowed prior in units of the Hessian-based
+        uncertainty of the MLE pre-fit.
+    pyramid_factor : int, optional, default 1
+        If > 1, first fit on the regions block-averaged by pyramid_factor
+        (e.g. 2 or 4), then on the original image with the prior narrowed
+        by the coarse fitting (or starting from the coarse MLE if
+        sample_method='mle'). The warm start is not used if > 1.
+    pyramid_width : float, optional, default 5
+        Half width of the narrowed prior in units of the posterior width
+        of the coarse fitting.
     print_progress : bool, optional, default True
         Whether to turn on the progress bar of dynesty
     draw : bool, optional, default True
@@ -713,8 +778,8 @@ def Run_PSF_Fitting(hdu_path,
     from .utils import background_stats
     
     # Read quantities from header
-    header = fits.getheader(hdu_path)
-    data = fits.getdata(hdu_path)
+    frame = open_frame(hdu_path)
+    header, data = frame.header, frame.data
     
     if ZP is None: ZP = find_keyword_header(header, ZP_keyname)
     if G_eff is None:
@@ -734,7 +799,8 @@ def Run_PSF_Fitting(hdu_path,
     DF_Images = ImageList(hdu_path, bounds_list,
                           obj_name, band,
                           pixel_scale=pixel_scale,
-                          pad=pad, ZP=ZP, bkg=bkg, G_eff=G_eff)
+                          pad=pad, ZP=ZP, bkg=bkg, G_eff=G_eff,
+                          n_cpu=1 if n_cpu is None else n_cpu)
     
     # Read faint stars info and brightness measurement
     DF_Images.read_measurement_tables(dir_measure,
@@ -841,10 +907,15 @@ def Run_PSF_Fitting(hdu_path,
                             n_min=1.2, leg2d=leg2d,
                             parallel=parallel,
                             draw_real=draw_real,
+                            fft_convolve=fft_convolve,
                             fit_sigma=fit_sigma,
                             fit_frac=fit_frac,
                             brightest_only=brightest_only,
                             method=sample_method,
+                            joint=joint_fit,
+                            profile=profile,
+                            stamp_cache=stamp_cache,
+                            pyramid_factor=pyramid_factor,
                             verbose=True)
     
     ## (a stop for inspection/developer)
@@ -860,18 +931,41 @@ def Run_PSF_Fitting(hdu_path,
     
     samplers = []
     
+    if joint_fit:
+        # Run one fitting for all regions
+        ct = DF_Images.container_joint
+        ndim = ct.ndim
+        ct_coarse = getattr(DF_Images, 'container_joint_coarse', None)
+        
+        s_joint = Sampler(ct, n_cpu=n_cpu, sample_method=sample_method,
+                          warm_start=warm_start, warm_width=warm_width,
+                          container_coarse=ct_coarse, pyramid_width=pyramid_width)
+        
+        if nlive_init is None: nlive_init = ndim*10
+        s_joint.run_fitting(nlive_init=nlive_init,
+                            nlive_batch=5*ndim+5, maxbatch=2,
+                            print_progress=print_progress)
+        
+        samplers_joint = s_joint.split_regions()
+    
     for i, reg in enumerate(AsciiUpper(DF_Images.N_Image)):
 
         ct = DF_Images.containers[i]
         ndim = ct.ndim
-
-        s = Sampler(ct, n_cpu=n_cpu, sample_method=sample_method)
+        
+        if joint_fit:
+            s = samplers_joint[i]
+        else:
+            ct_coarse = DF_Images.containers_coarse[i] if pyramid_factor>1 else None
+            s = Sampler(ct, n_cpu=n_cpu, sample_method=sample_method,
+                        warm_start=warm_start, warm_width=warm_width,
+                        container_coarse=ct_coarse, pyramid_width=pyramid_width)
                                   
-        if nlive_init is None: nlive_init = ndim*10
-        # Run fitting
-        s.run_fitting(nlive_init=nlive_init,
-                      nlive_batch=5*ndim+5, maxbatch=2,
-                      print_progress=print_progress)
+            if nlive_init is None: nlive_init = ndim*10
+            # Run fitting
+            s.run_fitting(nlive_init=nlive_init,
+                          nlive_batch=5*ndim+5, maxbatch=2,
+                          print_progress=print_progress)
     
         if save:
             # Save outputs
@@ -895,6 +989,9 @@ def Run_PSF_Fitting(hdu_path,
             if brightest_only: suffix += 'b'
             if use_PS1_DR2: suffix += '_ps2'
             if sample_method=='mle': suffix+='_mle'
+            elif pyramid_factor>1: suffix+='_pyr%d'%pyramid_factor
+            elif warm_start: suffix+='_ws'
+            if joint_fit: suffix += '_joint'
             
             Xmin, Ymin, Xmax, Ymax = bounds_list[i]
             range_str = f'X[{Xmin}-{Xmax}]Y[{Ymin}-{Ymax}]'
@@ -1014,10 +1111,10 @@ class berry:
         self.obj_name = obj_name
         self.band = band
         
-        with fits.open(hdu_path) as hdul:
-            self.data = hdul[0].data
-            self.header = hdul[0].header
-            hdul.close()
+        # Full frame, memory-mapped and shared by the steps
+        self.frame = open_frame(hdu_path)
+        self.data = self.frame.data
+        self.header = self.frame.header
         
         self.work_dir = work_dir
         
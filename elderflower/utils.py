@@ -19,7 +19,7 @@ from astropy import units as u
 from astropy.io import fits, ascii
 from astropy.nddata import Cutout2D
 from astropy.coordinates import SkyCoord
-from astropy.table import Table, Column, setdiff, join
+from astropy.table import Table, Column, setdiff, join, hstack
 from astropy.stats import mad_std, biweight_location, gaussian_fwhm_to_sigma
 from astropy.stats import sigma_clip, SigmaClip, sigma_clipped_stats
 
@@ -35,7 +35,7 @@ except ImportError:
     galsim_installed = False
     
 from .io import logger
-from .io import save_pickle, load_pickle, check_save_path
+from .io import save_pickle, load_pickle, load_thumbnails, check_save_path
 from .numeric import log_linear, flattened_linear, piecewise_linear
 from .plotting import LogNorm, AsinhNorm, colorbar
 from . import DF_pixel_scale, DF_raw_pixel_scale
@@ -950,7 +950,33 @@ def downsample_segmentation(fn, fn_out, scale=0.5):
         
     else:
         pass
-    
+
+def block_downsample(image, factor, func=np.mean):
+    """
+    Downsample an image by reducing blocks of factor x factor pixels.
+    Rows / columns left at the upper edges are trimmed.
+
+    Parameters
+    ----------
+    image: 2d array
+        Input image (or mask).
+    factor: int
+        Size of the blocks.
+    func: callable, optional, default np.mean
+        Reduction over the block axes, e.g. np.any for masks
+        (a block is masked if any of its pixels is masked).
+
+    Returns
+    -------
+    image_ds: 2d array
+        Downsampled image of shape (nY//factor, nX//factor).
+
+    """
+    factor = int(factor)
+    nY, nX = np.shape(image)[0] // factor, np.shape(image)[1] // factor
+    blocks = np.asarray(image)[:nY*factor, :nX*factor].reshape(nY, factor, nX, factor)
+    return func(blocks, axis=(1, 3))
+
 def process_resampling(fn, bounds, obj_name, band,
                        pixel_scale=DF_pixel_scale, r_scale=12,
                        mag_limit=15, dir_measure='./', work_dir='./',
@@ -1100,8 +1126,9 @@ def merge_catalog(SE_catalog, table_merge, sep=5 * u.arcsec,
     cat_SE_match = SE_catalog[match]
     cat_tab_match = table_merge[idx[match]]
     
-    cat_tab_match.add_column(cat_SE_match["NUMBER"], index=0, name="NUMBER")
-    cat_match = join(cat_SE_match, cat_tab_match, keys='NUMBER')
+    # Rows are aligned by the match: stack them instead of joining by NUMBER
+    cat_match = hstack([cat_SE_match, cat_tab_match])
+    cat_match.sort('NUMBER')
     
     if keep_columns is not None:
         cat_match.keep_columns(keep_columns)
@@ -1331,10 +1358,10 @@ def fit_n0(dir_measure, bounds,
         mag_str = convert_decimal_string(mag_limit)
         range_str = f'X[{Xmin}-{Xmax}]Y[{Ymin}-{Ymax}]'
         
-        fn_res_thumb = os.path.join(dir_measure, f'{obj_name}-thumbnail_{b}mag{mag_str}_{range_str}.pkl')
+        fn_res_thumb = os.path.join(dir_measure, f'{obj_name}-thumbnail_{b}mag{mag_str}_{range_str}.thumb')
         fn_tab_norm = os.path.join(dir_measure, f'{obj_name}-norm_{r_scale}pix_{b}mag{mag_str}_{range_str}.txt')
         
-        res_thumb = load_pickle(fn_res_thumb)
+        res_thumb = load_thumbnails(fn_res_thumb)
         tab_norm = Table.read(fn_tab_norm, format='ascii')
 
         if draw:
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.table import Table
+
+from elderflower.catalog import CatalogCache
+
+
+def make_sky(seed=0):
+    """ Random sources around RA=0 near the equator and around the north pole """
+    rng = np.random.default_rng(seed)
+    ra = np.concatenate([rng.uniform(-2, 2, 3000) % 360, rng.uniform(0, 360, 3000)])
+    dec = np.concatenate([rng.uniform(-2, 2, 3000), rng.uniform(88, 90, 3000)])
+    return Table({'ID': np.arange(len(ra)), 'RAJ2000': ra, 'DEJ2000': dec})
+
+
+def in_cone(table, ra, dec, radius):
+    coords = SkyCoord(table['RAJ2000'], table['DEJ2000'], unit=u.deg)
+    return table[coords.separation(SkyCoord(ra, dec, unit=u.deg)).deg <= radius]
+
+
+class FakeService:
+    """ A cone search over a table, counting the queries """
+
+    def __init__(self, table):
+        self.table = table
+        self.n_call = 0
+
+    def __call__(self, ra, dec, radius):
+        self.n_call += 1
+        return in_cone(self.table, ra, dec, radius)
+
+
+def cached_files(cache_dir):
+    return [fn for _, _, fns in os.walk(cache_dir) for fn in fns]
+
+
+@pytest.mark.parametrize('ra, dec, radius', [(0.1, 0.3, 0.6),       # RA wrap-around
+                                             (359.7, -0.5, 0.4),
+                                             (123., 89.8, 0.5)])    # around the pole
+def test_query_rows(tmp_path, ra, dec, radius):
+    sky = make_sky()
+    fetch = FakeService(sky)
+    cache = CatalogCache(str(tmp_path))
+
+    expected = sorted(in_cone(sky, ra, dec, radius)['ID'])
+    assert len(expected) > 0
+    assert sorted(cache.query('test', fetch, ra, dec, radius)['ID']) == expected
+    n_call = fetch.n_call
+
+    # Served from the cached tiles
+    assert sorted(cache.query('test', fetch, ra, dec, radius)['ID']) == expected
+    assert fetch.n_call == n_call
+
+
+def test_offline_local_catalog_not_cached(tmp_path):
+    sky = make_sky()
+    ra, dec, radius = 0.1, 0.3, 0.6
+    expected = sorted(in_cone(sky, ra, dec, radius)['ID'])
+
+    # A local catalog only covering part of the cone
+    fn_local = str(tmp_path / 'local.ecsv')
+    local = sky[(sky['DEJ2000'] > 0) & (sky['DEJ2000'] < 2)]
+    local.write(fn_local, format='ascii.ecsv')
+
+    def fetch(*args):
+        raise AssertionError("No query in offline mode")
+
+    cache_dir = str(tmp_path / 'cache')
+    cache = CatalogCache(cache_dir, offline=True, local_catalog=fn_local)
+    rows = cache.query('test', fetch, ra, dec, radius)
+    assert sorted(rows['ID']) == sorted(in_cone(local, ra, dec, radius)['ID'])
+    assert cached_files(cache_dir) == []
+
+    # A later online run fetches the real tiles
+    fetch = FakeService(sky)
+    cache = CatalogCache(cache_dir)
+    assert sorted(cache.query('test', fetch, ra, dec, radius)['ID']) == expected
+    assert fetch.n_call > 0
+
+    # Offline runs then read the tiles of the service
+    cache = CatalogCache(cache_dir, offline=True, local_catalog=fn_local)
+    assert sorted(cache.query('test', None, ra, dec, radius)['ID']) == expected
+
+
+def test_offline_without_local_catalog(tmp_path):
+    cache = CatalogCache(str(tmp_path), offline=True)
+    with pytest.raises(FileNotFoundError):
+        cache.query('test', None, 10., 10., 0.1)
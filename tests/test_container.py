@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from elderflower.container import Container
+from elderflower.modeling import (Stars, StampCache,
+                                  generate_image_by_znorm, add_image_noise)
+from elderflower.utils import make_psf_2D, block_downsample
+
+
+def make_field(N=256, n_star=40, seed=1):
+    """ A field of faint, medium bright and very bright stars
+        with the cores of stars masked """
+    rng = np.random.default_rng(seed)
+    _, psf = make_psf_2D(n_s=[3.2, 2.5], theta_s=[5, 100], frac=0.3,
+                         beta=6., fwhm=6., psf_range=1200, pixel_scale=2.5,
+                         cutoff_param=dict(cutoff=True, n_c=4, theta_c=1200))
+    psf.generate_core()
+
+    star_pos = rng.uniform(0, N, size=(n_star, 2))
+    z_norm = 10**rng.uniform(0, 3, n_star)
+    stars = Stars.from_znorm(psf, star_pos, z_norm,
+                             z_threshold=np.array([10, 300]), r_scale=12)
+    stars.BKG = 100.
+
+    yy, xx = np.mgrid[:N, :N]
+    image = generate_image_by_znorm(psf, stars.copy(), xx, yy,
+                                    psf_range=[None, None], psf_scale=2.5,
+                                    max_psf_range=1200, subtract_external=True,
+                                    draw_real=True)
+    image = add_image_noise(image + 100., 1., random_seed=seed)
+
+    mask = rng.random((N, N)) < 0.05
+    for x0, y0 in star_pos:
+        mask |= (xx-x0)**2 + (yy-y0)**2 < 24**2
+    psf.theta_out = 1200
+
+    return image, mask, psf, stars
+
+
+def make_container(image, mask, psf, stars, noise_scale=1, draw_method=None):
+    container = Container(2, brightest_only=False, draw_real=True,
+                          fft_convolve=(draw_method == 'fft'),
+                          noise_scale=noise_scale)
+    container.fix_n0 = False
+    container.set_prior(n_est=3.2, mu_est=100., std_est=1.)
+    container.set_likelihood(image, mask, psf, stars,
+                             psf_range=[None, None], G_eff=1e5,
+                             stamp_cache=StampCache() if draw_method == 'cache' else None)
+    return container
+
+
+@pytest.mark.parametrize('draw_method', [None, 'fft', 'cache'])
+def test_coarse_likelihood_peaks_with_medium_bright_stars(draw_method, factor=2):
+    image, mask, psf, stars = make_field()
+    assert stars.n_medbright > 0
+    container = make_container(image, mask, psf, stars, draw_method=draw_method)
+
+    # Coarse level as set by ImageList.set_container(pyramid_factor=factor)
+    psf_c = psf.copy()
+    psf_c.pixelize(psf.pixel_scale * factor)
+    container_c = make_container(block_downsample(image, factor),
+                                 block_downsample(mask, factor, func=np.any),
+                                 psf_c, stars.downsample(factor),
+                                 noise_scale=1./factor, draw_method=draw_method)
+
+    # Scan each parameter of the PSF and the background in the unit cube
+    grid = np.linspace(0.05, 0.95, 19)
+    for i in range(container.ndim - 1):
+        u_peak = []
+        for ct in [container, container_c]:
+            loglike = []
+            for g in grid:
+                u = np.full(ct.ndim, 0.5)
+                u[i] = g
+                loglike.append(ct.loglikelihood(ct.prior_transform(u)))
+            u_peak.append(grid[np.argmax(loglike)])
+        assert abs(u_peak[0] - u_peak[1]) <= 0.1, container.labels[i]
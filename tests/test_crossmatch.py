@@ -0,0 +1,64 @@
+import numpy as np
+
+from elderflower.crossmatch import resolve_duplicates
+
+
+def drop_loop(idx_ref, scores, valid):
+    """ Duplicates dropped by a loop over reference objects (as before) """
+    drop = np.zeros(len(idx_ref), dtype=bool)
+    for i in np.unique(idx_ref):
+        rows = np.flatnonzero(idx_ref == i)
+        if len(rows) <= 1:
+            continue
+        rows = rows[valid[rows]]
+        if len(rows) == 0:
+            continue
+        score_min = np.nanmin(scores[rows])
+        drop[rows[scores[rows] > score_min]] = True
+    return drop
+
+
+def drop_ps1(idx_ref, sep, mag):
+    """ PS1 rule: the closest matches, then the brightest among them """
+    has_mag = ~np.isnan(mag)
+    drop = resolve_duplicates(idx_ref, sep, valid=has_mag)
+    drop |= resolve_duplicates(idx_ref, mag, valid=has_mag & ~drop)
+    return drop
+
+
+def test_multiple_duplicates():
+    # star 0: three entries, star 1: single, star 2: two entries
+    idx_ref = np.array([0, 0, 0, 1, 2, 2])
+    scores = np.array([0.3, 0.1, 0.2, 0.5, 0.4, 0.6])
+    drop = resolve_duplicates(idx_ref, scores)
+    assert drop.tolist() == [True, False, True, False, False, True]
+
+
+def test_duplicate_without_magnitude():
+    # the entry without magnitude is never dropped, nor used as the best
+    idx_ref = np.array([0, 0, 0])
+    sep = np.array([0.1, 0.5, 0.9])
+    mag = np.array([np.nan, 12., 11.])
+    drop = drop_ps1(idx_ref, sep, mag)
+    assert drop.tolist() == [False, False, True]
+
+
+def test_ps1_tie_in_separation():
+    # two entries at the same separation: the fainter one is dropped
+    idx_ref = np.array([0, 0, 0, 1, 1])
+    sep = np.array([0.2, 0.2, 0.5, 0.3, 0.3])
+    mag = np.array([12.5, 12., 11., 13., 13.])
+    drop = drop_ps1(idx_ref, sep, mag)
+    # star 1 ties in both separation and magnitude: both are kept
+    assert drop.tolist() == [True, False, True, False, False]
+
+
+def test_same_as_loop():
+    rng = np.random.default_rng(0)
+    idx_ref = np.sort(rng.integers(0, 200, 1000))
+    scores = np.round(rng.random(1000), 2)      # with ties
+    valid = rng.random(1000) > 0.1
+    scores[rng.random(1000) < 0.05] = np.nan
+
+    drop = resolve_duplicates(idx_ref, scores, valid=valid)
+    assert np.array_equal(drop, drop_loop(idx_ref, scores, valid))
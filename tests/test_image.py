@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from elderflower.image import ImageList
+from elderflower.mask import mask_param_default
+from elderflower.modeling import Stars
+from elderflower.utils import make_psf_2D
+
+
+@pytest.fixture(scope='module')
+def hdu_path(tmp_path_factory):
+    """ A 200x200 frame of noise and a few sources, with a TAN wcs """
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[:200, :200]
+    image = 100 + rng.normal(0, 1, (200, 200))
+    for x, y in rng.uniform(0, 200, (20, 2)):
+        image += 50 * np.exp(-((xx-x)**2 + (yy-y)**2) / 8)
+
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crval = [150., 2.]
+    wcs.wcs.crpix = [100, 100]
+    wcs.wcs.cdelt = [-2.5/3600, 2.5/3600]
+
+    filename = str(tmp_path_factory.mktemp('image') / 'frame.fits')
+    fits.writeto(filename, image.astype(np.float32), wcs.to_header())
+    return filename
+
+
+def make_stars():
+    """ One very bright, one medium bright and one faint star """
+    _, psf = make_psf_2D(n_s=[3.2, 2.5], theta_s=[5, 100], frac=0.3,
+                         beta=6., fwhm=6., psf_range=1200, pixel_scale=2.5)
+    star_pos = np.array([[50., 50.], [20., 70.], [80., 30.]])
+    return Stars.from_znorm(psf, star_pos, np.array([500., 50., 5.]),
+                            z_threshold=np.array([10, 300]), r_scale=12)
+
+
+@pytest.mark.parametrize('n_cpu', [1, 2])
+def test_make_mask(hdu_path, tmp_path, n_cpu):
+    bounds0_list = [[10, 10, 110, 110], [90, 90, 190, 190]]
+    DF_Images = ImageList(hdu_path, bounds0_list, pad=10,
+                          bkg=100., ZP=27., G_eff=1e5, n_cpu=n_cpu)
+    stars_list = [make_stars() for _ in bounds0_list]
+
+    DF_Images.make_mask(stars_list, str(tmp_path),
+                        mask_param=mask_param_default, draw=False)
+
+    assert len(DF_Images.Masks) == 2
+    for Img, mask, mask_fit in zip(DF_Images, DF_Images.Masks, DF_Images.mask_fit):
+        assert mask.Image is Img
+        assert mask_fit.shape == Img.image_shape
+        assert 0 < mask_fit.mean() < 1
+        # The core of the very bright star is masked
+        assert mask_fit[40, 40]
+    assert len(DF_Images.stars) == 2
@@ -0,0 +1,108 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from elderflower.io import (ThumbnailWriter, ThumbnailStore,
+                            save_pickle, load_thumbnails)
+
+
+def make_thumbnails(seed=0):
+    """ Thumbnails of mixed shapes and dtypes """
+    rng = np.random.default_rng(seed)
+    shapes = [(5, 7), (1, 1), (13, 13), (3, 10)]
+    dtypes = [(np.float32, np.float32), (np.float64, np.float32),
+              (np.float32, np.float64), (np.int16, np.float64)]
+    res_thumb = {}
+    for num, (shape, (dtype_image, dtype_bkg)) in zip([3, 11, 42, 7], zip(shapes, dtypes)):
+        image = (rng.random(shape) * 100).astype(dtype_image)
+        bkg = rng.random(shape).astype(dtype_bkg)
+        mask = rng.random(shape) > 0.5
+        res_thumb[num] = {'image': image, 'bkg': bkg, 'mask': mask,
+                          'center': rng.random(2) * 1000}
+    # scalar background, broadcasted to the image
+    res_thumb[99] = {'image': np.ones((4, 6)), 'bkg': 2.5,
+                     'mask': np.zeros((4, 6), dtype=bool), 'center': (1., 2.)}
+    return res_thumb
+
+
+def assert_same(thumb, thumb_ref):
+    image = thumb_ref['image']
+    bkg = np.broadcast_to(thumb_ref['bkg'], image.shape)
+    assert thumb['image'].dtype == image.dtype
+    assert np.array_equal(thumb['image'], image)
+    assert np.asarray(thumb['bkg']).dtype == bkg.dtype
+    assert np.array_equal(np.broadcast_to(thumb['bkg'], image.shape), bkg)
+    assert thumb['mask'].dtype == bool
+    assert np.array_equal(thumb['mask'], thumb_ref['mask'])
+    assert np.allclose(thumb['center'], thumb_ref['center'])
+
+
+def test_thumbnail_store_round_trip(tmp_path):
+    res_thumb = make_thumbnails()
+    filename = str(tmp_path / 'stars.thumb')
+
+    with ThumbnailWriter(filename) as writer:
+        for num, thumb in res_thumb.items():
+            writer[num] = thumb
+        assert len(writer) == len(res_thumb)
+
+    store = load_thumbnails(filename)
+    assert isinstance(store, ThumbnailStore)
+    assert list(store) == list(res_thumb)
+    for num, thumb in res_thumb.items():
+        assert_same(store[num], thumb)
+
+    # Pickled by filename and reopened
+    store = pickle.loads(pickle.dumps(store))
+    for num, thumb in res_thumb.items():
+        assert_same(store[num], thumb)
+
+    # Copy-on-write: changes are not written to the file
+    store[3]['image'][:] = 0
+    assert_same(ThumbnailStore(filename)[3], res_thumb[3])
+
+
+def test_load_thumbnails_pickle_fallback(tmp_path):
+    res_thumb = make_thumbnails()
+    filename = str(tmp_path / 'stars.thumb')
+    save_pickle(res_thumb, str(tmp_path / 'stars.pkl'))
+
+    # Thumbnails pickled by earlier versions are read instead
+    for fn in [filename, str(tmp_path / 'stars.pkl')]:
+        thumbs = load_thumbnails(fn)
+        assert isinstance(thumbs, dict)
+        for num, thumb in res_thumb.items():
+            assert_same(thumbs[num], thumb)
+
+    with pytest.raises(FileNotFoundError):
+        load_thumbnails(str(tmp_path / 'missing.thumb'))
+
+
+def test_not_a_thumbnail_store(tmp_path):
+    filename = str(tmp_path / 'stars.thumb')
+    save_pickle(make_thumbnails(), filename)
+    with pytest.raises(ValueError):
+        ThumbnailStore(filename)
+
+
+def test_open_frame_closes_older_versions(tmp_path):
+    from astropy.io import fits
+    from elderflower import io
+
+    filename = str(tmp_path / 'image.fits')
+    fits.writeto(filename, np.zeros((8, 10), dtype=np.float32))
+    frame = io.open_frame(filename)
+    assert io.open_frame(filename) is frame
+    assert frame.data.sum() == 0
+
+    # The file is modified: the older frame is closed and dropped
+    fits.writeto(filename, np.ones((8, 10), dtype=np.float32), overwrite=True)
+    os.utime(filename, (0, os.path.getmtime(filename) + 10))
+    frame_new = io.open_frame(filename)
+    assert frame_new is not frame
+    assert frame.hdul._file.closed
+    assert frame_new.data.sum() == 80
+    assert [f for f in io._frames.values() if f.hdu_path == filename] == [frame_new]
+    frame_new.close()
@@ -0,0 +1,70 @@
+import gc
+import os
+
+import numpy as np
+import pytest
+
+from elderflower import parallel
+from elderflower.sampler import Sampler, dynesty_installed
+
+
+class ToyContainer:
+    """ A container of a Gaussian likelihood carrying a large array,
+        which is shared with the workers (see parallel.SharedPickler) """
+
+    ndim = 2
+    labels = ['a', 'b']
+
+    def __init__(self, mu):
+        self.mu = np.asarray(mu)
+        self.image = np.zeros((2, 2))
+        self.data = np.ones(2 * parallel.SHARED_MIN_NBYTES // 8)
+
+    def prior_transform(self, u):
+        return 10 * u - 5
+
+    def loglikelihood(self, v):
+        return -0.5 * np.sum((v - self.mu)**2) * self.data[0]
+
+    def reset_timings(self):
+        pass
+
+    def timings(self):
+        return None
+
+    def stamp_cache_info(self):
+        return None
+
+
+def shm_blocks():
+    if not os.path.isdir('/dev/shm'):
+        return set()
+    return {fn for fn in os.listdir('/dev/shm') if fn.startswith('psm_')}
+
+
+@pytest.mark.skipif(not dynesty_installed, reason='dynesty is not installed')
+def test_two_fits_release_shared_memory():
+    blocks_before = shm_blocks()
+    shared_before = set(parallel._shared_blocks)
+    try:
+        for i, mu in enumerate([(1., -1.), (-2., 0.5)]):
+            sampler = Sampler(ToyContainer(mu), sample_method='unif',
+                              n_cpu=2, persistent_pool=True)
+            if i > 0:
+                # Workers of the open pool receive the state by shared memory
+                assert len(set(parallel._shared_blocks) - shared_before) > 0
+                assert len(shm_blocks() - blocks_before) > 0
+            sampler.run_fitting(nlive_init=50, nlive_batch=20, maxbatch=0,
+                                maxiter=500, print_progress=False)
+            assert sampler.pool.is_open
+            del sampler
+            gc.collect()
+
+            # The state is released after each fit, the workers are kept
+            pool = parallel.get_worker_pool(2)
+            assert pool.keys == []
+            assert pool.shared_refs == {}
+            assert set(parallel._shared_blocks) == shared_before
+            assert shm_blocks() == blocks_before
+    finally:
+        parallel.close_worker_pool()
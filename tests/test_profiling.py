@@ -0,0 +1,46 @@
+import os
+import time
+
+import multiprocess as mp
+
+from elderflower import profiling
+from elderflower.profiling import StageTimer, N_SLOT
+
+timer = StageTimer()
+
+
+def worker_slot(_):
+    time.sleep(0.05)    # keep all workers of the pool busy
+    return os.getpid(), profiling._worker_slot(N_SLOT)
+
+
+def record(_):
+    with timer.stage('loglike'):
+        pass
+
+
+def test_worker_slots_of_recreated_pools():
+    # More workers in total than rows: rows of dead workers are reused
+    for _ in range(N_SLOT):
+        with mp.get_context('fork').Pool(2) as pool:
+            slots = dict(pool.map(worker_slot, range(8)))
+            pool.close()
+            pool.join()
+        assert len(slots) == 2
+        rows = list(slots.values())
+        assert None not in rows
+        assert 0 not in rows
+        assert len(set(rows)) == len(rows)
+
+    assert profiling._worker_slot(N_SLOT) == 0
+
+
+def test_timer_over_recreated_pools():
+    timer.reset()
+    for _ in range(5):
+        with mp.get_context('fork').Pool(2) as pool:
+            pool.map(record, range(20))
+            pool.close()
+            pool.join()
+    record(None)
+    assert timer.summary()['loglike']['ncall'] == 101
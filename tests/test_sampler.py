@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from elderflower.sampler import Sampler, dynesty_installed
+
+
+class ToyContainer:
+    """ A container of a Gaussian likelihood whose gradient overflows
+        near the edges of the prior (|v| > 4.5) """
+
+    ndim = 2
+    labels = ['a', 'b']
+
+    def __init__(self, mu, sigma=1.):
+        self.mu = np.asarray(mu)
+        self.sigma = sigma
+        self.image = np.zeros((2, 2))
+
+    def prior_transform(self, u):
+        return 10 * u - 5
+
+    def loglikelihood(self, v):
+        return -0.5 * np.sum((v - self.mu)**2) / self.sigma**2
+
+    def loglike_grad(self, v):
+        grad = -(v - self.mu) / self.sigma**2
+        if np.any(abs(v) > 4.5):
+            grad = np.full(self.ndim, np.inf)
+        return self.loglikelihood(v), grad
+
+
+@pytest.mark.skipif(not dynesty_installed, reason='dynesty is not installed')
+def test_warm_start_rejects_non_finite_gradient():
+    # The first step of the pre-fit goes to a corner of the prior,
+    # which is better than the start but has no finite gradient
+    container = ToyContainer([3., -3.])
+    sampler = Sampler(container, n_cpu=1, warm_start=True, warm_width=5.)
+    info = sampler.warm_start_info
+
+    assert np.allclose(info['param_mle'], container.mu, atol=1e-3)
+    assert not np.any(info['at_edge'])
+    # sigma = 1 in the params, i.e. 0.1 in the unit cube
+    assert np.allclose(info['sigma_u'], 0.1, rtol=1e-2)
+    assert np.all(info['lower'] < container.mu) & np.all(container.mu < info['upper'])
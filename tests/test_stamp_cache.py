@@ -0,0 +1,21 @@
+import multiprocess as mp
+
+from elderflower.modeling import StampCache
+
+cache = StampCache(n_slot=4)
+
+
+def count_hit(_):
+    cache._counter()[0] += 1
+
+
+def test_counters_summed_over_workers():
+    cache.clear()
+    cache._counter()[1] += 1
+
+    with mp.get_context('fork').Pool(2) as pool:
+        pool.map(count_hit, range(6))
+
+    assert cache.hits == 6
+    assert cache.misses == 1
+    assert cache.hit_rate == 6 / 7